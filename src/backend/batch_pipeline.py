@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+"""
+Cross-video stage pipelining for batch runs.
+
+Run one video at a time and, while Whisper transcribes video N, the decoder
+and EfficientNet sit idle (and the other way round). A StagePipeline runs
+each stage on its own thread(s), connected by bounded queues, so video N+1
+is decoded and embedded while video N is transcribed. The queues bound how
+many decoded videos are held in memory at once.
+
+After a run, report() prints per-stage utilization (busy time over wall
+time), how long each stage was starved (waiting on its input queue) or
+blocked (waiting for room downstream), and the mean / max occupancy of each
+queue. The busiest stage with the fullest input queue is the bottleneck.
+
+The stages themselves are defined by the caller (see
+ensemble_model.run_pipelined); this module only moves items between them.
+"""
+import queue
+import threading
+import time
+
+SAMPLE_INTERVAL_S = 0.1  # queue occupancy sampling period
+_DONE = object()         # end-of-stream marker passed down the queues
+
+
+class BatchItem:
+    """One video moving through the pipeline; stages attach what they produce."""
+
+    def __init__(self, path):
+        self.path = path
+        self.error = None
+        self.result = None
+
+
+class Stage:
+    def __init__(self, name, fn, workers=1):
+        self.name = name
+        self.fn = fn          # fn(item); skipped for items that already failed
+        self.workers = workers
+        self.items = 0
+        self.busy_s = 0.0
+        self.starved_s = 0.0
+        self.blocked_s = 0.0
+        self._lock = threading.Lock()
+
+    def _add(self, busy, starved, blocked, items=0):
+        with self._lock:
+            self.busy_s += busy
+            self.starved_s += starved
+            self.blocked_s += blocked
+            self.items += items
+
+
+class _QueueStats:
+    def __init__(self, name, q, capacity):
+        self.name = name
+        self.q = q
+        self.capacity = capacity
+        self.samples = 0
+        self.total = 0
+        self.max = 0
+        self.full = 0
+
+    def sample(self):
+        size = self.q.qsize()
+        self.samples += 1
+        self.total += size
+        self.max = max(self.max, size)
+        if size >= self.capacity:
+            self.full += 1
+
+
+class StagePipeline:
+    def __init__(self, stages, queue_size=1):
+        self.stages = stages
+        self.queue_size = queue_size
+        self.wall_s = 0.0
+        self._queues = []
+        self._queue_stats = []
+
+    def run(self, items):
+        """Push items through every stage; yields them as they leave the last one."""
+        self._queues = [queue.Queue(maxsize=self.queue_size) for _ in self.stages]
+        out_q = queue.Queue()
+        self._queue_stats = queue_stats = [_QueueStats(f"→ {s.name}", q, self.queue_size)
+                                           for s, q in zip(self.stages, self._queues)]
+
+        threads = []
+        for i, stage in enumerate(self.stages):
+            in_q = self._queues[i]
+            next_q = self._queues[i + 1] if i + 1 < len(self.stages) else out_q
+            next_workers = self.stages[i + 1].workers if i + 1 < len(self.stages) else 1
+            remaining = [stage.workers]
+            for _ in range(stage.workers):
+                t = threading.Thread(target=self._worker,
+                                     args=(stage, in_q, next_q, next_workers, remaining),
+                                     name=f"stage-{stage.name}", daemon=True)
+                threads.append(t)
+
+        stop_sampling = threading.Event()
+
+        def sampler():
+            while not stop_sampling.wait(SAMPLE_INTERVAL_S):
+                for qs in queue_stats:
+                    qs.sample()
+
+        def feeder():
+            for item in items:
+                self._queues[0].put(item)
+            for _ in range(self.stages[0].workers):
+                self._queues[0].put(_DONE)
+
+        start = time.perf_counter()
+        sampler_thread = threading.Thread(target=sampler, daemon=True)
+        feeder_thread = threading.Thread(target=feeder, daemon=True)
+        for t in threads + [sampler_thread, feeder_thread]:
+            t.start()
+        try:
+            while True:
+                item = out_q.get()
+                if item is _DONE:
+                    break
+                yield item
+        finally:
+            self.wall_s = time.perf_counter() - start
+            stop_sampling.set()
+            sampler_thread.join()
+
+    def _worker(self, stage, in_q, next_q, next_workers, remaining):
+        while True:
+            t0 = time.perf_counter()
+            item = in_q.get()
+            t1 = time.perf_counter()
+            if item is _DONE:
+                stage._add(0.0, t1 - t0, 0.0)
+                with stage._lock:
+                    remaining[0] -= 1
+                    last = remaining[0] == 0
+                if last:
+                    # The last worker of a stage ends the stream for the next one
+                    for _ in range(next_workers):
+                        next_q.put(_DONE)
+                return
+            if item.error is None:
+                try:
+                    stage.fn(item)
+                except Exception as e:
+                    item.error = f"{stage.name}: {type(e).__name__}: {e}"
+            t2 = time.perf_counter()
+            next_q.put(item)
+            t3 = time.perf_counter()
+            stage._add(t2 - t1, t1 - t0, t3 - t2, items=1)
+
+    def report(self):
+        wall = max(self.wall_s, 1e-9)
+        print(f"\nPipeline: {wall:.1f}s wall, queue size {self.queue_size}")
+        print(f"{'stage':<14}{'items':>6}{'busy s':>9}{'util':>7}{'starved':>9}{'blocked':>9}")
+        for s in self.stages:
+            capacity = wall * s.workers
+            print(f"{s.name:<14}{s.items:>6}{s.busy_s:>9.1f}{s.busy_s / capacity:>7.0%}"
+                  f"{s.starved_s / capacity:>9.0%}{s.blocked_s / capacity:>9.0%}")
+        print(f"{'queue':<14}{'mean':>6}{'max':>6}{'full':>7}")
+        for qs in self._queue_stats:
+            mean = qs.total / qs.samples if qs.samples else 0.0
+            full = qs.full / qs.samples if qs.samples else 0.0
+            print(f"{qs.name:<14}{mean:>6.2f}{qs.max:>6}{full:>7.0%}")
+        bottleneck = max(self.stages, key=lambda s: s.busy_s / s.workers)
+        print(f"Bottleneck: {bottleneck.name}")
@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+"""
+Cooperative cancellation of predictions nobody is waiting for any more.
+
+Closing the Electron window or clearing its queue used to leave /predict
+running to completion, which can be minutes of Whisper large-v3 for a result
+nobody reads. Each request now carries a CancelToken. The pipeline checks it
+before every branch, between frame batches, between Whisper segments and
+while waiting for a scheduler slot or the classifier subprocess, and raises
+Cancelled, which unwinds through the normal context managers so threads,
+slots and buffers are released as the exception propagates.
+
+Tokens are reference counted: requests coalesced onto one computation (see
+single_flight.py) each hold a reference, and the work stops only when every
+one of them has been cancelled. Code paths without cancellation get
+NULL_TOKEN, whose check() does nothing.
+"""
+import threading
+import time
+
+CANCELLED_STATUS = 499  # HTTP status of a cancelled request (nginx: client closed request)
+
+
+class Cancelled(Exception):
+    """Raised at a checkpoint once the work's token has been cancelled."""
+
+
+class CancelToken:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._event = threading.Event()
+        self._holders = 1
+        self.reason = None
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def retain(self) -> bool:
+        """Another request now depends on this work; False if it was already cancelled."""
+        with self._lock:
+            if self._event.is_set():
+                return False
+            self._holders += 1
+            return True
+
+    def cancel(self, reason: str = "cancelled") -> bool:
+        """Drop one holder; returns True if that stopped the work."""
+        with self._lock:
+            if self._event.is_set():
+                return False
+            self._holders -= 1
+            if self._holders > 0:
+                return False
+            self.reason = reason
+            self._event.set()
+            return True
+
+    def check(self):
+        if self._event.is_set():
+            raise Cancelled(self.reason)
+
+
+class _NullToken:
+    cancelled = False
+    reason = None
+
+    def check(self):
+        pass
+
+
+NULL_TOKEN = _NullToken()
+
+
+CANCEL_POLL_S = 0.5  # how often a worker picks up cancels sent through the board
+
+
+class JobRegistry:
+    """
+    Running /predict jobs by id, for DELETE /jobs/{id} and the stats endpoint.
+
+    With a WorkerBoard (see worker_board.py) job ids are unique across
+    serve.py's workers, GET /jobs lists every worker's jobs, and a cancel for
+    a job in another worker is forwarded to it.
+    """
+
+    def __init__(self, board=None):
+        self._lock = threading.Lock()
+        self._jobs = {}
+        self.board = board
+        self._watcher = None
+        self.cancel_requests = 0
+        self.cancelled = 0
+        self.reclaimed_s = 0.0
+
+    def start(self, job_id: str, token, filepath: str):
+        with self._lock:
+            if job_id in self._jobs:
+                raise ValueError(f"Job {job_id} is already running")
+            if self.board is not None:
+                self.board.add_job(job_id, filepath)
+                self._watch()
+            self._jobs[job_id] = {"token": token, "shared": None, "filepath": filepath,
+                                  "started": time.time(), "cancelling": False}
+
+    def attach(self, job_id: str, token):
+        """Record the token of the computation a coalesced job joined."""
+        with self._lock:
+            if job_id in self._jobs:
+                self._jobs[job_id]["shared"] = token
+
+    def _watch(self):
+        # Started lazily by the first job, so never in serve.py's parent before fork
+        if self._watcher is None:
+            self._watcher = threading.Thread(target=self._forwarded_cancels, daemon=True,
+                                             name="job-cancel-watcher")
+            self._watcher.start()
+
+    def _forwarded_cancels(self):
+        while True:
+            time.sleep(CANCEL_POLL_S)
+            try:
+                requests = self.board.cancel_requests()
+            except Exception as e:
+                print(f"[jobs] Could not read forwarded cancels: {e}")
+                continue
+            for job_id, reason in requests:
+                self.cancel(job_id, reason, forward=False)
+
+    def cancel(self, job_id: str, reason: str = "cancelled", forward: bool = True):
+        """Cancel a running job; None if unknown or already finished."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None and forward and self.board is not None:
+                forwarded = self.board.request_cancel(job_id, reason)
+                if forwarded is not None:
+                    self.cancel_requests += 1
+                    forwarded["stopping"] = None  # decided by the worker running it
+                return forwarded
+            if job is None or job["cancelling"]:
+                return None
+            job["cancelling"] = True
+            self.cancel_requests += 1
+        # The job's own token ends its wait; the shared one drops its hold
+        # on a computation it joined, which stops once nobody holds it
+        stopped = job["token"].cancel(reason)
+        if job["shared"] is not None:
+            stopped = job["shared"].cancel(reason)
+        return {"job_id": job_id, "filepath": job["filepath"], "stopping": stopped}
+
+    def finish(self, job_id: str, cancelled: bool = False):
+        with self._lock:
+            if self._jobs.pop(job_id, None) is not None and self.board is not None:
+                self.board.remove_job(job_id)
+            if cancelled:
+                self.cancelled += 1
+
+    def record_reclaimed(self, seconds: float):
+        """Estimated CPU seconds the pipeline did not spend because it stopped early."""
+        with self._lock:
+            self.reclaimed_s += max(0.0, seconds)
+
+    def running(self) -> list:
+        now = time.time()
+        if self.board is not None:
+            return [{"job_id": j["job_id"], "filepath": j["filepath"], "worker": j["pid"],
+                     "elapsed_s": now - j["started"], "cancelling": j["cancel_reason"] is not None}
+                    for j in self.board.jobs()]
+        with self._lock:
+            return [{"job_id": job_id, "filepath": j["filepath"],
+                     "elapsed_s": now - j["started"], "cancelling": j["cancelling"]}
+                    for job_id, j in self._jobs.items()]
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "running": len(self._jobs),
+                "cancel_requests": self.cancel_requests,
+                "cancelled": self.cancelled,
+                "reclaimed_s": self.reclaimed_s,
+            }
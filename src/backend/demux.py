@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+"""
+Single-pass demux: one read of a video file for every branch.
+
+The image-similarity branch, the ImageBind branch and Whisper used to open
+the file separately (OpenCV twice, PyAV once), which triples the I/O on
+network-mounted evidence shares. demux_video reads the container once with
+PyAV, resamples the audio to the 16 kHz mono float32 buffer Whisper expects
+and keeps the same evenly spaced frames extract_frames() would have picked.
+
+Video frames between the sampled ones still have to be decoded (inter-frame
+codecs need them) but are never converted to RGB.
+"""
+import os
+from collections import Counter
+
+import av
+import numpy as np
+
+SAMPLE_RATE = 16000
+FRAMES_PER_VIDEO = 400
+
+
+class DemuxedVideo:
+    """Decoded contents of one video file."""
+
+    def __init__(self, path, frames, audio, duration_s, fps, width, height, total_frames):
+        self.path = path
+        self.frames = frames          # list of HxWx3 uint8 RGB arrays
+        self.audio = audio            # float32 mono PCM at SAMPLE_RATE
+        self.duration_s = duration_s
+        self.fps = fps
+        self.width = width
+        self.height = height
+        self.total_frames = total_frames
+
+    @property
+    def audio_s(self):
+        return self.audio.size / SAMPLE_RATE
+
+
+def sample_indices(total_frames: int, num_frames: int = FRAMES_PER_VIDEO) -> np.ndarray:
+    """Frame indices extract_frames() samples, so both paths see the same frames."""
+    if total_frames <= 0:
+        total_frames = num_frames
+    return np.linspace(0, total_frames - 1, num_frames, dtype=int)
+
+
+def _total_frames(stream, duration_s):
+    if stream.frames:
+        return int(stream.frames)
+    rate = float(stream.average_rate or 0)
+    return int(round(duration_s * rate)) if rate and duration_s else 0
+
+
+def probe_video(video_path: str) -> dict:
+    """Duration and resolution from container metadata, without decoding."""
+    container = av.open(video_path)
+    try:
+        duration_s = container.duration / av.time_base if container.duration else 0.0
+        info = {"duration_s": duration_s, "width": 0, "height": 0, "fps": 0.0}
+        if container.streams.video:
+            stream = container.streams.video[0]
+            info["width"] = stream.codec_context.width
+            info["height"] = stream.codec_context.height
+            info["fps"] = float(stream.average_rate or 0)
+            if not duration_s and stream.duration and stream.time_base:
+                info["duration_s"] = float(stream.duration * stream.time_base)
+        return info
+    finally:
+        container.close()
+
+
+def demux_video(video_path: str, num_frames: int = FRAMES_PER_VIDEO,
+                with_audio: bool = True, threads: int = 0) -> DemuxedVideo:
+    """
+    Decode sampled RGB frames and 16 kHz mono audio in one pass over the file.
+
+    threads: video decoder threads (0 lets FFmpeg use every core).
+    """
+    container = av.open(video_path)
+    try:
+        vstream = container.streams.video[0] if container.streams.video else None
+        astream = container.streams.audio[0] if (with_audio and container.streams.audio) else None
+        duration_s = container.duration / av.time_base if container.duration else 0.0
+
+        wanted = Counter()
+        last_wanted = -1
+        fps = width = height = 0
+        total = 0
+        if vstream is not None:
+            vstream.thread_type = 'AUTO'
+            if threads:
+                vstream.codec_context.thread_count = threads
+            fps = float(vstream.average_rate or 0)
+            width, height = vstream.codec_context.width, vstream.codec_context.height
+            total = _total_frames(vstream, duration_s)
+            wanted = Counter(sample_indices(total, num_frames).tolist())
+            last_wanted = max(wanted) if wanted else -1
+
+        resampler = av.AudioResampler(format='s16', layout='mono', rate=SAMPLE_RATE) if astream else None
+        audio_chunks = []
+        frames = []
+        frame_idx = 0
+
+        streams = [s for s in (vstream, astream) if s is not None]
+        for packet in container.demux(*streams):
+            if packet.stream is vstream and frame_idx > last_wanted:
+                continue  # past the last sampled frame; only audio still matters
+            try:
+                decoded = packet.decode()
+            except av.error.InvalidDataError:
+                continue
+            for frame in decoded:
+                if packet.stream is astream:
+                    for resampled in resampler.resample(frame):
+                        audio_chunks.append(resampled.to_ndarray().reshape(-1))
+                else:
+                    repeats = wanted.get(frame_idx, 0)
+                    if repeats:
+                        rgb = frame.to_ndarray(format='rgb24')
+                        frames.extend([rgb] * repeats)
+                    frame_idx += 1
+        if resampler is not None:
+            for resampled in resampler.resample(None):
+                audio_chunks.append(resampled.to_ndarray().reshape(-1))
+    finally:
+        container.close()
+
+    if audio_chunks:
+        audio = np.concatenate(audio_chunks).astype(np.float32) / 32768.0
+    else:
+        audio = np.zeros(0, dtype=np.float32)
+    if not duration_s:
+        duration_s = audio.size / SAMPLE_RATE or (total / fps if fps else 0.0)
+    print(f"[{os.path.basename(video_path)}] Demuxed {len(frames)} frames, "
+          f"{audio.size / SAMPLE_RATE:.1f}s audio in one pass")
+    return DemuxedVideo(video_path, frames, audio, duration_s, fps, width, height, total)
@@ -19,7 +19,20 @@ import h5py
 import numpy as np
 
 from test_image_similarity_model import extract_video_feature, cosine_similarity
-from fast_whisper_transcriber import FasterWhisperTranscriber
+from fast_whisper_transcriber import get_transcriber
+from demux import demux_video, FRAMES_PER_VIDEO
+from planner import cost_model
+from profiling import NULL_PROFILER, make_profiler
+from speech_gate import detect_speech, whisper_costs, MIN_SPEECH_S
+from video_fingerprint import (
+    FingerprintIndex, compute_fingerprint, fingerprint_mode, DUPLICATE_SIM_THRESH
+)
+from single_flight import transcript_flight, file_identity
+from cancellation import NULL_TOKEN, Cancelled, CancelToken
+from model_bundle import bundled_path
+from job_ledger import open_ledger, run_worker, LEASE_S
+from batch_pipeline import StagePipeline, Stage, BatchItem
+from scheduler import ResourceScheduler
 
 # ————————————————————————————————————————————————————————————
 # THRESHOLDS
@@ -32,12 +45,20 @@ TR_HIGH_THRESH = 0.95    # >= this → HIGH-confidence Traffic Stop
 TR_LOW_THRESH  = 0.90    # >= this → MEDIUM-confidence Traffic Stop
 #————————————————————————————————————————————————————————————
 
+# Results are only reused between videos classified the same way (see
+# video_fingerprint.fingerprint_mode for the rest of the configuration)
+FINGERPRINT_MODE = 'basic'
+
+# How often the classifier subprocess is polled for cancellation
+SUBPROCESS_POLL_S = 0.5
+
 def load_image_similarity_prototype(h5_path):
     with h5py.File(h5_path, 'r') as f:
         return f['model_vector'][:]
 
 
-def predict_traffic_from_transformer(model_path, transcript_text):
+def predict_traffic_from_transformer(model_path, transcript_text, num_threads=None,
+                                     cancel=NULL_TOKEN):
     tf = tempfile.NamedTemporaryFile(suffix='.txt', delete=False, mode='w', encoding='utf-8')
     tf.write(transcript_text)
     tf.close()
@@ -45,9 +66,16 @@ def predict_traffic_from_transformer(model_path, transcript_text):
     cmd = ['python', 'src/text_transformer/evaluate.py', model_path, tf.name]
     print("Running:", cmd)
     print("Temp file exists? ", os.path.exists(tf.name), tf.name)
+    env = None
+    if num_threads:
+        # Keep the classifier subprocess inside its share of the CPU budget
+        env = dict(os.environ, OMP_NUM_THREADS=str(num_threads), MKL_NUM_THREADS=str(num_threads))
     try:
-        out = subprocess.check_output(cmd, stderr=subprocess.STDOUT)
+        out = _run_cancellable(cmd, env, cancel)
         print(out.decode())
+    except Cancelled:
+        os.unlink(tf.name)
+        raise
     except subprocess.CalledProcessError as e:
         print("=== Transformer script failed, skipping transformer branch ===")
         print(e.output.decode())
@@ -61,35 +89,25 @@ def predict_traffic_from_transformer(model_path, transcript_text):
     return m.group(2), float(m.group(1))
 
 
-def classify_video(
-    vid_path, img_proto,
-    whisper_model_name, whisper_device, whisper_compute,
-    transformer_ckpt
-):
-    basename = os.path.basename(vid_path)
-
-    # 1) image-similarity score
-    start_img = time.perf_counter()
-    feat_img = extract_video_feature(vid_path)
-    s_img    = cosine_similarity(feat_img, img_proto)
-    time_img = time.perf_counter() - start_img
-    print(f"[{basename}] Image-Similarity time: {time_img:.2f}s, score: {s_img:.3f}")
+def _run_cancellable(cmd, env, cancel):
+    """subprocess.check_output that kills the child once cancel is set."""
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, env=env)
+    while True:
+        try:
+            out, _ = proc.communicate(timeout=SUBPROCESS_POLL_S)
+            break
+        except subprocess.TimeoutExpired:
+            if cancel.cancelled:
+                proc.kill()
+                proc.communicate()
+                cancel.check()
+    if proc.returncode:
+        raise subprocess.CalledProcessError(proc.returncode, cmd, output=out)
+    return out
 
-    # 2) transcript → traffic-stop prob
-    start_whisper = time.perf_counter()
-    transcriber = FasterWhisperTranscriber(
-        model_name=whisper_model_name,
-        device=whisper_device,
-        compute_type=whisper_compute
-    )
-    result     = transcriber.transcribe_file(vid_path)
-    text       = result['text']
-    label_tr, conf_tr = predict_traffic_from_transformer(transformer_ckpt, text)
-    time_whisper = time.perf_counter() - start_whisper
-    print(f"[{basename}] Whisper time: {time_whisper:.2f}s, traffic label: {label_tr} ({conf_tr:.3f})")
 
-    # 3) fusion logic
-    s_car = s_img  # image similarity only
+def fuse_scores(s_car, label_tr, conf_tr):
+    """Decision-tree fusion of the visual car-check score and the transcript label."""
     is_traffic = (label_tr == 'traffic_pedestrian')
 
     if s_car < CAR_LOW_THRESH:
@@ -117,17 +135,319 @@ def classify_video(
         return "Other/Unsure", s_car
 
 
+class VideoRun:
+    """
+    One video's state as it moves through the classify_video stages.
+
+    ensemble_model_full subclasses it to add the ImageBind score; kind names
+    the classifier in the fingerprint mode so the two never share results.
+    """
+    kind = FINGERPRINT_MODE
+
+    def __init__(self, vid_path, whisper_model_name, num_frames=FRAMES_PER_VIDEO, beam_size=None,
+                 cancel=NULL_TOKEN, profiler=NULL_PROFILER):
+        self.path = vid_path
+        self.basename = os.path.basename(vid_path)
+        self.num_frames = num_frames
+        self.beam_size = beam_size
+        self.cancel = cancel
+        self.profiler = profiler
+        self.mode = fingerprint_mode(self.kind, num_frames, whisper_model_name, beam_size)
+        self.frames = None        # sampled RGB frames, dropped once embedded
+        self.audio = None         # 16 kHz mono audio, dropped once transcribed
+        self.fingerprint = None
+        self.s_img = None
+        self.transcript = None    # (label_tr, conf_tr)
+        self.result = None        # (label, score), fused or reused from a duplicate
+
+    def car_score(self):
+        """Visual car-check score fed to the fusion."""
+        return self.s_img  # image similarity only
+
+
+# ————————————————————————————————————————————————————————————
+# STAGES: classify_video (here and in ensemble_model_full) runs them in
+# order for one video; run_pipelined runs them on different videos at once
+#————————————————————————————————————————————————————————————
+
+def demux_stage(run, threads=0):
+    """Read the file once for every branch; on failure each branch reads it itself."""
+    run.cancel.check()
+    with run.profiler.stage('demux'):
+        try:
+            start = time.perf_counter()
+            demuxed = demux_video(run.path, run.num_frames, threads=threads)
+            run.frames, run.audio = demuxed.frames, demuxed.audio
+            megapixels = demuxed.width * demuxed.height / 1e6
+            cost_model.observe('decode', demuxed.duration_s * megapixels, time.perf_counter() - start)
+        except Exception as e:
+            print(f"[{run.basename}] Single-pass demux failed, reading per branch: {e}")
+
+
+def duplicate_stage(run, fingerprint_index, reuse_duplicates=True):
+    """Near-duplicate check; sets run.result when an earlier result is reused."""
+    if fingerprint_index is None:
+        return
+    run.cancel.check()
+    with run.profiler.stage('fingerprint'):
+        run.fingerprint = compute_fingerprint(run.path, frames=run.frames, audio=run.audio,
+                                              sampled=run.num_frames)
+    match = fingerprint_index.lookup(run.fingerprint, run.mode)
+    if match is None:
+        return
+    sim, entry = match
+    if reuse_duplicates:
+        fingerprint_index.record_skip()
+        print(f"[{run.basename}] Near-duplicate of {os.path.basename(entry['path'])} "
+              f"(similarity {sim:.3f}), reusing result")
+        run.result = (entry['label'], entry['score'])
+        run.frames = run.audio = None
+    else:
+        fingerprint_index.record_flag()
+        print(f"[{run.basename}] Near-duplicate of {os.path.basename(entry['path'])} "
+              f"(similarity {sim:.3f}), classifying anyway")
+
+
+def vision_stage(run, img_proto, release=True):
+    """Image-similarity score of the sampled frames; release drops them afterwards."""
+    start_img = time.perf_counter()
+    dedupe_stats = {}
+    run.cancel.check()
+    with run.profiler.stage('image'):
+        feat_img = extract_video_feature(run.path, stats=dedupe_stats, frames=run.frames,
+                                         num_frames=run.num_frames, cancel=run.cancel)
+    run.s_img = cosine_similarity(feat_img, img_proto)
+    time_img = time.perf_counter() - start_img
+    if run.frames is not None:
+        cost_model.observe('image', dedupe_stats.get('forward_passes', 0), time_img)
+    if release:
+        run.frames = None
+    print(f"[{run.basename}] Image-Similarity time: {time_img:.2f}s, score: {run.s_img:.3f}, "
+          f"{dedupe_stats.get('forward_passes', 0)}/{dedupe_stats.get('frames', 0)} frames embedded")
+
+
+def transcript_stage(run, whisper_model_name, whisper_device, whisper_compute, transformer_ckpt,
+                     stage_threads=None, min_speech_s=MIN_SPEECH_S):
+    """Speech gate, then Whisper and the text classifier → run.transcript."""
+    stage_threads = stage_threads or {}
+    cancel, profiler, basename = run.cancel, run.profiler, run.basename
+    audio, run.audio = run.audio, None
+    start_whisper = time.perf_counter()
+    speech = None
+    if min_speech_s > 0:
+        cancel.check()
+        with profiler.stage('speech_gate'):
+            speech = detect_speech(run.path, min_speech_s, audio=audio)
+    if speech is not None and not speech['has_speech']:
+        label_tr, conf_tr = 'other', 0.0
+        saved = whisper_costs.record_skip(speech['duration_s'], speech['elapsed_s'])
+        print(f"[{basename}] Speech gate: {speech['speech_s']:.1f}s speech "
+              f"({speech['coverage']:.1%} of {speech['duration_s']:.0f}s), "
+              f"skipping Whisper + transformer, ~{saved:.1f}s saved")
+    else:
+        if speech is not None:
+            print(f"[{basename}] Speech gate: {speech['speech_s']:.1f}s speech "
+                  f"({speech['coverage']:.1%}), transcribing")
+        def transcribe_and_classify():
+            cancel.check()
+            with profiler.stage('whisper'):
+                transcriber = get_transcriber(
+                    model_name=whisper_model_name,
+                    device=whisper_device,
+                    compute_type=whisper_compute,
+                    cpu_threads=stage_threads.get('whisper', 0),
+                    num_workers=stage_threads.get('whisper_workers', 1),
+                    chunk_workers=stage_threads.get('whisper_chunk_workers', 1)
+                )
+                has_audio  = audio is not None and audio.size > 0
+                start_asr  = time.perf_counter()
+                result     = transcriber.transcribe_file(
+                    audio if has_audio else run.path, name=basename, beam_size=run.beam_size,
+                    cancel=cancel
+                )
+                text       = result['text']
+                if has_audio:
+                    cost_model.observe_whisper(whisper_model_name, run.beam_size or transcriber.beam_size,
+                                               audio.size / 16000, time.perf_counter() - start_asr)
+            cancel.check()
+            with profiler.stage('transformer'):
+                start_tr = time.perf_counter()
+                label_tr, conf_tr = predict_traffic_from_transformer(
+                    transformer_ckpt, text, num_threads=stage_threads.get('transformer'),
+                    cancel=cancel
+                )
+                cost_model.observe('transformer', 1, time.perf_counter() - start_tr)
+            return label_tr, conf_tr
+
+        # Concurrent requests for the same clip and Whisper config share one run
+        text_key = (file_identity(run.path), whisper_model_name, run.beam_size, transformer_ckpt)
+        (label_tr, conf_tr), shared = transcript_flight.do(text_key, transcribe_and_classify,
+                                                            cancel=cancel)
+        if shared:
+            print(f"[{basename}] Shared the transcript of a concurrent request for this clip")
+        elif speech is not None:
+            whisper_costs.record(speech['duration_s'], time.perf_counter() - start_whisper)
+    time_whisper = time.perf_counter() - start_whisper
+    print(f"[{basename}] Whisper time: {time_whisper:.2f}s, traffic label: {label_tr} ({conf_tr:.3f})")
+    run.transcript = (label_tr, conf_tr)
+
+
+def fuse_stage(run, fingerprint_index=None, fuse=fuse_scores):
+    """Fuse the branch scores and remember the result for later near-duplicates."""
+    run.result = fuse(run.car_score(), *run.transcript)
+    if run.fingerprint is not None:
+        fingerprint_index.add(run.fingerprint, run.path, run.mode, *run.result)
+    return run.result
+
+
+def classify_video(
+    vid_path, img_proto,
+    whisper_model_name, whisper_device, whisper_compute,
+    transformer_ckpt,
+    stage_threads=None,
+    fingerprint_index=None,
+    reuse_duplicates=True,
+    min_speech_s=MIN_SPEECH_S,
+    profiler=NULL_PROFILER,
+    single_pass=True,
+    num_frames=FRAMES_PER_VIDEO,
+    beam_size=None,
+    cancel=NULL_TOKEN
+):
+    """
+    stage_threads: optional dict from the scheduler with 'decode', 'whisper'
+    and 'transformer' thread counts; torch threads are set process-wide.
+    fingerprint_index: optional FingerprintIndex; a near-duplicate of an
+    already-classified video reuses its result (or is only flagged when
+    reuse_duplicates is False).
+    min_speech_s: clips with less detected speech skip Whisper and the text
+    classifier and are fused as a non-traffic transcript (0 disables the gate).
+    profiler: a PipelineProfiler (see profiling.make_profiler) to record
+    per-stage CPU, allocation and torch operator profiles.
+    single_pass: read the file once (demux.py) and hand the decoded frames
+    and audio to every branch; otherwise each branch reads the file itself.
+    num_frames / beam_size: frames sampled for the vision branches and the
+    Whisper beam (None keeps the transcriber's default); set by planner.py.
+    Measured stage times feed planner.cost_model.
+    cancel: CancelToken (see cancellation.py) checked before each branch and
+    inside the long ones; raises Cancelled once it is set.
+    """
+    stage_threads = stage_threads or {}
+    run = VideoRun(vid_path, whisper_model_name, num_frames, beam_size, cancel, profiler)
+
+    # 0) single read of the file for every branch, near-duplicate check
+    if single_pass:
+        demux_stage(run, stage_threads.get('decode', 0))
+    duplicate_stage(run, fingerprint_index, reuse_duplicates)
+    if run.result is not None:
+        return run.result
+
+    # 1) image-similarity score
+    vision_stage(run, img_proto)
+
+    # 2) transcript → traffic-stop prob
+    transcript_stage(run, whisper_model_name, whisper_device, whisper_compute, transformer_ckpt,
+                     stage_threads, min_speech_s)
+
+    # 3) fusion logic
+    return fuse_stage(run, fingerprint_index)
+
+
+def run_pipelined(
+    videos, img_proto,
+    whisper_model_name, whisper_device, whisper_compute,
+    transformer_ckpt,
+    stage_threads=None,
+    fingerprint_index=None,
+    reuse_duplicates=True,
+    min_speech_s=MIN_SPEECH_S,
+    queue_size=1,
+    cancel=NULL_TOKEN
+):
+    """
+    classify_video over a batch: the same stages, run as decode → vision →
+    transcribe → fuse steps that work on different videos at the same time
+    (see batch_pipeline.py). Yields BatchItems, in order of completion, whose
+    result is (label, score) or whose error says which stage failed.
+
+    stage_threads: ResourceScheduler.pipeline_allocation(), which splits the
+    budget between stages that run side by side. Decoded frames are dropped
+    once embedded and audio once transcribed, so at most queue_size + 1
+    decoded videos wait between any two stages.
+    """
+    stage_threads = stage_threads or {}
+
+    def decode(item):
+        item.run = VideoRun(item.path, whisper_model_name, cancel=cancel)
+        demux_stage(item.run, stage_threads.get('decode', 0))
+        duplicate_stage(item.run, fingerprint_index, reuse_duplicates)
+        item.result = item.run.result
+
+    def vision(item):
+        if item.result is None:
+            vision_stage(item.run, img_proto)
+
+    def transcribe(item):
+        if item.result is None:
+            transcript_stage(item.run, whisper_model_name, whisper_device, whisper_compute,
+                             transformer_ckpt, stage_threads, min_speech_s)
+
+    def fuse(item):
+        if item.result is None:
+            item.result = fuse_stage(item.run, fingerprint_index)
+        item.run = None
+
+    pipeline = StagePipeline([
+        Stage('decode', decode),
+        Stage('vision', vision),
+        Stage('transcribe', transcribe),
+        Stage('fuse', fuse),
+    ], queue_size=queue_size)
+    yield from pipeline.run(BatchItem(path) for path in videos)
+    pipeline.report()
+
+
 def main():
     parser = argparse.ArgumentParser()
     base_dir = os.path.dirname(__file__)
-    parser.add_argument('videos', nargs='+', help='Paths to .mp4 files or directories containing them')
+    parser.add_argument('videos', nargs='*', help='Paths to .mp4 files or directories containing them')
     parser.add_argument('--imgsim-h5', default=os.path.join(base_dir, 'image_similarity_model_efficientnet_b4.h5'))
-    parser.add_argument('--transformer-ckpt', default=os.path.join(base_dir, 'text_model_v1.pth'))
+    parser.add_argument('--transformer-ckpt',
+                        default=bundled_path('text_model_v1', os.path.join(base_dir, 'text_model_v1.pth')))
     parser.add_argument('--whisper-model', default='large-v3')
     parser.add_argument('--whisper-device', default='cpu')
     parser.add_argument('--whisper-compute', default='int8')
+    parser.add_argument('--dedupe-index', default=None,
+                        help='Fingerprint index (SQLite file) used to reuse results for near-duplicate videos')
+    parser.add_argument('--dup-threshold', type=float, default=DUPLICATE_SIM_THRESH,
+                        help='Fingerprint similarity at or above which videos count as duplicates')
+    parser.add_argument('--flag-duplicates', action='store_true',
+                        help='Only report near-duplicates instead of reusing their results')
+    parser.add_argument('--min-speech-s', type=float, default=MIN_SPEECH_S,
+                        help='Skip Whisper on clips with less detected speech (0 disables the gate)')
+    parser.add_argument('--profile', action='store_true',
+                        help='Write CPU / allocation / torch operator profiles per video to profiles/')
+    parser.add_argument('--no-single-pass', action='store_true',
+                        help='Let each branch read the video itself instead of one shared demux')
+    parser.add_argument('--ledger', default=None,
+                        help='Shared job ledger (SQLite file on a share, or memory://); videos given '
+                             'are enqueued, then this process works through the ledger with other nodes')
+    parser.add_argument('--node-id', default=None, help='Name of this worker in the ledger stats')
+    parser.add_argument('--share-root', default=None,
+                        help="This node's mount point of the share the ledger keys videos against "
+                             "(default: SHPD_SHARE_ROOT, else the ledger's directory)")
+    parser.add_argument('--lease-s', type=float, default=LEASE_S,
+                        help='Seconds without a heartbeat before another node takes a video over')
+    parser.add_argument('--pipelined', action='store_true',
+                        help='Overlap videos: decode / embed the next ones while Whisper transcribes')
+    parser.add_argument('--queue-size', type=int, default=1,
+                        help='Videos allowed to wait between two pipeline stages (--pipelined)')
 
     args = parser.parse_args()
+    if not args.videos and not args.ledger:
+        parser.error('give videos to process, or --ledger to work through a shared queue')
+    if args.pipelined and (args.ledger or args.profile or args.no_single_pass):
+        parser.error('--pipelined cannot be combined with --ledger, --profile or --no-single-pass')
 
     all_vids = []
     for pth in args.videos:
@@ -139,21 +459,82 @@ def main():
 
     img_proto = load_image_similarity_prototype(args.imgsim_h5)
 
-    for vid in args.videos:
-        try:
-            label, score = classify_video(
+    fingerprint_index = None
+    if args.dedupe_index:
+        fingerprint_index = FingerprintIndex(args.dedupe_index, args.dup_threshold)
+
+    def classify(vid):
+        with make_profiler(args.profile, vid) as profiler:
+            return classify_video(
                 vid, img_proto,
                 args.whisper_model, args.whisper_device, args.whisper_compute,
-                args.transformer_ckpt
+                args.transformer_ckpt,
+                fingerprint_index=fingerprint_index,
+                reuse_duplicates=not args.flag_duplicates,
+                min_speech_s=args.min_speech_s,
+                profiler=profiler,
+                single_pass=not args.no_single_pass
             )
-            if score is None:
-                print(f"{os.path.basename(vid)} → {label}, score=N/A")
-            else:
-                print(f"{os.path.basename(vid)} → {label}, score={score:.3f}")
 
-        except Exception as e:
-            print(f"[{os.path.basename(vid)}] ERROR, skipping: {e}")
-            continue
+    def report(vid, label, score):
+        if score is None:
+            print(f"{os.path.basename(vid)} → {label}, score=N/A")
+        else:
+            print(f"{os.path.basename(vid)} → {label}, score={score:.3f}")
+
+    if args.ledger:
+        ledger = open_ledger(args.ledger, lease_s=args.lease_s, share_root=args.share_root)
+        if args.videos:
+            print(f"Enqueued {ledger.enqueue(args.videos)} new videos in {args.ledger}")
+
+        def process(vid):
+            label, score = classify(vid)
+            report(vid, label, score)
+            return label, score
+
+        run_worker(ledger, process, node=args.node_id)
+    elif args.pipelined:
+        # Stages run side by side, so they split the cores instead of each taking all of them
+        scheduler = ResourceScheduler.from_env()
+        allocation = scheduler.pipeline_allocation()
+        scheduler.apply_torch_threads(allocation['vision'])
+        cancel = CancelToken()
+        try:
+            for item in run_pipelined(
+                args.videos, img_proto,
+                args.whisper_model, args.whisper_device, args.whisper_compute,
+                args.transformer_ckpt,
+                stage_threads=allocation,
+                fingerprint_index=fingerprint_index,
+                reuse_duplicates=not args.flag_duplicates,
+                min_speech_s=args.min_speech_s,
+                queue_size=args.queue_size,
+                cancel=cancel
+            ):
+                if item.error is not None:
+                    print(f"[{os.path.basename(item.path)}] ERROR, skipping: {item.error}")
+                else:
+                    report(item.path, *item.result)
+        except KeyboardInterrupt:
+            # Stops the stage threads and kills a running classifier subprocess
+            cancel.cancel("interrupted")
+            raise
+    else:
+        for vid in args.videos:
+            try:
+                label, score = classify(vid)
+                report(vid, label, score)
+            except Exception as e:
+                print(f"[{os.path.basename(vid)}] ERROR, skipping: {e}")
+                continue
+
+    if fingerprint_index is not None:
+        stats = fingerprint_index.stats()
+        print(f"Near-duplicates: {stats['skipped']} skipped, {stats['flagged']} flagged "
+              f"out of {len(args.videos)} videos")
+    if whisper_costs.skipped:
+        print(f"Speech gate: skipped Whisper on {whisper_costs.skipped} videos, "
+              f"~{whisper_costs.saved_s:.0f}s saved")
 
 
 if __name__ == '__main__':
@@ -11,20 +11,25 @@ src_dir = os.path.dirname(__file__)
 sys.path.insert(0, src_dir)
 
 import argparse
-import subprocess
-import tempfile
-import re
 
 import h5py
-import numpy as np
 
-from test_image_similarity_model import extract_video_feature, cosine_similarity
 from test_imagebind_similarity_model import (
     extract_frames as ib_extract_frames,
     extract_video_embedding,
     cosine_sim
 )
-from fast_whisper_transcriber import FasterWhisperTranscriber
+from demux import FRAMES_PER_VIDEO
+from planner import cost_model
+from profiling import NULL_PROFILER, make_profiler
+from speech_gate import whisper_costs, MIN_SPEECH_S
+from video_fingerprint import FingerprintIndex, DUPLICATE_SIM_THRESH
+from cancellation import NULL_TOKEN
+from model_bundle import bundled_path
+from ensemble_model import (
+    VideoRun, demux_stage, duplicate_stage, vision_stage, transcript_stage, fuse_stage,
+    load_image_similarity_prototype
+)
 
 # ————————————————————————————————————————————————————————————
 # 1) THRESHOLDS
@@ -36,9 +41,9 @@ TR_HIGH_THRESH = 0.95    # >= this → HIGH-confidence Traffic Stop
 TR_LOW_THRESH  = 0.90    # >= this → MEDIUM-confidence Traffic Stop  
 #————————————————————————————————————————————————————————————
 
-def load_image_similarity_prototype(h5_path):
-    with h5py.File(h5_path, 'r') as f:
-        return f['model_vector'][:]
+# Results are only reused between videos classified the same way (see
+# video_fingerprint.fingerprint_mode for the rest of the configuration)
+FINGERPRINT_MODE = 'imagebind'
 
 
 def load_imagebind_prototype(h5_path):
@@ -46,68 +51,8 @@ def load_imagebind_prototype(h5_path):
         return f['precise_model_vector'][:]
 
 
-def predict_traffic_from_transformer(model_path, transcript_text):
-    tf = tempfile.NamedTemporaryFile(suffix='.txt', delete=False, mode='w', encoding='utf-8')
-    tf.write(transcript_text)
-    tf.close()
-
-    cmd = ['python', 'src/text_transformer/evaluate.py', model_path, tf.name]
-    print("Running:", cmd)
-    print("Temp file exists? ", os.path.exists(tf.name), tf.name)
-    try:
-        out = subprocess.check_output(cmd, stderr=subprocess.STDOUT)
-        print(out.decode())
-    except subprocess.CalledProcessError as e:
-        print("=== Transformer script failed, skipping transformer branch ===")
-        print(e.output.decode())
-        return 'other', 0.0
-    os.unlink(tf.name)
-
-    m = re.search(r'confidence = ([0-9.]+).+predicted as (\w+)', out.decode())
-
-    if not m:
-        return 'other', 0.0
-    return m.group(2), float(m.group(1))
-
-
-def classify_video(
-    vid_path, img_proto, ib_proto,
-    whisper_model_name, whisper_device, whisper_compute,
-    transformer_ckpt
-):
-    basename = os.path.basename(vid_path)
-
-    # 1) image-similarity score
-    start_img = time.perf_counter()
-    feat_img = extract_video_feature(vid_path)
-    s_img    = cosine_similarity(feat_img, img_proto)
-    time_img = time.perf_counter() - start_img
-    print(f"[{basename}] Image-Similarity time: {time_img:.2f}s, score: {s_img:.3f}")
-
-    # 2) imagebind-similarity score
-    start_ib = time.perf_counter()
-    frames   = ib_extract_frames(vid_path, 400)
-    emb_ib   = extract_video_embedding(frames)
-    torch.cuda.empty_cache()
-    s_ib     = cosine_sim(emb_ib, ib_proto)
-    time_ib  = time.perf_counter() - start_ib
-    print(f"[{basename}] ImageBind time: {time_ib:.2f}s, score: {s_ib:.3f}")
-
-    # 3) transcript → traffic-stop prob
-    start_whisper = time.perf_counter()
-    transcriber = FasterWhisperTranscriber(
-        model_name=whisper_model_name,
-        device=whisper_device,
-        compute_type=whisper_compute
-    )
-    result     = transcriber.transcribe_file(vid_path)
-    text       = result['text']
-    label_tr, conf_tr = predict_traffic_from_transformer(transformer_ckpt, text)
-    time_whisper = time.perf_counter() - start_whisper
-    print(f"[{basename}] Whisper time: {time_whisper:.2f}s, traffic label: {label_tr} ({conf_tr:.3f})")
-
-    # 4) fusion logic
-    s_car = (s_img + s_ib) / 2
+def fuse_scores(s_car, label_tr, conf_tr):
+    """Decision-tree fusion of the visual car-check score and the transcript label."""
     is_traffic = (label_tr == 'traffic_pedestrian')
 
     if s_car < CAR_LOW_THRESH:
@@ -133,17 +78,114 @@ def classify_video(
         return "Car Check|Unconfident", s_car
 
 
+class FullVideoRun(VideoRun):
+    """VideoRun with the ImageBind score averaged into the car-check score."""
+    kind = FINGERPRINT_MODE
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.s_ib = None
+
+    def car_score(self):
+        return (self.s_img + self.s_ib) / 2
+
+
+def imagebind_stage(run, ib_proto):
+    """ImageBind similarity of the sampled frames, which are dropped afterwards."""
+    start_ib = time.perf_counter()
+    run.cancel.check()
+    with run.profiler.stage('imagebind'):
+        ib_frames = run.frames if run.frames is not None else ib_extract_frames(run.path, run.num_frames)
+        emb_ib   = extract_video_embedding(ib_frames, cancel=run.cancel)
+    torch.cuda.empty_cache()
+    run.s_ib = cosine_sim(emb_ib, ib_proto)
+    time_ib  = time.perf_counter() - start_ib
+    if run.frames is not None:
+        cost_model.observe('imagebind', len(ib_frames), time_ib)
+    run.frames = None
+    print(f"[{run.basename}] ImageBind time: {time_ib:.2f}s, score: {run.s_ib:.3f}")
+
+
+def classify_video(
+    vid_path, img_proto, ib_proto,
+    whisper_model_name, whisper_device, whisper_compute,
+    transformer_ckpt,
+    stage_threads=None,
+    fingerprint_index=None,
+    reuse_duplicates=True,
+    min_speech_s=MIN_SPEECH_S,
+    profiler=NULL_PROFILER,
+    single_pass=True,
+    num_frames=FRAMES_PER_VIDEO,
+    beam_size=None,
+    cancel=NULL_TOKEN
+):
+    """
+    stage_threads: optional dict from the scheduler with 'decode', 'whisper' and
+    'transformer' thread counts; torch threads are set process-wide.
+    fingerprint_index: optional FingerprintIndex; a near-duplicate of an
+    already-classified video reuses its result (or is only flagged when
+    reuse_duplicates is False).
+    min_speech_s: clips with less detected speech skip Whisper and the text
+    classifier and are fused as a non-traffic transcript (0 disables the gate).
+    profiler: a PipelineProfiler (see profiling.make_profiler) to record
+    per-stage CPU, allocation and torch operator profiles.
+    single_pass: read the file once (demux.py) and hand the decoded frames
+    and audio to every branch; otherwise each branch reads the file itself.
+    num_frames / beam_size: frames sampled for the vision branches and the
+    Whisper beam (None keeps the transcriber's default); set by planner.py.
+    Measured stage times feed planner.cost_model.
+    cancel: CancelToken (see cancellation.py) checked before each branch and
+    inside the long ones; raises Cancelled once it is set.
+    """
+    stage_threads = stage_threads or {}
+    run = FullVideoRun(vid_path, whisper_model_name, num_frames, beam_size, cancel, profiler)
+
+    # 0) single read of the file for every branch, near-duplicate check
+    if single_pass:
+        demux_stage(run, stage_threads.get('decode', 0))
+    duplicate_stage(run, fingerprint_index, reuse_duplicates)
+    if run.result is not None:
+        return run.result
+
+    # 1) image-similarity score; ImageBind still needs the frames
+    vision_stage(run, img_proto, release=False)
+
+    # 2) imagebind-similarity score
+    imagebind_stage(run, ib_proto)
+
+    # 3) transcript → traffic-stop prob
+    transcript_stage(run, whisper_model_name, whisper_device, whisper_compute, transformer_ckpt,
+                     stage_threads, min_speech_s)
+
+    # 4) fusion logic
+    return fuse_stage(run, fingerprint_index, fuse=fuse_scores)
+
+
 def main():
     parser = argparse.ArgumentParser()
     base_dir = os.path.dirname(__file__)
     parser.add_argument('videos', nargs='+', help='Paths to .mp4 files or directories containing them')
     parser.add_argument('--imgsim-h5', default=os.path.join(base_dir, 'image_similarity_model_efficientnet_b4.h5'))
     parser.add_argument('--ib-h5', default=os.path.join(base_dir, 'imagebind_similarity_model.h5'))
-    parser.add_argument('--transformer-ckpt', default=os.path.join(base_dir, 'text_model_v1.pth'))
+    parser.add_argument('--transformer-ckpt',
+                        default=bundled_path('text_model_v1', os.path.join(base_dir, 'text_model_v1.pth')))
     parser.add_argument('--whisper-model', default='large-v3')
     parser.add_argument('--whisper-device', default='cpu')
     parser.add_argument('--whisper-compute', default='int8')
-    
+    parser.add_argument('--dedupe-index', default=None,
+                        help='Fingerprint index (SQLite file) used to reuse results for near-duplicate videos')
+    parser.add_argument('--dup-threshold', type=float, default=DUPLICATE_SIM_THRESH,
+                        help='Fingerprint similarity at or above which videos count as duplicates')
+    parser.add_argument('--flag-duplicates', action='store_true',
+                        help='Only report near-duplicates instead of reusing their results')
+    parser.add_argument('--min-speech-s', type=float, default=MIN_SPEECH_S,
+                        help='Skip Whisper on clips with less detected speech (0 disables the gate)')
+    parser.add_argument('--profile', action='store_true',
+                        help='Write CPU / allocation / torch operator profiles per video to profiles/')
+    parser.add_argument('--no-single-pass', action='store_true',
+                        help='Let each branch read the video itself instead of one shared demux')
+
     args = parser.parse_args()
 
     all_vids = []
@@ -157,13 +199,23 @@ def main():
     img_proto = load_image_similarity_prototype(args.imgsim_h5)
     ib_proto  = load_imagebind_prototype(args.ib_h5)
 
+    fingerprint_index = None
+    if args.dedupe_index:
+        fingerprint_index = FingerprintIndex(args.dedupe_index, args.dup_threshold)
+
     for vid in args.videos:
         try:
-            label, score = classify_video(
-                vid, img_proto, ib_proto,
-                args.whisper_model, args.whisper_device, args.whisper_compute,
-                args.transformer_ckpt
-            )
+            with make_profiler(args.profile, vid) as profiler:
+                label, score = classify_video(
+                    vid, img_proto, ib_proto,
+                    args.whisper_model, args.whisper_device, args.whisper_compute,
+                    args.transformer_ckpt,
+                    fingerprint_index=fingerprint_index,
+                    reuse_duplicates=not args.flag_duplicates,
+                    min_speech_s=args.min_speech_s,
+                    profiler=profiler,
+                    single_pass=not args.no_single_pass
+                )
             if score is None:
                 print(f"{os.path.basename(vid)} → {label}, score=N/A")
             else:
@@ -173,6 +225,14 @@ def main():
             print(f"[{os.path.basename(vid)}] ERROR, skipping: {e}")
             continue
 
+    if fingerprint_index is not None:
+        stats = fingerprint_index.stats()
+        print(f"Near-duplicates: {stats['skipped']} skipped, {stats['flagged']} flagged "
+              f"out of {len(args.videos)} videos")
+    if whisper_costs.skipped:
+        print(f"Speech gate: skipped Whisper on {whisper_costs.skipped} videos, "
+              f"~{whisper_costs.saved_s:.0f}s saved")
+
 
 if __name__ == '__main__':
     main()
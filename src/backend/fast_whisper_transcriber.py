@@ -1,11 +1,35 @@
 import os
 import glob
 import argparse
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from typing import Dict, List, Optional, Union
+import numpy as np
 from faster_whisper import WhisperModel
 from pathlib import Path
+from profiling import make_profiler
+from cancellation import NULL_TOKEN
+from model_bundle import whisper_model_path
+from speech_gate import decode_mono_16k, speech_timestamps, SAMPLE_RATE
 os.environ["KMP_DUPLICATE_LIB_OK"] = "TRUE"
 
+# Chunked mode: audio is cut at VAD silence into chunks of at most
+# CHUNK_MAX_S, aiming for one chunk per worker but never under CHUNK_MIN_S
+# (one Whisper window), and the chunks are decoded concurrently.
+CHUNK_MIN_S = 30.0
+CHUNK_MAX_S = 300.0
+# Shorter pre-decoded audio is decoded in one stream even in chunked mode
+CHUNKED_MIN_AUDIO_S = 120.0
+# Silence kept either side of a chunk's speech (Whisper's VAD pads 0.4s)
+CHUNK_PAD_S = 1.0
+
+VAD_PARAMETERS = dict(
+	min_silence_duration_ms=500,  # Minimum silence duration
+	speech_pad_ms=400,            # Padding around speech
+	threshold=0.5                 # VAD threshold
+)
+
 class FasterWhisperTranscriber:
 	def __init__(
 		self, 
@@ -14,7 +38,11 @@ class FasterWhisperTranscriber:
 		compute_type="default",
 		min_speech_probability=0.2,
 		no_speech_threshold=0.2,
-		beam_size=5
+		beam_size=5,
+		cpu_threads=0,
+		num_workers=1,
+		chunked=False,
+		chunk_workers=None
 	):
 		"""
 		Enhanced transcriber using Faster Whisper implementation
@@ -26,6 +54,12 @@ class FasterWhisperTranscriber:
 			min_speech_probability: Threshold for speech detection
 			no_speech_threshold: Higher values skip more potential non-speech
 			beam_size: Beam size for decoding (higher = more accurate, slower)
+			cpu_threads: CTranslate2 threads per decode (0 = library default)
+			num_workers: Decodes that may run concurrently on this model
+			chunked: Split long audio at silences and decode the chunks on
+				chunk_workers threads (see transcribe_chunked)
+			chunk_workers: Concurrent chunk decodes per file (default
+				num_workers); num_workers must leave room for them
 
 
 		
@@ -36,14 +70,20 @@ class FasterWhisperTranscriber:
 		python src/fast_whisper_transcriber.py "data/raw/car_check_videos/*.mp4" --model large-v3 --device cpu --compute-type int16
 		"""
 		print(f"Loading Faster Whisper model: {model_name} on {device}")
+		# A bundled CTranslate2 directory replaces the Hugging Face download
 		self.model = WhisperModel(
-			model_name, 
+			whisper_model_path(model_name), 
 			device=device, 
-			compute_type=compute_type
+			compute_type=compute_type,
+			cpu_threads=cpu_threads,
+			num_workers=num_workers
 		)
 		self.min_speech_probability = min_speech_probability
 		self.no_speech_threshold = no_speech_threshold
 		self.beam_size = beam_size
+		self.num_workers = num_workers
+		self.chunked = chunked
+		self.chunk_workers = chunk_workers or num_workers
 		
 	def post_process(self, text: str) -> str:
 		if not text or len(text) < 10:
@@ -52,30 +92,58 @@ class FasterWhisperTranscriber:
 			
 		return result.strip()
 	
-	def transcribe_file(self, video_path: str) -> Dict:
-		"""Transcribe a single file with enhanced settings"""
-		print(f"Transcribing: {video_path}")
+	def transcribe_file(
+		self,
+		video_path: Union[str, np.ndarray],
+		name: Optional[str] = None,
+		beam_size: Optional[int] = None,
+		cancel=NULL_TOKEN,
+		chunked: Optional[bool] = None
+	) -> Dict:
+		"""
+		Transcribe a single file with enhanced settings
+
+		Args:
+			video_path: Path to a media file, or pre-decoded 16 kHz mono
+				float32 audio (e.g. from demux.demux_video)
+			name: Label for log messages when passing an array
+			beam_size: Override the transcriber's beam size for this call
+			cancel: CancelToken checked between segments; segments are
+				decoded lazily, so raising stops the decode (see cancellation.py)
+			chunked: Override the transcriber's chunked setting for this call
+		"""
+		if chunked is None:
+			short = isinstance(video_path, np.ndarray) and video_path.size < CHUNKED_MIN_AUDIO_S * SAMPLE_RATE
+			chunked = self.chunked and not short
+		if chunked:
+			return self.transcribe_chunked(video_path, name=name, beam_size=beam_size, cancel=cancel)
+		if isinstance(video_path, np.ndarray):
+			print(f"Transcribing: {name or 'audio buffer'} ({video_path.size / 16000:.1f}s pre-decoded audio)")
+		else:
+			print(f"Transcribing: {video_path}")
 		
+		filtered_segments, info = self._decode(video_path, beam_size, cancel)
+		return self._result(filtered_segments, info.language, info.language_probability)
+
+	def _decode(self, audio, beam_size, cancel, offset=0.0, language=None):
+		"""Decode one file or buffer; returns (kept segments, info), times shifted by offset."""
 		# Use Faster Whisper with optimized parameters
 		segments, info = self.model.transcribe(
-			video_path,
-			beam_size=self.beam_size,
+			audio,
+			language=language,  # None: detect from the first 30s
+			beam_size=beam_size or self.beam_size,
 			# temperature=0,  # Reduces hallucinations
 			no_speech_threshold=self.no_speech_threshold,
 			compression_ratio_threshold=2.2,   # Avoid highly compressed (repetitive) output
 			vad_filter=True,  # Voice Activity Detection filtering
-			vad_parameters=dict(
-				min_silence_duration_ms=500,  # Minimum silence duration
-				speech_pad_ms=400,            # Padding around speech
-				threshold=0.5                 # VAD threshold
-			)
+			vad_parameters=VAD_PARAMETERS
 		)
 		
 		# Filter out segments with low speech probability
 		filtered_segments = []
-		full_text = []
 		
 		for segment in segments:
+			cancel.check()
 			# For faster-whisper, we need to calculate no_speech_prob differently
 			speech_prob = segment.avg_logprob  # Use log probability as a confidence measure
 			
@@ -84,15 +152,16 @@ class FasterWhisperTranscriber:
 				cleaned_text = self.post_process(segment.text)
 				if cleaned_text:  # Only keep non-empty segments
 					filtered_segments.append({
-						"start": segment.start,
-						"end": segment.end,
+						"start": segment.start + offset,
+						"end": segment.end + offset,
 						"text": cleaned_text,
 						"speech_prob": speech_prob
 					})
-					full_text.append(cleaned_text)
-		
+		return filtered_segments, info
+
+	def _result(self, filtered_segments, language, language_probability) -> Dict:
 		# Combine all text
-		filtered_text = " ".join(full_text)
+		filtered_text = " ".join(seg["text"] for seg in filtered_segments)
 		
 		# One final cleanup pass
 		final_text = self.post_process(filtered_text)
@@ -100,16 +169,66 @@ class FasterWhisperTranscriber:
 		return {
 			"text": final_text,
 			"segments": filtered_segments,
-			"language": info.language,
-			"language_probability": info.language_probability
+			"language": language,
+			"language_probability": language_probability
 		}
+
+	def transcribe_chunked(
+		self,
+		video_path: Union[str, np.ndarray],
+		name: Optional[str] = None,
+		beam_size: Optional[int] = None,
+		cancel=NULL_TOKEN
+	) -> Dict:
+		"""
+		Transcribe long audio as silence-bounded chunks decoded in parallel
+
+		One decode stream caps a 90-minute recording at the speed of a single
+		CTranslate2 worker. Here the audio is cut in the middle of VAD
+		silences (plan_chunks), the chunks are decoded on chunk_workers threads
+		sharing this model, and the segments are stitched back in order with
+		their timestamps moved to the recording's timeline. The language is
+		detected once, from the recording's first speech, and every chunk is
+		decoded in it, so a short or noisy chunk cannot switch language.
+		Otherwise chunks use transcribe_file's settings, so a cut only changes
+		the text when a chunk has to be split inside speech.
+		"""
+		label = name or (video_path if isinstance(video_path, str) else 'audio buffer')
+		audio = video_path if isinstance(video_path, np.ndarray) else decode_mono_16k(video_path)
+		duration = audio.size / SAMPLE_RATE
+		spans = speech_timestamps(audio)
+		speech_s = sum(e - s for s, e in spans)
+		max_chunk_s = min(CHUNK_MAX_S, max(CHUNK_MIN_S, speech_s / max(1, self.chunk_workers)))
+		chunks = plan_chunks(spans, duration, max_chunk_s)
+		print(f"Transcribing: {label} ({duration:.1f}s audio) as {len(chunks)} chunks "
+			  f"on {min(self.chunk_workers, max(1, len(chunks)))} workers")
+		if not chunks:
+			return self._result([], None, 0.0)
+
+		cancel.check()
+		language, language_probability, _ = self.model.detect_language(
+			audio, vad_filter=True, vad_parameters=VAD_PARAMETERS
+		)
+
+		def decode(chunk):
+			start, end = chunk
+			cancel.check()
+			piece = audio[int(start * SAMPLE_RATE):int(end * SAMPLE_RATE)]
+			return self._decode(piece, beam_size, cancel, offset=start, language=language)
+
+		with ThreadPoolExecutor(max_workers=self.chunk_workers, thread_name_prefix="whisper-chunk") as pool:
+			decoded = list(pool.map(decode, chunks))
+
+		segments = [seg for chunk_segments, _ in decoded for seg in chunk_segments]
+		return self._result(segments, language, language_probability)
 	
-	def transcribe_files(self, pattern: str) -> Dict[str, str]:
+	def transcribe_files(self, pattern: str, profile: bool = False) -> Dict[str, str]:
 		"""
 		Transcribe all files matching the pattern
 		
 		Args:
 			pattern: Glob pattern to match video files
+			profile: Write a profile per file (see profiling.py)
 		
 		Returns:
 			Dictionary mapping filenames to transcription text
@@ -125,7 +244,9 @@ class FasterWhisperTranscriber:
 		
 		# Process each video
 		for video_path in video_files:
-			result = self.transcribe_file(video_path)
+			with make_profiler(profile, video_path) as profiler:
+				with profiler.stage('whisper'):
+					result = self.transcribe_file(video_path)
 			
 			# Store the transcript
 			results[video_path] = result["text"]
@@ -155,6 +276,131 @@ class FasterWhisperTranscriber:
 		return results
 
 
+def plan_chunks(spans, duration: float, max_chunk_s: float = CHUNK_MAX_S, pad_s: float = CHUNK_PAD_S):
+	"""
+	Group VAD speech spans into chunks of at most max_chunk_s of speech
+
+	Returns (start_s, end_s) chunks in order. Each chunk keeps at most pad_s
+	of the silence on either side of its speech, and never more than half
+	of the gap to its neighbour, so no chunk is longer than
+	max_chunk_s + 2 * pad_s; longer silences are dropped, as Whisper's own
+	VAD would. A single span longer than max_chunk_s is split inside
+	speech, the only case where a word can be cut.
+	"""
+	groups = []
+	first = last = None
+	for s, e in spans:
+		while e - s > max_chunk_s:
+			if first is not None:
+				groups.append((first, last))
+				first = None
+			groups.append((s, s + max_chunk_s))
+			s += max_chunk_s
+		if first is not None and e - first > max_chunk_s:
+			groups.append((first, last))
+			first = None
+		if first is None:
+			first = s
+		last = e
+	if first is not None:
+		groups.append((first, last))
+
+	chunks = []
+	for i, (s, e) in enumerate(groups):
+		gap_before = s - groups[i - 1][1] if i else 2 * s
+		gap_after = groups[i + 1][0] - e if i + 1 < len(groups) else 2 * (duration - e)
+		chunks.append((s - min(pad_s, gap_before / 2), e + min(pad_s, gap_after / 2)))
+	return chunks
+
+
+def word_error_rate(reference: str, hypothesis: str) -> float:
+	"""Word-level edit distance over reference length (1.0 for an empty reference with output)."""
+	ref, hyp = reference.lower().split(), hypothesis.lower().split()
+	if not ref:
+		return float(bool(hyp))
+	row = list(range(len(hyp) + 1))
+	for i, r in enumerate(ref, 1):
+		prev, row[0] = row[0], i
+		for j, h in enumerate(hyp, 1):
+			prev, row[j] = row[j], min(row[j] + 1, row[j - 1] + 1, prev + (r != h))
+	return row[-1] / len(ref)
+
+
+def compare_chunked(transcriber: FasterWhisperTranscriber, pattern: str):
+	"""
+	Sequential vs chunked decoding on a reference set
+
+	Every file is decoded both ways with the same model; prints wall time,
+	speedup and the word error rate of the chunked transcript against the
+	sequential one, taken as the reference.
+	"""
+	video_files = sorted(glob.glob(pattern, recursive=True))
+	if not video_files:
+		print(f"No files found matching pattern: {pattern}")
+		return
+	rows = []
+	for video_path in video_files:
+		audio = decode_mono_16k(video_path)
+		start = time.perf_counter()
+		sequential = transcriber.transcribe_file(audio, name=video_path, chunked=False)
+		sequential_s = time.perf_counter() - start
+		start = time.perf_counter()
+		chunked = transcriber.transcribe_file(audio, name=video_path, chunked=True)
+		chunked_s = time.perf_counter() - start
+		rows.append((os.path.basename(video_path), audio.size / SAMPLE_RATE, sequential_s, chunked_s,
+					 word_error_rate(sequential["text"], chunked["text"]),
+					 len(sequential["text"].split())))
+
+	print(f"\n{'file':<40}{'audio s':>9}{'seq s':>8}{'chunk s':>9}{'speedup':>9}{'WER':>7}")
+	for name, audio_s, sequential_s, chunked_s, wer, _ in rows:
+		print(f"{name[:39]:<40}{audio_s:>9.1f}{sequential_s:>8.1f}{chunked_s:>9.1f}"
+			  f"{sequential_s / max(chunked_s, 1e-9):>8.2f}x{wer:>7.1%}")
+	total_seq = sum(r[2] for r in rows)
+	total_chunk = sum(r[3] for r in rows)
+	words = sum(r[5] for r in rows)
+	# Corpus WER weights each file by its reference length
+	corpus_wer = sum(r[4] * r[5] for r in rows) / words if words else 0.0
+	print(f"{'total':<40}{sum(r[1] for r in rows):>9.1f}{total_seq:>8.1f}{total_chunk:>9.1f}"
+		  f"{total_seq / max(total_chunk, 1e-9):>8.2f}x{corpus_wer:>7.1%}")
+
+
+_transcribers = {}
+_transcribers_lock = threading.Lock()
+
+
+def get_transcriber(
+	model_name="large-v3",
+	device="auto",
+	compute_type="default",
+	cpu_threads=0,
+	num_workers=1,
+	chunk_workers=1
+) -> FasterWhisperTranscriber:
+	"""
+	Return a shared transcriber for this configuration, loading it on first use.
+
+	Loading large-v3 takes several seconds and gigabytes of memory, so the
+	backend keeps one instance per configuration instead of one per request.
+	chunk_workers > 1 turns on chunked decoding of long audio; the scheduler
+	sizes it (see ResourceScheduler.stage_allocation).
+	"""
+	key = (model_name, device, compute_type, cpu_threads, num_workers, chunk_workers)
+	with _transcribers_lock:
+		transcriber = _transcribers.get(key)
+		if transcriber is None:
+			transcriber = FasterWhisperTranscriber(
+				model_name=model_name,
+				device=device,
+				compute_type=compute_type,
+				cpu_threads=cpu_threads,
+				num_workers=num_workers,
+				chunked=chunk_workers > 1,
+				chunk_workers=chunk_workers
+			)
+			_transcribers[key] = transcriber
+		return transcriber
+
+
 # Example usage
 if __name__ == "__main__":
 	parser = argparse.ArgumentParser(description='Faster Whisper Enhanced Video Transcriber')
@@ -169,18 +415,36 @@ if __name__ == "__main__":
 						help='Beam size for decoding (higher = better quality, slower)')
 	parser.add_argument('--no-speech-threshold', type=float, default=0.6, 
 						help='Threshold for filtering non-speech')
+	parser.add_argument('--profile', action='store_true',
+						help='Write a CPU / allocation profile per file to profiles/')
+	parser.add_argument('--chunked', action='store_true',
+						help='Split long audio at silences and decode the chunks in parallel')
+	parser.add_argument('--workers', type=int, default=4,
+						help='Concurrent chunk decodes with --chunked / --compare-chunked')
+	parser.add_argument('--cpu-threads', type=int, default=0,
+						help='CTranslate2 threads per decode (0 = library default)')
+	parser.add_argument('--compare-chunked', action='store_true',
+						help='Decode every file sequentially and chunked; report speedup and WER')
 	
 	args = parser.parse_args()
+	parallel = args.chunked or args.compare_chunked
 	
 	transcriber = FasterWhisperTranscriber(
 		model_name=args.model,
 		device=args.device,
 		compute_type=args.compute_type,
 		beam_size=args.beam_size,
-		no_speech_threshold=args.no_speech_threshold
+		no_speech_threshold=args.no_speech_threshold,
+		cpu_threads=args.cpu_threads,
+		num_workers=args.workers if parallel else 1,
+		chunked=args.chunked
 	)
 	
-	transcriptions = transcriber.transcribe_files(args.pattern)
+	if args.compare_chunked:
+		compare_chunked(transcriber, args.pattern)
+		raise SystemExit(0)
+	
+	transcriptions = transcriber.transcribe_files(args.pattern, profile=args.profile)
 	
 	print("\nTranscription complete!")
 	print(f"Processed {len(transcriptions)} files")
@@ -0,0 +1,603 @@
+#!/usr/bin/env python3
+"""
+Shared job ledger for spreading a video archive across several machines.
+
+Every machine runs ensemble_model.py with --ledger pointing at the same
+ledger. Workers claim one pending video at a time under a lease, renew the
+lease from a heartbeat thread while classify_video runs, and write the label
+and score back when done. A worker that dies stops heartbeating; once its
+lease expires any other worker puts the video back to pending (or fails it
+after MAX_ATTEMPTS), so nothing is lost. Every lease carries a token and a
+result is only accepted from the holder of the current lease, so a worker
+that stalled past its lease cannot overwrite the result of the worker that
+took the video over.
+
+Nodes may mount the share at different paths, so the SQLite ledger keys
+videos by their path relative to a share root: --share-root (or
+SHPD_SHARE_ROOT) if given, otherwise the directory holding the ledger file.
+Each node resolves keys against its own root before processing. Videos
+outside the root are kept as absolute paths.
+
+Backends:
+    SQLiteLedger   a SQLite file, e.g. on an NFS/SMB share all workers mount
+    MemoryLedger   in-process stand-in with the same interface, for a single
+                   machine (threads as nodes) and for trying things out
+open_ledger('memory://') returns the stand-in, anything else a SQLite file.
+
+CLI:
+    python job_ledger.py [--share-root DIR] LEDGER enqueue VIDEO_OR_DIR ...
+    python job_ledger.py LEDGER stats
+    python job_ledger.py LEDGER recover
+    python job_ledger.py LEDGER results [--status done]
+"""
+import argparse
+import glob
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+
+LEASE_S = 120.0            # a lease not renewed for this long counts as abandoned
+HEARTBEAT_FRACTION = 1 / 3  # renew after this fraction of the lease has elapsed
+MAX_ATTEMPTS = 3           # claims (including expired ones) before a video is failed
+POLL_S = 5.0               # idle wait while other nodes still hold leases
+NODE_STALE_S = 3 * LEASE_S  # nodes not seen for this long are shown as dead
+LOCK_RETRIES = 6           # attempts at a ledger call that hits a locked database
+LOCK_BACKOFF_S = 1.0       # first retry delay, doubled after every further failure
+
+PENDING, LEASED, DONE, FAILED = 'pending', 'leased', 'done', 'failed'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id            INTEGER PRIMARY KEY AUTOINCREMENT,
+    path          TEXT NOT NULL UNIQUE,
+    status        TEXT NOT NULL DEFAULT 'pending',
+    attempts      INTEGER NOT NULL DEFAULT 0,
+    node          TEXT,
+    lease_token   TEXT,
+    lease_expires REAL,
+    label         TEXT,
+    score         REAL,
+    error         TEXT,
+    elapsed_s     REAL,
+    enqueued_at   REAL NOT NULL,
+    finished_at   REAL
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs(status, id);
+CREATE INDEX IF NOT EXISTS idx_jobs_lease ON jobs(status, lease_expires);
+CREATE TABLE IF NOT EXISTS nodes (
+    node        TEXT PRIMARY KEY,
+    host        TEXT,
+    pid         INTEGER,
+    started_at  REAL NOT NULL,
+    last_seen   REAL NOT NULL,
+    done        INTEGER NOT NULL DEFAULT 0,
+    failed      INTEGER NOT NULL DEFAULT 0,
+    busy_s      REAL NOT NULL DEFAULT 0
+);
+"""
+
+
+def default_node_id() -> str:
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+def share_key(path: str, share_root: str) -> str:
+    """Mount-independent key for path: relative to share_root, '/'-separated."""
+    path = os.path.abspath(path)
+    if share_root is None:
+        return path
+    rel = os.path.relpath(path, share_root)
+    if rel == os.pardir or rel.startswith(os.pardir + os.sep):
+        return path  # not on the share; only meaningful to this node
+    return rel.replace(os.sep, '/')
+
+
+def local_path(key: str, share_root: str) -> str:
+    """Path of a ledger key on this node."""
+    if share_root is None or os.path.isabs(key):
+        return key
+    return os.path.join(share_root, *key.split('/'))
+
+
+def _is_lock_error(e: Exception) -> bool:
+    message = str(e).lower()
+    return 'locked' in message or 'busy' in message
+
+
+def _node_stats(nodes, now):
+    out = []
+    for n in nodes:
+        up = max(now - n['started_at'], 1e-9)
+        out.append({
+            "node": n['node'],
+            "host": n['host'],
+            "done": n['done'],
+            "failed": n['failed'],
+            "busy_s": round(n['busy_s'], 1),
+            "videos_per_hour": round(n['done'] * 3600.0 / up, 2),
+            "utilization": round(min(1.0, n['busy_s'] / up), 3),
+            "last_seen_s": round(now - n['last_seen'], 1),
+            "alive": now - n['last_seen'] < NODE_STALE_S,
+        })
+    return sorted(out, key=lambda n: n['node'])
+
+
+class SQLiteLedger:
+    """
+    Ledger in a SQLite file shared by every worker.
+
+    Uses the rollback journal rather than WAL: WAL needs shared memory, which
+    network filesystems do not provide. Claims take the write lock up front
+    (BEGIN IMMEDIATE) so two workers can never lease the same row.
+    """
+
+    def __init__(self, db_path: str, lease_s: float = LEASE_S, max_attempts: int = MAX_ATTEMPTS,
+                 share_root: str = None):
+        self.db_path = db_path
+        share_root = share_root or os.environ.get('SHPD_SHARE_ROOT')
+        self.share_root = os.path.abspath(share_root or os.path.dirname(os.path.abspath(db_path)))
+        self.lease_s = lease_s
+        self.max_attempts = max_attempts
+        self._local = threading.local()
+        conn = sqlite3.connect(self.db_path, timeout=60)
+        try:
+            conn.execute("PRAGMA journal_mode=DELETE")
+            conn.executescript(SCHEMA)
+        finally:
+            conn.close()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=60, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            self._local.conn = conn
+        return conn
+
+    def _write(self, fn):
+        """Run fn(conn) in one write transaction."""
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            result = fn(conn)
+            conn.execute("COMMIT")
+        except Exception:
+            # A COMMIT refused with "database is locked" leaves the transaction open
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        return result
+
+    def _resolve(self, row) -> dict:
+        job = dict(row)
+        job['path'] = local_path(job['path'], self.share_root)
+        return job
+
+    def enqueue(self, paths) -> int:
+        """Add videos not already in the ledger; returns the number added."""
+        now = time.time()
+
+        def add(conn):
+            before = conn.total_changes
+            conn.executemany(
+                "INSERT OR IGNORE INTO jobs (path, enqueued_at) VALUES (?, ?)",
+                [(share_key(p, self.share_root), now) for p in paths],
+            )
+            return conn.total_changes - before
+        return self._write(add)
+
+    def register_node(self, node: str):
+        now = time.time()
+        self._write(lambda conn: conn.execute(
+            """
+            INSERT INTO nodes (node, host, pid, started_at, last_seen) VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT(node) DO UPDATE SET last_seen = excluded.last_seen
+            """,
+            (node, socket.gethostname(), os.getpid(), now, now),
+        ))
+
+    def claim(self, node: str):
+        """Lease the oldest pending video to node; returns the job dict or None."""
+        now = time.time()
+        token = uuid.uuid4().hex
+
+        def take(conn):
+            row = conn.execute(
+                "SELECT id FROM jobs WHERE status = ? ORDER BY id LIMIT 1", (PENDING,)
+            ).fetchone()
+            if row is None:
+                return None
+            conn.execute(
+                """
+                UPDATE jobs SET status = ?, node = ?, lease_token = ?, lease_expires = ?,
+                                attempts = attempts + 1
+                WHERE id = ?
+                """,
+                (LEASED, node, token, now + self.lease_s, row['id']),
+            )
+            conn.execute("UPDATE nodes SET last_seen = ? WHERE node = ?", (now, node))
+            return self._resolve(conn.execute("SELECT * FROM jobs WHERE id = ?", (row['id'],)).fetchone())
+        return self._write(take)
+
+    def heartbeat(self, job: dict) -> bool:
+        """Extend the lease; False if it was lost (expired and taken over)."""
+        now = time.time()
+
+        def renew(conn):
+            cur = conn.execute(
+                "UPDATE jobs SET lease_expires = ? WHERE id = ? AND lease_token = ? AND status = ?",
+                (now + self.lease_s, job['id'], job['lease_token'], LEASED),
+            )
+            conn.execute("UPDATE nodes SET last_seen = ? WHERE node = ?", (now, job['node']))
+            return cur.rowcount == 1
+        return self._write(renew)
+
+    def complete(self, job: dict, label: str, score, elapsed_s: float) -> bool:
+        """Write a result back; rejected (False) unless job still holds its lease."""
+        now = time.time()
+
+        def finish(conn):
+            cur = conn.execute(
+                """
+                UPDATE jobs SET status = ?, label = ?, score = ?, elapsed_s = ?, error = NULL,
+                                finished_at = ?, lease_token = NULL, lease_expires = NULL
+                WHERE id = ? AND lease_token = ? AND status = ?
+                """,
+                (DONE, label, score, elapsed_s, now, job['id'], job['lease_token'], LEASED),
+            )
+            if cur.rowcount != 1:
+                return False
+            conn.execute(
+                "UPDATE nodes SET done = done + 1, busy_s = busy_s + ?, last_seen = ? WHERE node = ?",
+                (elapsed_s, now, job['node']),
+            )
+            return True
+        return self._write(finish)
+
+    def fail(self, job: dict, error: str, elapsed_s: float = 0.0) -> bool:
+        """Give a video back after an error; failed for good after max_attempts."""
+        now = time.time()
+
+        def give_back(conn):
+            row = conn.execute(
+                "SELECT attempts FROM jobs WHERE id = ? AND lease_token = ? AND status = ?",
+                (job['id'], job['lease_token'], LEASED),
+            ).fetchone()
+            if row is None:
+                return False
+            final = row['attempts'] >= self.max_attempts
+            conn.execute(
+                """
+                UPDATE jobs SET status = ?, error = ?, node = ?, lease_token = NULL,
+                                lease_expires = NULL, finished_at = ?
+                WHERE id = ?
+                """,
+                (FAILED if final else PENDING, error, job['node'], now if final else None, job['id']),
+            )
+            conn.execute(
+                "UPDATE nodes SET failed = failed + ?, busy_s = busy_s + ?, last_seen = ? WHERE node = ?",
+                (1 if final else 0, elapsed_s, now, job['node']),
+            )
+            return True
+        return self._write(give_back)
+
+    def recover_expired(self) -> int:
+        """Return videos whose lease expired (dead or hung worker) to pending."""
+        now = time.time()
+
+        def sweep(conn):
+            expired = conn.execute(
+                "SELECT id, attempts, node FROM jobs WHERE status = ? AND lease_expires < ?",
+                (LEASED, now),
+            ).fetchall()
+            for row in expired:
+                final = row['attempts'] >= self.max_attempts
+                conn.execute(
+                    """
+                    UPDATE jobs SET status = ?, error = ?, lease_token = NULL,
+                                    lease_expires = NULL, finished_at = ?
+                    WHERE id = ?
+                    """,
+                    (FAILED if final else PENDING, f"lease expired on {row['node']}",
+                     now if final else None, row['id']),
+                )
+            return len(expired)
+        return self._write(sweep)
+
+    def remaining(self) -> int:
+        """Videos still pending or leased."""
+        return self._connect().execute(
+            "SELECT COUNT(*) FROM jobs WHERE status IN (?, ?)", (PENDING, LEASED)
+        ).fetchone()[0]
+
+    def results(self, status: str = None) -> list:
+        sql, params = "SELECT * FROM jobs", []
+        if status:
+            sql += " WHERE status = ?"
+            params.append(status)
+        return [self._resolve(r) for r in self._connect().execute(sql + " ORDER BY id", params)]
+
+    def stats(self) -> dict:
+        conn = self._connect()
+        counts = {PENDING: 0, LEASED: 0, DONE: 0, FAILED: 0}
+        for row in conn.execute("SELECT status, COUNT(*) AS n FROM jobs GROUP BY status"):
+            counts[row['status']] = row['n']
+        nodes = [dict(r) for r in conn.execute("SELECT * FROM nodes")]
+        return {"jobs": counts, "nodes": _node_stats(nodes, time.time())}
+
+
+class MemoryLedger:
+    """In-process stand-in for SQLiteLedger; nodes are threads of one process."""
+
+    def __init__(self, lease_s: float = LEASE_S, max_attempts: int = MAX_ATTEMPTS):
+        self.lease_s = lease_s
+        self.max_attempts = max_attempts
+        self._lock = threading.Lock()
+        self._jobs = {}       # id -> job dict
+        self._by_path = {}
+        self._nodes = {}
+        self._next_id = 1
+
+    def enqueue(self, paths) -> int:
+        now = time.time()
+        added = 0
+        with self._lock:
+            for p in paths:
+                p = os.path.abspath(p)
+                if p in self._by_path:
+                    continue
+                job = {"id": self._next_id, "path": p, "status": PENDING, "attempts": 0,
+                       "node": None, "lease_token": None, "lease_expires": None,
+                       "label": None, "score": None, "error": None, "elapsed_s": None,
+                       "enqueued_at": now, "finished_at": None}
+                self._jobs[job['id']] = job
+                self._by_path[p] = job['id']
+                self._next_id += 1
+                added += 1
+        return added
+
+    def register_node(self, node: str):
+        now = time.time()
+        with self._lock:
+            entry = self._nodes.setdefault(node, {
+                "node": node, "host": socket.gethostname(), "pid": os.getpid(),
+                "started_at": now, "last_seen": now, "done": 0, "failed": 0, "busy_s": 0.0,
+            })
+            entry['last_seen'] = now
+
+    def _held(self, job):
+        current = self._jobs.get(job['id'])
+        if current and current['status'] == LEASED and current['lease_token'] == job['lease_token']:
+            return current
+        return None
+
+    def _touch(self, node, now, **deltas):
+        entry = self._nodes.get(node)
+        if entry is not None:
+            entry['last_seen'] = now
+            for key, value in deltas.items():
+                entry[key] += value
+
+    def claim(self, node: str):
+        now = time.time()
+        with self._lock:
+            for job in self._jobs.values():
+                if job['status'] == PENDING:
+                    job.update(status=LEASED, node=node, lease_token=uuid.uuid4().hex,
+                               lease_expires=now + self.lease_s, attempts=job['attempts'] + 1)
+                    self._touch(node, now)
+                    return dict(job)
+        return None
+
+    def heartbeat(self, job: dict) -> bool:
+        now = time.time()
+        with self._lock:
+            current = self._held(job)
+            if current is None:
+                return False
+            current['lease_expires'] = now + self.lease_s
+            self._touch(job['node'], now)
+            return True
+
+    def complete(self, job: dict, label: str, score, elapsed_s: float) -> bool:
+        now = time.time()
+        with self._lock:
+            current = self._held(job)
+            if current is None:
+                return False
+            current.update(status=DONE, label=label, score=score, elapsed_s=elapsed_s, error=None,
+                           finished_at=now, lease_token=None, lease_expires=None)
+            self._touch(job['node'], now, done=1, busy_s=elapsed_s)
+            return True
+
+    def fail(self, job: dict, error: str, elapsed_s: float = 0.0) -> bool:
+        now = time.time()
+        with self._lock:
+            current = self._held(job)
+            if current is None:
+                return False
+            final = current['attempts'] >= self.max_attempts
+            current.update(status=FAILED if final else PENDING, error=error, lease_token=None,
+                           lease_expires=None, finished_at=now if final else None)
+            self._touch(job['node'], now, failed=1 if final else 0, busy_s=elapsed_s)
+            return True
+
+    def recover_expired(self) -> int:
+        now = time.time()
+        recovered = 0
+        with self._lock:
+            for job in self._jobs.values():
+                if job['status'] == LEASED and job['lease_expires'] < now:
+                    final = job['attempts'] >= self.max_attempts
+                    job.update(status=FAILED if final else PENDING,
+                               error=f"lease expired on {job['node']}", lease_token=None,
+                               lease_expires=None, finished_at=now if final else None)
+                    recovered += 1
+        return recovered
+
+    def remaining(self) -> int:
+        with self._lock:
+            return sum(1 for j in self._jobs.values() if j['status'] in (PENDING, LEASED))
+
+    def results(self, status: str = None) -> list:
+        with self._lock:
+            return [dict(j) for j in self._jobs.values() if status is None or j['status'] == status]
+
+    def stats(self) -> dict:
+        with self._lock:
+            counts = {PENDING: 0, LEASED: 0, DONE: 0, FAILED: 0}
+            for job in self._jobs.values():
+                counts[job['status']] += 1
+            nodes = [dict(n) for n in self._nodes.values()]
+        return {"jobs": counts, "nodes": _node_stats(nodes, time.time())}
+
+
+def open_ledger(location: str, lease_s: float = LEASE_S, max_attempts: int = MAX_ATTEMPTS,
+                share_root: str = None):
+    """'memory://' for the in-process stand-in, otherwise a SQLite file path."""
+    if location == 'memory://':
+        return MemoryLedger(lease_s, max_attempts)
+    return SQLiteLedger(location, lease_s, max_attempts, share_root)
+
+
+def _retry(call, *args):
+    """call(*args), retried with backoff while another node holds the ledger lock."""
+    delay = LOCK_BACKOFF_S
+    for attempt in range(LOCK_RETRIES):
+        try:
+            return call(*args)
+        except sqlite3.OperationalError as e:
+            if not _is_lock_error(e) or attempt == LOCK_RETRIES - 1:
+                raise
+            print(f"[ledger] {call.__name__} hit a locked ledger, retrying in {delay:.1f}s: {e}")
+            time.sleep(delay)
+            delay *= 2
+
+
+class _Heartbeat:
+    """Renews one job's lease in the background while it is processed."""
+
+    def __init__(self, ledger, job, interval_s):
+        self.ledger = ledger
+        self.job = job
+        self.interval_s = interval_s
+        self.lost = False
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval_s):
+            try:
+                if not self.ledger.heartbeat(self.job):
+                    self.lost = True
+                    print(f"[ledger] Lost lease on {os.path.basename(self.job['path'])}")
+                    return
+            except sqlite3.Error as e:
+                # A busy share is retried at the next beat; the lease has slack
+                print(f"[ledger] Heartbeat failed, will retry: {e}")
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._stop.set()
+        self._thread.join()
+        return False
+
+
+def run_worker(ledger, process, node: str = None, poll_s: float = POLL_S):
+    """
+    Claim and process videos until the ledger has none left.
+
+    process(path) -> (label, score). Between claims the worker also returns
+    expired leases of dead nodes to pending, so recovery needs no separate
+    supervisor. Returns (processed, failed) counts for this node.
+    """
+    node = node or default_node_id()
+    _retry(ledger.register_node, node)
+    processed = failed = 0
+    interval = ledger.lease_s * HEARTBEAT_FRACTION
+    while True:
+        recovered = _retry(ledger.recover_expired)
+        if recovered:
+            print(f"[ledger] Returned {recovered} expired lease(s) to the queue")
+        job = _retry(ledger.claim, node)
+        if job is None:
+            if _retry(ledger.remaining) == 0:
+                break
+            time.sleep(poll_s)  # others still hold leases; wait in case one expires
+            continue
+
+        name = os.path.basename(job['path'])
+        start = time.perf_counter()
+        with _Heartbeat(ledger, job, interval) as beat:
+            try:
+                label, score = process(job['path'])
+                error = None
+            except Exception as e:
+                error = f"{type(e).__name__}: {e}"
+        elapsed = time.perf_counter() - start
+
+        if error is not None:
+            _retry(ledger.fail, job, error, elapsed)
+            failed += 1
+            print(f"[ledger] {name} failed on attempt {job['attempts']}: {error}")
+        elif beat.lost or not _retry(ledger.complete, job, label, score, elapsed):
+            print(f"[ledger] {name}: lease was taken over, result discarded")
+        else:
+            processed += 1
+    stats = _retry(ledger.stats)
+    print(f"[ledger] Node {node} finished: {processed} processed, {failed} errors; "
+          f"ledger {stats['jobs']}")
+    return processed, failed
+
+
+def _expand(paths):
+    videos = []
+    for pth in paths:
+        if os.path.isdir(pth):
+            videos += glob.glob(os.path.join(pth, '*.mp4'))
+        else:
+            videos.append(pth)
+    return sorted(videos)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Inspect or fill a shared job ledger')
+    parser.add_argument('ledger', help='Ledger SQLite file on a filesystem every worker mounts')
+    parser.add_argument('--share-root', default=None,
+                        help="This node's mount point of the share (default: the ledger's directory)")
+    sub = parser.add_subparsers(dest='command', required=True)
+    enqueue = sub.add_parser('enqueue', help='Add videos (or directories of .mp4 files)')
+    enqueue.add_argument('videos', nargs='+')
+    sub.add_parser('stats', help='Job counts and per-node throughput')
+    sub.add_parser('recover', help='Return expired leases to the queue now')
+    results = sub.add_parser('results', help='Print path, status, label and score')
+    results.add_argument('--status', choices=[PENDING, LEASED, DONE, FAILED])
+    args = parser.parse_args()
+
+    ledger = SQLiteLedger(args.ledger, share_root=args.share_root)
+    if args.command == 'enqueue':
+        videos = _expand(args.videos)
+        print(f"Enqueued {ledger.enqueue(videos)} of {len(videos)} videos")
+    elif args.command == 'recover':
+        print(f"Recovered {ledger.recover_expired()} expired leases")
+    elif args.command == 'results':
+        for job in ledger.results(args.status):
+            score = 'N/A' if job['score'] is None else f"{job['score']:.3f}"
+            print(f"{job['path']}\t{job['status']}\t{job['label'] or job['error'] or ''}\t{score}")
+    else:
+        stats = ledger.stats()
+        print("Jobs: " + ", ".join(f"{k}={v}" for k, v in stats['jobs'].items()))
+        for n in stats['nodes']:
+            state = 'alive' if n['alive'] else f"dead ({n['last_seen_s']:.0f}s)"
+            print(f"  {n['node']:<32} {n['done']:>6} done {n['failed']:>4} failed "
+                  f"{n['videos_per_hour']:>8.1f}/h  util {n['utilization']:.0%}  {state}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,592 @@
+#!/usr/bin/env python3
+"""
+Offline load test for the FastAPI backend.
+
+Runs main.py in-process with deterministic stub models in place of
+EfficientNet, ImageBind, Whisper and the text classifier (plus the decoder,
+so no footage is needed), then drives /predict at fixed concurrency levels
+(closed loop) or Poisson arrival rates (open loop) and reports throughput,
+p50/p95/p99 latency, rejections and peak RSS per level. Open-loop latency is
+measured from each request's scheduled arrival, so time a request spends
+waiting for a free client counts against it (no coordinated omission).
+
+--cancel-fraction sends that share of requests with a job_id and cancels them
+through DELETE /jobs/{id} after --cancel-after seconds, reporting how many
+ended in 499 and how long they took to stop. --batch runs that many clips
+through the batch paths, ensemble_model.run_pipelined and a job ledger worked
+by --batch-nodes threads, with the same stubs.
+
+Each stub's latency and transient memory is configurable; by default they
+sleep, use --burn to spend real CPU (NumPy matmuls, which release the GIL)
+so the scheduler's core budget matters. Everything else - scheduler,
+fingerprint index, speech gate, planner, results store - is the real code.
+
+Needs the backend's Python requirements but no model weights, videos or
+network. Examples:
+    python src/backend/loadtest.py --concurrency 1,2,4,8 --requests 40
+    python src/backend/loadtest.py --rate 0.5,1,2 --duration 60 --burn
+    python src/backend/loadtest.py --concurrency 4 --cancel-fraction 0.25 --batch 16
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+import types
+import urllib.error
+import urllib.request
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+src_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, src_dir)
+
+from cancellation import NULL_TOKEN, CANCELLED_STATUS
+from process_memory import memory_report
+
+
+class StubConfig:
+    """Latency / memory of each stub stage. Seconds are multiplied by time_scale."""
+
+    def __init__(self, args):
+        self.scale = args.time_scale
+        self.burn = args.burn
+        self.video_s = args.video_s
+        self.decode_s = args.decode_s
+        self.image_s_per_frame = args.image_ms_per_frame / 1000.0
+        self.imagebind_s_per_frame = args.imagebind_ms_per_frame / 1000.0
+        self.whisper_rtf = args.whisper_rtf
+        self.transformer_s = args.transformer_s
+        self.image_mb = args.image_mb
+        self.imagebind_mb = args.imagebind_mb
+        self.whisper_mb = args.whisper_mb
+        self.speech_fraction = args.speech_fraction
+
+
+def _seed(name):
+    return zlib.crc32(str(name).encode('utf-8'))
+
+
+def work(cfg, seconds, mb):
+    """Hold mb of memory for `seconds` (scaled), sleeping or burning CPU."""
+    seconds *= cfg.scale
+    held = np.ones(int(mb * 1024 * 1024 / 8)) if mb > 0 else None
+    if not cfg.burn:
+        time.sleep(seconds)
+    else:
+        a = np.random.default_rng(0).standard_normal((256, 256))
+        end = time.perf_counter() + seconds
+        while time.perf_counter() < end:
+            a = np.tanh(a @ a)
+    del held
+
+
+def install_stub_models(cfg):
+    """Put stub model modules in sys.modules before main.py imports the real ones."""
+    img = types.ModuleType('test_image_similarity_model')
+    img.FRAMES_PER_VIDEO = 400
+
+    def extract_video_feature(video_path, dedupe=False, stats=None, frames=None, num_frames=400,
+                              cancel=NULL_TOKEN):
+        cancel.check()
+        n = len(frames) if frames is not None else num_frames
+        passes = max(1, int(n * 0.7)) if dedupe else n  # dedupe keeps ~70% on typical footage
+        if stats is not None:
+            stats.update(frames=n, forward_passes=passes, saved=n - passes)
+        work(cfg, passes * cfg.image_s_per_frame, cfg.image_mb)
+        return np.random.default_rng(_seed(video_path)).random(16)
+
+    def cosine_similarity(vec, proto):
+        # Deterministic score in the interesting range around the thresholds
+        return 0.66 + 0.1 * float(vec[0])
+
+    img.extract_video_feature = extract_video_feature
+    img.cosine_similarity = cosine_similarity
+    img.extract_frames = lambda video_path, num_frames=400: []
+    sys.modules['test_image_similarity_model'] = img
+
+    ib = types.ModuleType('test_imagebind_similarity_model')
+
+    def extract_video_embedding(frames, cancel=NULL_TOKEN):
+        cancel.check()
+        work(cfg, len(frames) * cfg.imagebind_s_per_frame, cfg.imagebind_mb)
+        return np.random.default_rng(len(frames)).random(16)
+
+    ib.extract_frames = lambda video_path, num_frames=400: []
+    ib.extract_video_embedding = extract_video_embedding
+    ib.cosine_sim = cosine_similarity
+    sys.modules['test_imagebind_similarity_model'] = ib
+
+
+class StubTranscriber:
+    def __init__(self, cfg, model_name):
+        self.cfg = cfg
+        self.model_name = model_name
+        self.beam_size = 5
+
+    def transcribe_file(self, audio, name=None, beam_size=None, cancel=NULL_TOKEN):
+        cancel.check()
+        audio_s = audio.size / 16000 if isinstance(audio, np.ndarray) else self.cfg.video_s
+        rtf = self.cfg.whisper_rtf * (0.6 if (beam_size or self.beam_size) == 1 else 1.0)
+        work(self.cfg, audio_s * rtf, self.cfg.whisper_mb)
+        text = "stub transcript for " + str(name)
+        return {"text": text, "segments": [], "language": "en", "language_probability": 1.0}
+
+
+def patch_pipeline(cfg, main):
+    """Swap decode, Whisper and the classifier subprocess for stubs in the loaded app."""
+    import demux
+    import speech_gate
+
+    def demux_video(video_path, num_frames=400, with_audio=True, threads=0):
+        work(cfg, cfg.decode_s, 0)
+        rng = np.random.default_rng(_seed(video_path))
+        frames = [rng.integers(0, 255, (24, 32, 3), dtype=np.uint8) for _ in range(num_frames)]
+        audio = (rng.standard_normal(int(cfg.video_s * 16000)) * 0.05).astype(np.float32)
+        return demux.DemuxedVideo(video_path, frames, audio, cfg.video_s, 30.0, 1920, 1080,
+                                  int(cfg.video_s * 30))
+
+    def speech_timestamps(audio):
+        # Deterministic per clip: a fixed fraction of clips has speech
+        duration = audio.size / 16000
+        has_speech = (zlib.crc32(audio[:64].tobytes()) % 1000) / 1000.0 < cfg.speech_fraction
+        return [(0.0, duration * 0.5)] if has_speech else []
+
+    def predict_traffic_from_transformer(model_path, transcript_text, num_threads=None,
+                                         cancel=NULL_TOKEN):
+        cancel.check()
+        work(cfg, cfg.transformer_s, 0)
+        conf = 0.85 + 0.15 * ((_seed(transcript_text) % 100) / 100.0)
+        label = 'traffic_pedestrian' if _seed(transcript_text) % 3 == 0 else 'other'
+        return label, conf
+
+    transcribers = {}
+    lock = threading.Lock()
+
+    def get_transcriber(model_name='large-v3', device='auto', compute_type='default',
+                        cpu_threads=0, num_workers=1, chunk_workers=1):
+        with lock:
+            return transcribers.setdefault(model_name, StubTranscriber(cfg, model_name))
+
+    speech_gate.speech_timestamps = speech_timestamps
+    # ensemble_model_full runs ensemble_model's stages, so patching them covers both
+    main.ensemble_model.demux_video = demux_video
+    main.ensemble_model.get_transcriber = get_transcriber
+    main.ensemble_model.predict_traffic_from_transformer = predict_traffic_from_transformer
+    main.probe_video = lambda path: {"duration_s": cfg.video_s, "width": 1920, "height": 1080, "fps": 30.0}
+
+
+def start_app(cfg, port, workdir):
+    """Import main.py with stubs and serve it on a background thread."""
+    os.environ.setdefault('SHPD_RESULTS_DB', os.path.join(workdir, 'results.db'))
+    os.environ.setdefault('SHPD_FINGERPRINT_INDEX', os.path.join(workdir, 'fingerprints.db'))
+    os.environ.setdefault('SHPD_PROFILE_DIR', os.path.join(workdir, 'profiles'))
+    install_stub_models(cfg)
+    import main
+    patch_pipeline(cfg, main)
+
+    import uvicorn
+    server = uvicorn.Server(uvicorn.Config(main.app, host='127.0.0.1', port=port, log_level='warning'))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    deadline = time.time() + 30
+    while not server.started:
+        if time.time() > deadline:
+            raise RuntimeError("Backend did not start")
+        time.sleep(0.05)
+    return server, thread
+
+
+def http(base_url, path, method='GET', payload=None, timeout=60.0):
+    """Status code of one request; 0 if it did not get a response."""
+    data = json.dumps(payload).encode('utf-8') if payload is not None else None
+    request = urllib.request.Request(base_url + path, data=data, method=method,
+                                     headers={'Content-Type': 'application/json'})
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as res:
+            res.read()
+            return res.status
+    except urllib.error.HTTPError as e:
+        return e.code
+    except Exception:
+        return 0
+
+
+def post_predict(base_url, payload, timeout, scheduled=None):
+    """
+    (status, latency, finished) of one /predict call.
+
+    Latency runs from `scheduled` (the intended send time) when given, so a
+    request that waited for a client thread is charged for the wait.
+    """
+    start = time.perf_counter() if scheduled is None else scheduled
+    status = http(base_url, '/predict', 'POST', payload, timeout)
+    finished = time.perf_counter()
+    return status, finished - start, finished
+
+
+class JobCanceller:
+    """Cancels chosen requests through DELETE /jobs/{id} after a delay."""
+
+    def __init__(self, base_url, fraction, after_s, seed):
+        self.base_url = base_url
+        self.fraction = fraction
+        self.after_s = after_s
+        self.rng = random.Random(seed)
+        self.sent = {}        # job_id -> time the DELETE was sent
+        self.accepted = 0     # DELETEs that found the job running
+        self.listed_max = 0   # most jobs GET /jobs reported at once
+        self._lock = threading.Lock()
+        self._timers = []
+
+    def prepare(self, payload, i):
+        """Give payload a job_id and schedule its cancel, for a `fraction` of requests."""
+        with self._lock:
+            if self.fraction <= 0 or self.rng.random() >= self.fraction:
+                return payload
+        job_id = f"loadtest-{i:06d}"
+        timer = threading.Timer(self.after_s, self._cancel, (job_id,))
+        timer.daemon = True
+        with self._lock:
+            self._timers.append(timer)
+        timer.start()
+        return dict(payload, job_id=job_id)
+
+    def _cancel(self, job_id):
+        try:
+            with urllib.request.urlopen(self.base_url + '/jobs', timeout=10) as res:
+                listed = len(json.loads(res.read()))
+        except Exception:
+            listed = 0
+        sent = time.perf_counter()
+        status = http(self.base_url, f'/jobs/{job_id}', 'DELETE', timeout=10)
+        with self._lock:
+            self.listed_max = max(self.listed_max, listed)
+            if status == 200:
+                self.sent[job_id] = sent
+                self.accepted += 1
+
+    def stop_s(self, job_id, finished):
+        """Seconds from the accepted DELETE to the request returning, or None."""
+        with self._lock:
+            sent = self.sent.get(job_id)
+        return None if sent is None else finished - sent
+
+    def close(self):
+        for timer in self._timers:
+            timer.cancel()
+
+
+class RssSampler:
+    """Samples this process's RSS while a load level runs."""
+
+    def __init__(self, interval=0.2):
+        self.interval = interval
+        self.peak_mb = 0.0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.is_set():
+            rss = memory_report()['rss_mb']
+            if rss is not None:
+                self.peak_mb = max(self.peak_mb, rss)
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._stop.set()
+        self._thread.join()
+        return False
+
+
+def _pct(ordered, q):
+    return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))] if ordered else float('nan')
+
+
+def summarize(label, results, wall_s, peak_mb, canceller=None):
+    """results: (status, latency_s, job_id, finished) per request."""
+    ok = sorted(lat for status, lat, _, _ in results if status == 200)
+    rejected = sum(1 for status, _, _, _ in results if status == 503)
+    cancelled = [r for r in results if r[0] == CANCELLED_STATUS]
+    errors = len(results) - len(ok) - rejected - len(cancelled)
+
+    def pct(q):
+        return _pct(ok, q)
+
+    row = {
+        "level": label,
+        "sent": len(results),
+        "ok": len(ok),
+        "rejected": rejected,
+        "errors": errors,
+        "throughput_per_s": len(ok) / wall_s if wall_s > 0 else 0.0,
+        "p50_s": pct(0.50),
+        "p95_s": pct(0.95),
+        "p99_s": pct(0.99),
+        "peak_rss_mb": peak_mb,
+        "cancelled": len(cancelled),
+    }
+    if canceller is not None:
+        stops = sorted(s for s in (canceller.stop_s(job_id, finished)
+                                   for _, _, job_id, finished in cancelled) if s is not None)
+        row.update(cancel_sent=canceller.accepted, jobs_listed_max=canceller.listed_max,
+                   cancel_stop_p50_s=_pct(stops, 0.50), cancel_stop_p95_s=_pct(stops, 0.95))
+    return row
+
+
+def payload_for(i, args):
+    payload = {"filepath": f"/loadtest/clip_{i:06d}.mp4", "use_imagebind": args.imagebind}
+    if args.mode:
+        payload["mode"] = args.mode
+    return payload
+
+
+def send(base_url, payload, args, canceller, i, scheduled=None):
+    payload = canceller.prepare(payload, i) if canceller is not None else payload
+    status, latency, finished = post_predict(base_url, payload, args.timeout, scheduled)
+    return status, latency, payload.get('job_id'), finished
+
+
+def make_canceller(base_url, args):
+    if args.cancel_fraction <= 0:
+        return None
+    return JobCanceller(base_url, args.cancel_fraction, args.cancel_after, args.seed)
+
+
+def run_closed_loop(base_url, concurrency, total, args, counter):
+    """`concurrency` clients, each sending its next request when the last returns."""
+    results = []
+    lock = threading.Lock()
+    canceller = make_canceller(base_url, args)
+
+    def client():
+        while True:
+            with lock:
+                if counter['sent'] >= counter['limit']:
+                    return
+                counter['sent'] += 1
+                i = counter['next']
+                counter['next'] += 1
+            outcome = send(base_url, payload_for(i, args), args, canceller, i)
+            with lock:
+                results.append(outcome)
+
+    counter['sent'] = 0
+    counter['limit'] = total
+    start = time.perf_counter()
+    with RssSampler() as rss:
+        threads = [threading.Thread(target=client) for _ in range(concurrency)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+    if canceller is not None:
+        canceller.close()
+    return summarize(f"concurrency={concurrency}", results, time.perf_counter() - start, rss.peak_mb,
+                     canceller)
+
+
+def run_open_loop(base_url, rate, duration, args, counter):
+    """
+    Poisson arrivals at `rate` requests/s for `duration` seconds.
+
+    Each request is timed from its scheduled arrival, not from when a pool
+    thread got to it, so a saturated client pool shows up as latency.
+    """
+    rng = random.Random(args.seed)
+    futures = []
+    canceller = make_canceller(base_url, args)
+    start = time.perf_counter()
+    with RssSampler() as rss, ThreadPoolExecutor(max_workers=args.max_clients) as pool:
+        next_at = start
+        while next_at - start < duration:
+            delay = next_at - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            i = counter['next']
+            counter['next'] += 1
+            futures.append(pool.submit(send, base_url, payload_for(i, args), args, canceller, i, next_at))
+            next_at += rng.expovariate(rate)
+        results = [f.result() for f in futures]
+    if canceller is not None:
+        canceller.close()
+    return summarize(f"rate={rate}/s", results, time.perf_counter() - start, rss.peak_mb, canceller)
+
+
+def batch_row(label, latencies, errors, wall_s, peak_mb):
+    ordered = sorted(latencies)
+    return {
+        "level": label,
+        "sent": len(latencies) + errors,
+        "ok": len(latencies),
+        "rejected": 0,
+        "errors": errors,
+        "throughput_per_s": len(latencies) / wall_s if wall_s > 0 else 0.0,
+        "p50_s": _pct(ordered, 0.50),
+        "p95_s": _pct(ordered, 0.95),
+        "p99_s": _pct(ordered, 0.99),
+        "peak_rss_mb": peak_mb,
+        "cancelled": 0,
+    }
+
+
+def run_batch(size, nodes, args, counter):
+    """
+    The batch paths on `size` stub clips: run_pipelined, then a memory job
+    ledger worked by `nodes` threads calling classify_video. Pipelined
+    latency is each clip's completion time from the start of the batch.
+    """
+    import main
+    from job_ledger import open_ledger, run_worker
+
+    def clips():
+        paths = [f"/loadtest/batch_{counter['next'] + k:06d}.mp4" for k in range(size)]
+        counter['next'] += size
+        return paths
+
+    rows = []
+    latencies, errors = [], 0
+    start = time.perf_counter()
+    with RssSampler() as rss:
+        for item in main.ensemble_model.run_pipelined(
+            clips(), main.img_proto, main.WHISPER_MODEL, 'cpu', 'int8', main.TRANSFORMER_CKPT,
+            stage_threads=main.scheduler.pipeline_allocation(), min_speech_s=main.min_speech_s,
+            queue_size=args.queue_size
+        ):
+            if item.error is not None:
+                errors += 1
+            else:
+                latencies.append(time.perf_counter() - start)
+    rows.append(batch_row(f"pipelined n={size}", latencies, errors, time.perf_counter() - start,
+                          rss.peak_mb))
+
+    # Ledger nodes run whole predictions side by side, like admitted /predict requests
+    allocation = main.scheduler.stage_allocation()
+    ledger = open_ledger('memory://')
+    ledger.enqueue(clips())
+    latencies, lock = [], threading.Lock()
+
+    def process(path):
+        began = time.perf_counter()
+        label, score = main.ensemble_model.classify_video(
+            path, main.img_proto, main.WHISPER_MODEL, 'cpu', 'int8', main.TRANSFORMER_CKPT,
+            stage_threads=allocation
+        )
+        with lock:
+            latencies.append(time.perf_counter() - began)
+        return label, score
+
+    start = time.perf_counter()
+    with RssSampler() as rss:
+        workers = [threading.Thread(target=run_worker, args=(ledger, process, f"node-{n}", 0.1))
+                   for n in range(nodes)]
+        for t in workers:
+            t.start()
+        for t in workers:
+            t.join()
+    failed = ledger.stats()['jobs']['failed']
+    rows.append(batch_row(f"ledger x{nodes}", latencies, failed, time.perf_counter() - start,
+                          rss.peak_mb))
+    return rows
+
+
+def _secs(value, width=0, unit=''):
+    """Seconds with two decimals, or '-' for a percentile of no samples (NaN)."""
+    text = '-' if value != value else f"{value:.2f}{unit}"
+    return f"{text:>{width}}"
+
+
+def print_table(rows):
+    print(f"\n{'level':<18}{'sent':>6}{'ok':>6}{'503':>6}{'499':>6}{'err':>6}{'req/s':>9}"
+          f"{'p50':>8}{'p95':>8}{'p99':>8}{'peakMB':>9}")
+    for r in rows:
+        print(f"{r['level']:<18}{r['sent']:>6}{r['ok']:>6}{r['rejected']:>6}{r['cancelled']:>6}"
+              f"{r['errors']:>6}{r['throughput_per_s']:>9.2f}{_secs(r['p50_s'], 8)}{_secs(r['p95_s'], 8)}"
+              f"{_secs(r['p99_s'], 8)}{r['peak_rss_mb']:>9.0f}")
+        if 'cancel_sent' in r:
+            print(f"{'':<18}cancels accepted {r['cancel_sent']}, stopped p50 "
+                  f"{_secs(r['cancel_stop_p50_s'], unit='s')} p95 {_secs(r['cancel_stop_p95_s'], unit='s')}, "
+                  f"GET /jobs max {r['jobs_listed_max']}")
+
+
+def _floats(text):
+    return [float(x) for x in text.split(',') if x]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Offline load test for the backend with stub models')
+    parser.add_argument('--concurrency', default='1,2,4', help='Closed-loop client counts, e.g. 1,2,4,8')
+    parser.add_argument('--requests', type=int, default=20, help='Requests per concurrency level')
+    parser.add_argument('--rate', default='', help='Open-loop arrival rates in req/s, e.g. 0.5,1,2')
+    parser.add_argument('--duration', type=float, default=30.0, help='Seconds per arrival-rate level')
+    parser.add_argument('--max-clients', type=int, default=64, help='Open-loop in-flight request cap')
+    parser.add_argument('--imagebind', action='store_true', help='Send use_imagebind=true')
+    parser.add_argument('--mode', default=None, help='Send a planner mode (fast/balanced/thorough)')
+    parser.add_argument('--cancel-fraction', type=float, default=0.0,
+                        help='Share of requests cancelled through DELETE /jobs/{id}')
+    parser.add_argument('--cancel-after', type=float, default=1.0,
+                        help='Seconds after sending that a request is cancelled')
+    parser.add_argument('--batch', type=int, default=0,
+                        help='Also run this many clips through run_pipelined and a job ledger')
+    parser.add_argument('--batch-nodes', type=int, default=2, help='Ledger worker threads for --batch')
+    parser.add_argument('--queue-size', type=int, default=1, help='run_pipelined queue size for --batch')
+    parser.add_argument('--timeout', type=float, default=600.0)
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', default=None, help='Also write the results to this file')
+    # Stub model profile
+    parser.add_argument('--time-scale', type=float, default=1.0, help='Multiply every stub latency')
+    parser.add_argument('--burn', action='store_true', help='Spend CPU instead of sleeping')
+    parser.add_argument('--video-s', type=float, default=60.0, help='Stub clip length')
+    parser.add_argument('--decode-s', type=float, default=0.2)
+    parser.add_argument('--image-ms-per-frame', type=float, default=1.0)
+    parser.add_argument('--imagebind-ms-per-frame', type=float, default=3.0)
+    parser.add_argument('--whisper-rtf', type=float, default=0.02, help='Whisper seconds per audio second')
+    parser.add_argument('--transformer-s', type=float, default=0.2)
+    parser.add_argument('--image-mb', type=float, default=50.0, help='Transient memory per image stage')
+    parser.add_argument('--imagebind-mb', type=float, default=100.0)
+    parser.add_argument('--whisper-mb', type=float, default=200.0)
+    parser.add_argument('--speech-fraction', type=float, default=0.8,
+                        help='Fraction of clips the stub VAD reports speech in')
+    args = parser.parse_args()
+
+    cfg = StubConfig(args)
+    workdir = tempfile.mkdtemp(prefix='shpd-loadtest-')
+    server, thread = start_app(cfg, args.port, workdir)
+    base_url = f"http://127.0.0.1:{args.port}"
+    print(f"Backend with stub models on {base_url} (state in {workdir})")
+
+    counter = {'next': 0, 'sent': 0, 'limit': 0}
+    rows = []
+    try:
+        for level in _floats(args.concurrency):
+            rows.append(run_closed_loop(base_url, int(level), args.requests, args, counter))
+            print_table(rows[-1:])
+        for rate in _floats(args.rate):
+            rows.append(run_open_loop(base_url, rate, args.duration, args, counter))
+            print_table(rows[-1:])
+        if args.batch > 0:
+            rows += run_batch(args.batch, args.batch_nodes, args, counter)
+            print_table(rows[-2:])
+    finally:
+        server.should_exit = True
+        thread.join(timeout=10)
+
+    print_table(rows)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(rows, f, indent=2)
+        print(f"Results written to {args.json}")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,14 +1,30 @@
 # backend/main.py
-from fastapi import FastAPI
+from fastapi import FastAPI, HTTPException, Request
 from pydantic import BaseModel
+from starlette.concurrency import run_in_threadpool
+from typing import List, Optional
+import asyncio
 import os
 import sys
+import uuid
 
 # Ensure src/backend is in path
 sys.path.append(os.path.dirname(__file__))
 
 # Import both implementations
 import ensemble_model
+from scheduler import ResourceScheduler, SchedulerRejected
+from video_fingerprint import FingerprintIndex, DUPLICATE_SIM_THRESH
+from speech_gate import whisper_costs, MIN_SPEECH_S
+from results_store import ResultsStore, DuplicateVideoId, default_tag
+from process_memory import memory_report
+from profiling import make_profiler
+from planner import plan_prediction, cost_model, whisper_model_key, MODES
+from demux import probe_video, FRAMES_PER_VIDEO
+from single_flight import SingleFlight, file_identity, transcript_flight
+from cancellation import CancelToken, Cancelled, JobRegistry, NULL_TOKEN, CANCELLED_STATUS
+from worker_board import board_from_env
+from model_bundle import bundled_path, bundled_whisper_models
 try:
     import ensemble_model_full
     IMAGEBIND_AVAILABLE = True
@@ -18,12 +34,50 @@ except ImportError:
 
 app = FastAPI()
 
+# Global CPU budget shared by all concurrent /predict calls
+scheduler = ResourceScheduler.from_env()
+scheduler.apply_torch_threads()
+
 class PredictRequest(BaseModel):
     filepath: str
     use_imagebind: bool = False  # default off
+    profile: bool = False  # write CPU / memory / torch profiles for this request
+    mode: Optional[str] = None  # fast | balanced | thorough (see planner.py)
+    latency_budget_s: Optional[float] = None
+    job_id: Optional[str] = None  # client-chosen id for DELETE /jobs/{job_id}
+
+class VideoRecord(BaseModel):
+    filename: str
+    prediction: str
+    tag: Optional[str] = None
+    score: Optional[float] = None
+    id: Optional[str] = None
+
+class TagUpdateRequest(BaseModel):
+    tag: str
+    ids: List[str] = []
+    filenames: List[str] = []
+
+class DeleteVideosRequest(BaseModel):
+    filenames: List[str]
+
+class ImportRequest(BaseModel):
+    path: str
 
 # Load shared prototypes once
 base_dir = os.path.dirname(__file__)
+
+# Model name or a local CTranslate2 directory (serve.py resolves it before forking)
+WHISPER_MODEL = os.environ.get('SHPD_WHISPER_MODEL', 'large-v3')
+# Whisper models the planner may switch to. Each one is another resident
+# model, and one outside the bundle is downloaded on first use, so by default
+# only the bundled models (or WHISPER_MODEL alone without a bundle) are used
+if os.environ.get('SHPD_PLAN_WHISPER_MODELS'):
+    PLAN_WHISPER_MODELS = set(os.environ['SHPD_PLAN_WHISPER_MODELS'].split(','))
+else:
+    PLAN_WHISPER_MODELS = bundled_whisper_models() or {whisper_model_key(WHISPER_MODEL)}
+# Text classifier checkpoint, verified once from the local model bundle if there is one
+TRANSFORMER_CKPT = bundled_path('text_model_v1', os.path.join(base_dir, 'text_model_v1.pth'))
 img_proto = ensemble_model.load_image_similarity_prototype(
     os.path.join(base_dir, 'image_similarity_model_efficientnet_b4.h5')
 )
@@ -34,29 +88,272 @@ if IMAGEBIND_AVAILABLE:
 else:
     ib_proto = None
 
+# Fingerprints of classified videos, so re-exported copies reuse their result
+fingerprint_index = FingerprintIndex(
+    os.environ.get('SHPD_FINGERPRINT_INDEX', os.path.join(base_dir, 'video_fingerprints.db')),
+    similarity_threshold=float(os.environ.get('SHPD_DUP_THRESHOLD', DUPLICATE_SIM_THRESH))
+)
+
+# Classified videos; replaces the Electron app's videos.json
+results_store = ResultsStore(
+    os.environ.get('SHPD_RESULTS_DB', os.path.join(base_dir, 'results.db'))
+)
+
+# Clips with less detected speech than this skip Whisper entirely
+min_speech_s = float(os.environ.get('SHPD_MIN_SPEECH_S', MIN_SPEECH_S))
+
+# Shared by serve.py's workers (SHPD_WORKER_DB); None for a single process
+worker_board = board_from_env()
+
+# Identical requests already in flight share one pipeline run, across workers
+prediction_flight = SingleFlight('predict', board=worker_board)
+
+# Running predictions, so abandoned ones can be cancelled from any worker
+jobs = JobRegistry(board=worker_board)
+DISCONNECT_POLL_S = 1.0
+
 # Endpoint with toggle support
 @app.post("/predict")
-def predict(req: PredictRequest):
-    if req.use_imagebind and IMAGEBIND_AVAILABLE:
-        result = ensemble_model_full.classify_video(
-            req.filepath,
-            img_proto,
-            ib_proto,
-            whisper_model_name='large-v3',
-            whisper_device='cpu',
-            whisper_compute='int8',
-            transformer_ckpt=os.path.join(base_dir, 'text_model_v1.pth')
-        )
+async def predict(req: PredictRequest, request: Request):
+    # The pipeline runs on the threadpool as before; this coroutine only
+    # watches for the client going away and cancels the job if it does
+    job_id = req.job_id or uuid.uuid4().hex
+    work = asyncio.ensure_future(run_in_threadpool(predict_job, req, job_id))
+    while not work.done():
+        await asyncio.wait({work}, timeout=DISCONNECT_POLL_S)
+        if not work.done() and await request.is_disconnected():
+            if jobs.cancel(job_id, "client disconnected"):
+                print(f"[{os.path.basename(req.filepath)}] Client disconnected, cancelling job {job_id}")
+    return work.result()
+
+
+def predict_job(req: PredictRequest, job_id: str):
+    token = CancelToken()
+    try:
+        jobs.start(job_id, token, req.filepath)
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    cancelled = False
+    try:
+        plan = plan_request(req)
+
+        def run():
+            ticket = scheduler.admit(cancel=token)
+            try:
+                # A profiled run waits for its turn (see profiling.py) before taking a slot
+                with make_profiler(req.profile, req.filepath, cancel=token) as profiler:
+                    with ticket:
+                        label, score = run_prediction(req, profiler, plan, token)
+            except Cancelled:
+                reclaimed = max(0.0, estimate_cost_s(req, plan) - ticket.run_s)
+                jobs.record_reclaimed(reclaimed)
+                print(f"[{os.path.basename(req.filepath)}] Cancelled ({token.reason}) after "
+                      f"{ticket.run_s:.1f}s, ~{reclaimed:.1f}s of pipeline time reclaimed")
+                raise
+            # Plain values: a follower in another worker receives this as JSON
+            return {"label": label, "score": score, "queue_wait_s": ticket.wait_s,
+                    "run_s": ticket.run_s, "profile_dir": profiler.out_dir}
+
+        if req.profile:
+            # A profiled request wants its own profile, not someone else's
+            outcome, coalesced = run(), False
+        else:
+            outcome, coalesced = prediction_flight.do(
+                prediction_key(req, plan), run,
+                context=token, on_join=lambda shared: join_job(job_id, shared), cancel=token
+            )
+        label, score = outcome["label"], outcome["score"]
+        # Stored under this caller's path: a coalesced request may have named
+        # the same file through a symlink or another mount
+        record = results_store.upsert(req.filepath, label, score, tag=default_tag(label))
+    except SchedulerRejected as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except Cancelled as e:
+        cancelled = True
+        raise HTTPException(status_code=CANCELLED_STATUS, detail=f"Cancelled: {e}")
+    finally:
+        jobs.finish(job_id, cancelled)
+    if coalesced:
+        print(f"[{os.path.basename(req.filepath)}] Joined an identical in-flight prediction")
+    return {
+        "id": record["id"],
+        "job_id": job_id,
+        "prediction": label,
+        "score": score,
+        "tag": record["tag"],
+        "queue_wait_s": outcome["queue_wait_s"],
+        "run_s": outcome["run_s"],
+        "profile_dir": outcome["profile_dir"],
+        "plan": plan.as_dict() if plan else None,
+        "coalesced": coalesced,
+    }
+
+
+def join_job(job_id: str, shared_token) -> bool:
+    """A coalesced job keeps the shared run alive until it is cancelled too."""
+    if not shared_token.retain():
+        return False  # that run is already stopping; start a new one after it
+    jobs.attach(job_id, shared_token)
+    return True
+
+
+def estimate_cost_s(req: PredictRequest, plan=None) -> float:
+    """Planner estimate of a full run, for reporting reclaimed time."""
+    if plan is not None:
+        return plan.estimate_s
+    try:
+        info = probe_video(req.filepath)
+    except Exception:
+        return 0.0
+    megapixels = info['width'] * info['height'] / 1e6
+    estimate, _ = cost_model.estimate(
+        info['duration_s'], megapixels, FRAMES_PER_VIDEO, WHISPER_MODEL, 5,
+        req.use_imagebind and IMAGEBIND_AVAILABLE
+    )
+    return estimate
+
+
+def prediction_key(req: PredictRequest, plan=None):
+    """File identity plus everything that changes the pipeline's output."""
+    if plan is not None:
+        config = (plan.num_frames, plan.whisper_model, plan.beam_size, plan.use_imagebind)
     else:
-        if req.use_imagebind and not IMAGEBIND_AVAILABLE:
-            print("ImageBind requested but not available, using basic ensemble")
-        result = ensemble_model.classify_video(
-            req.filepath,
-            img_proto,
-            whisper_model_name='large-v3',
-            whisper_device='cpu',
-            whisper_compute='int8',
-            transformer_ckpt=os.path.join(base_dir, 'text_model_v1.pth')
-        )
-    label, score = result
-    return {"prediction": label, "score": score}
+        config = (req.use_imagebind and IMAGEBIND_AVAILABLE,)
+    return (file_identity(req.filepath), WHISPER_MODEL, min_speech_s) + config
+
+
+def plan_request(req: PredictRequest):
+    """Plan for requests that ask for a mode or latency budget; None keeps use_imagebind."""
+    if req.mode is None and req.latency_budget_s is None:
+        return None
+    mode = req.mode or 'balanced'
+    if mode not in MODES:
+        raise HTTPException(status_code=400, detail=f"mode must be one of {list(MODES)}")
+    try:
+        info = probe_video(req.filepath)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Could not read {req.filepath}: {e}")
+    plan = plan_prediction(
+        info['duration_s'], info['width'], info['height'],
+        mode=mode, budget_s=req.latency_budget_s,
+        imagebind_available=IMAGEBIND_AVAILABLE,
+        whisper_models=PLAN_WHISPER_MODELS
+    )
+    print(f"[{os.path.basename(req.filepath)}] Plan: {plan.as_dict()}")
+    return plan
+
+
+@app.get("/videos")
+def list_videos(search: Optional[str] = None, prediction: Optional[str] = None,
+                tag: Optional[str] = None, since: Optional[float] = None,
+                until: Optional[float] = None, limit: int = 100, offset: int = 0):
+    return results_store.query(
+        search=search, prediction=prediction, tag=tag,
+        since=since, until=until, limit=limit, offset=offset
+    )
+
+
+@app.post("/videos")
+def add_videos(videos: List[VideoRecord]):
+    try:
+        stored = results_store.upsert_many([v.model_dump() for v in videos])
+    except DuplicateVideoId as e:
+        raise HTTPException(status_code=409, detail={"message": str(e), "id": e.video_id})
+    return {"stored": len(stored)}
+
+
+@app.post("/videos/tags")
+def update_tags(req: TagUpdateRequest):
+    return {"updated": results_store.update_tags(req.tag, ids=req.ids, filenames=req.filenames)}
+
+
+@app.post("/videos/delete")
+def delete_videos(req: DeleteVideosRequest):
+    return {"deleted": results_store.delete(req.filenames)}
+
+
+@app.post("/videos/import")
+def import_videos(req: ImportRequest):
+    return {"imported": results_store.import_videos_json(req.path)}
+
+
+@app.get("/jobs")
+def list_jobs():
+    return jobs.running()
+
+
+@app.delete("/jobs/{job_id}")
+def cancel_job(job_id: str):
+    cancelled = jobs.cancel(job_id, "cancelled by client")
+    if cancelled is None:
+        raise HTTPException(status_code=404, detail=f"No running job {job_id}")
+    return cancelled
+
+
+@app.get("/stats/cancellation")
+def cancellation_stats():
+    return jobs.stats()
+
+
+@app.get("/stats/scheduler")
+def scheduler_stats():
+    return scheduler.stats()
+
+
+@app.get("/stats/planner")
+def planner_stats():
+    return dict(cost_model.snapshot(), whisper_models=sorted(PLAN_WHISPER_MODELS))
+
+
+@app.get("/stats/memory")
+def memory_stats():
+    return memory_report()
+
+
+@app.get("/stats/duplicates")
+def duplicate_stats():
+    return fingerprint_index.stats()
+
+
+@app.get("/stats/coalescing")
+def coalescing_stats():
+    return {
+        "predictions": prediction_flight.stats(),
+        "transcripts": transcript_flight.stats(),
+    }
+
+
+@app.get("/stats/speech_gate")
+def speech_gate_stats():
+    return {
+        "min_speech_s": min_speech_s,
+        "whisper_skipped": whisper_costs.skipped,
+        "estimated_saved_s": whisper_costs.saved_s,
+        "whisper_rtf": whisper_costs.rtf,
+    }
+
+
+def run_prediction(req: PredictRequest, profiler, plan=None, cancel=NULL_TOKEN):
+    options = dict(
+        whisper_model_name=WHISPER_MODEL,
+        whisper_device='cpu',
+        whisper_compute='int8',
+        transformer_ckpt=TRANSFORMER_CKPT,
+        stage_threads=scheduler.stage_allocation(),
+        fingerprint_index=fingerprint_index,
+        min_speech_s=min_speech_s,
+        profiler=profiler,
+        cancel=cancel
+    )
+    use_imagebind = req.use_imagebind
+    if plan is not None:
+        use_imagebind = plan.use_imagebind
+        options.update(num_frames=plan.num_frames, beam_size=plan.beam_size)
+        if plan.whisper_model != 'large-v3':
+            options['whisper_model_name'] = plan.whisper_model
+
+    if use_imagebind and IMAGEBIND_AVAILABLE:
+        return ensemble_model_full.classify_video(req.filepath, img_proto, ib_proto, **options)
+    if use_imagebind and not IMAGEBIND_AVAILABLE:
+        print("ImageBind requested but not available, using basic ensemble")
+    return ensemble_model.classify_video(req.filepath, img_proto, **options)
@@ -0,0 +1,487 @@
+#!/usr/bin/env python3
+"""
+Local model bundle: every model the backend needs, loadable with no network.
+
+Without a bundle, EfficientNet weights come from torchvision's download
+cache, ImageBind is read with torch.load from .checkpoints/imagebind_huge.pth
+and Whisper large-v3 is resolved through the Hugging Face cache. A bundle is
+one directory holding:
+
+    manifest.json               versions, sha256 and size of every file
+    efficientnet_b4.safetensors
+    imagebind_huge.safetensors
+    whisper-large-v3/           CTranslate2 model directory (one per --whisper
+                                name; planner.py only uses bundled models)
+    text_model_v1.pth           text classifier, read by its own subprocess
+
+Torch weights are stored as safetensors and memory-mapped at load time: the
+model is built on the meta device (ImageBind: on CPU with weight init
+switched off) and the mapped tensors are assigned as its parameters, so
+nothing is copied or randomly initialised. Pages are read on
+first use, stay in the page cache across restarts, and are shared by every
+worker process that maps the same file. Checksums are verified the first
+time a file is used and the result is stamped in .verified.json (keyed by
+size and mtime), so later cold starts skip hashing gigabytes of weights.
+
+The bundle is found through SHPD_MODEL_BUNDLE, or src/backend/models if it
+has a manifest; without one every loader falls back to its old behaviour.
+
+CLI:
+    python model_bundle.py BUNDLE build [--imagebind-ckpt PATH] [--whisper large-v3] ...
+    python model_bundle.py BUNDLE verify
+    python model_bundle.py BUNDLE bench efficientnet_b4 [--runs 3]
+"""
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+BUNDLE_DIR = os.environ.get(
+    'SHPD_MODEL_BUNDLE',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'models')
+)
+MANIFEST = 'manifest.json'
+VERIFIED_STAMP = '.verified.json'
+FORMAT_VERSION = 1
+HASH_CHUNK = 16 * 1024 * 1024
+
+# safetensors dtype names
+_DTYPES = {
+    'F64': 'float64', 'F32': 'float32', 'F16': 'float16', 'BF16': 'bfloat16',
+    'I64': 'int64', 'I32': 'int32', 'I16': 'int16', 'I8': 'int8', 'U8': 'uint8', 'BOOL': 'bool',
+}
+
+
+class BundleError(Exception):
+    """Raised when a bundle is missing a model or a file fails verification."""
+
+
+def sha256_file(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+# ————————————————————————————————————————————————————————————
+# safetensors read (memory-mapped) / write
+# ————————————————————————————————————————————————————————————
+
+def read_safetensors_header(path: str):
+    with open(path, 'rb') as f:
+        size = int.from_bytes(f.read(8), 'little')
+        header = json.loads(f.read(size))
+    return header, 8 + size
+
+
+def load_safetensors_mmap(path: str) -> dict:
+    """State dict whose tensors are views of a private memory map of path."""
+    import torch
+    header, data_start = read_safetensors_header(path)
+    nbytes = os.path.getsize(path)
+    storage = torch.UntypedStorage.from_file(path, shared=False, nbytes=nbytes)
+    raw = torch.empty(0, dtype=torch.uint8).set_(storage)
+    state = {}
+    for name, info in header.items():
+        if name == '__metadata__':
+            continue
+        begin, end = info['data_offsets']
+        dtype = getattr(torch, _DTYPES[info['dtype']])
+        chunk = raw[data_start + begin:data_start + end]
+        try:
+            tensor = chunk.view(dtype)
+        except RuntimeError as e:
+            # save_safetensors aligns every tensor; anything else would have to be copied
+            raise BundleError(f"{os.path.basename(path)}: tensor {name} is not aligned for "
+                              f"{info['dtype']} and cannot be memory-mapped; rebuild the bundle") from e
+        state[name] = tensor.reshape(info['shape'])
+    return state
+
+
+def save_safetensors(state: dict, path: str, metadata: dict = None):
+    """
+    Write a state dict as safetensors.
+
+    Tensors are ordered by element size, largest first, so with the header
+    padded to 8 bytes every tensor starts aligned and can be mapped in place.
+    """
+    import torch
+    names = sorted(state, key=lambda n: (-state[n].element_size(), n))
+    reverse = {v: k for k, v in _DTYPES.items()}
+    header, offset = {}, 0
+    for name in names:
+        t = state[name]
+        size = t.numel() * t.element_size()
+        header[name] = {'dtype': reverse[str(t.dtype).replace('torch.', '')],
+                        'shape': list(t.shape), 'data_offsets': [offset, offset + size]}
+        offset += size
+    if metadata:
+        header['__metadata__'] = {k: str(v) for k, v in metadata.items()}
+    blob = json.dumps(header, separators=(',', ':')).encode('utf-8')
+    blob += b' ' * (-len(blob) % 8)
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(len(blob).to_bytes(8, 'little'))
+        f.write(blob)
+        for name in names:
+            t = state[name].detach().to('cpu').contiguous().reshape(-1)
+            f.write(t.view(torch.uint8).numpy().tobytes())
+    os.replace(tmp, path)
+
+
+# ————————————————————————————————————————————————————————————
+# architectures (built without weights)
+# ————————————————————————————————————————————————————————————
+
+def _build_efficientnet(arch: str):
+    import torch
+    import torchvision.models as models
+    model = getattr(models, arch)(weights=None)
+    model.classifier = torch.nn.Identity()  # feature extractor, as in test_image_similarity_model
+    return model
+
+
+def _build_imagebind(arch: str):
+    from imagebind.models.imagebind_model import imagebind_huge
+    return imagebind_huge(pretrained=False)
+
+
+ARCH_BUILDERS = {
+    'efficientnet': _build_efficientnet,
+    'imagebind': _build_imagebind,
+}
+# Families that can be constructed on the meta device. ImageBind computes its
+# drop-path rates with torch.linspace(...).item(), which meta tensors cannot
+# do, so it is built on CPU with weight init switched off instead.
+META_SAFE = {'efficientnet'}
+
+_INIT_FUNCTIONS = ('uniform_', 'normal_', 'trunc_normal_', 'constant_', 'ones_', 'zeros_',
+                   'xavier_uniform_', 'xavier_normal_', 'kaiming_uniform_', 'kaiming_normal_',
+                   'orthogonal_')
+_init_lock = threading.Lock()
+
+
+@contextmanager
+def _skip_init():
+    """
+    Make torch.nn.init a no-op while building a model whose weights are replaced.
+
+    Parameters are then allocated but never written, so their pages are not
+    touched before load_state_dict(assign=True) swaps in the mapped tensors.
+    The patch is process-wide, hence the lock.
+    """
+    import torch.nn.init as init
+    with _init_lock:
+        saved = {n: getattr(init, n) for n in _INIT_FUNCTIONS if hasattr(init, n)}
+        for n in saved:
+            setattr(init, n, lambda tensor, *args, **kwargs: tensor)
+        try:
+            yield
+        finally:
+            for n, fn in saved.items():
+                setattr(init, n, fn)
+
+
+class ModelBundle:
+    def __init__(self, path: str):
+        self.path = path
+        with open(os.path.join(path, MANIFEST), 'r', encoding='utf-8') as f:
+            self.manifest = json.load(f)
+        if self.manifest.get('format_version') != FORMAT_VERSION:
+            raise BundleError(f"Unsupported bundle format {self.manifest.get('format_version')}")
+        self.models = self.manifest['models']
+        self._verified = set()
+        self._lock = threading.Lock()
+
+    def __contains__(self, name):
+        return name in self.models
+
+    def entry(self, name: str) -> dict:
+        if name not in self.models:
+            raise BundleError(f"Model {name} is not in bundle {self.path}")
+        return self.models[name]
+
+    def _stamps(self) -> dict:
+        try:
+            with open(os.path.join(self.path, VERIFIED_STAMP), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _write_stamps(self, stamps: dict):
+        stamp_path = os.path.join(self.path, VERIFIED_STAMP)
+        try:
+            with open(stamp_path + '.tmp', 'w', encoding='utf-8') as f:
+                json.dump(stamps, f, indent=1)
+            os.replace(stamp_path + '.tmp', stamp_path)
+        except OSError as e:
+            # Read-only bundle: still verified, just again on the next start
+            print(f"[bundle] Could not record verification in {self.path}: {e}")
+
+    def verify(self, name: str, force: bool = False):
+        """Check the model's files against the manifest once; raises BundleError."""
+        with self._lock:
+            if name in self._verified and not force:
+                return
+            stamps = self._stamps()
+            changed = False
+            for rel, expected in self.entry(name)['files'].items():
+                full = os.path.join(self.path, rel)
+                try:
+                    st = os.stat(full)
+                except OSError:
+                    raise BundleError(f"{rel} is missing from bundle {self.path}")
+                if st.st_size != expected['bytes']:
+                    raise BundleError(f"{rel}: {st.st_size} bytes, manifest says {expected['bytes']}")
+                key = [st.st_size, st.st_mtime_ns, expected['sha256']]
+                if not force and stamps.get(rel) == key:
+                    continue
+                start = time.perf_counter()
+                digest = sha256_file(full)
+                if digest != expected['sha256']:
+                    raise BundleError(f"{rel}: checksum mismatch, bundle is corrupt or modified")
+                print(f"[bundle] Verified {rel} in {time.perf_counter() - start:.1f}s")
+                stamps[rel] = key
+                changed = True
+            if changed:
+                self._write_stamps(stamps)
+            self._verified.add(name)
+
+    def file_path(self, name: str) -> str:
+        """Verified path of a single-file or directory model."""
+        self.verify(name)
+        return os.path.join(self.path, self.entry(name)['path'])
+
+    def load_torch_model(self, name: str):
+        """Build the model's architecture and assign its memory-mapped weights."""
+        import torch
+        entry = self.entry(name)
+        self.verify(name)
+        start = time.perf_counter()
+        state = load_safetensors_mmap(os.path.join(self.path, entry['path']))
+        build = ARCH_BUILDERS[entry['family']]
+        if entry['family'] in META_SAFE:
+            with torch.device('meta'):
+                model = build(entry['arch'])
+        else:
+            with _skip_init():
+                model = build(entry['arch'])
+        model.load_state_dict(state, assign=True)
+
+        # Every parameter must now be a view of the mapping; anything else
+        # means the bundle does not match the architecture
+        mapping = next(iter(state.values())).untyped_storage().data_ptr()
+        leftover = [n for n, t in model.named_parameters()
+                    if t.is_meta or t.untyped_storage().data_ptr() != mapping]
+        leftover += [n for n, t in model.named_buffers() if t.is_meta]
+        if leftover:
+            raise BundleError(f"{name}: {len(leftover)} tensors not loaded from the bundle, "
+                              f"e.g. {leftover[:3]}")
+        model.memory_mapped = True
+        model.eval()
+        print(f"[bundle] Loaded {name} ({entry.get('version', '?')}) in "
+              f"{time.perf_counter() - start:.2f}s")
+        return model
+
+
+_bundle = None
+_bundle_loaded = False
+_bundle_lock = threading.Lock()
+
+
+def get_bundle():
+    """The configured ModelBundle, or None when there is no manifest."""
+    global _bundle, _bundle_loaded
+    with _bundle_lock:
+        if not _bundle_loaded:
+            _bundle_loaded = True
+            if os.path.exists(os.path.join(BUNDLE_DIR, MANIFEST)):
+                _bundle = ModelBundle(BUNDLE_DIR)
+                print(f"[bundle] Using model bundle {BUNDLE_DIR}")
+        return _bundle
+
+
+def bundled_path(name: str, default: str) -> str:
+    """Path of a bundled single-file/directory model, or default without one."""
+    bundle = get_bundle()
+    if bundle is None or name not in bundle:
+        return default
+    return bundle.file_path(name)
+
+
+def bundled_whisper_models():
+    """Names of the Whisper models in the bundle, or None without a bundle."""
+    bundle = get_bundle()
+    if bundle is None:
+        return None
+    return {name[len('whisper-'):] for name in bundle.models if name.startswith('whisper-')}
+
+
+def whisper_model_path(model_name: str) -> str:
+    """Local directory for a Whisper model name when the bundle has it."""
+    if os.path.isdir(model_name):
+        return model_name
+    return bundled_path(f"whisper-{model_name}", model_name)
+
+
+# ————————————————————————————————————————————————————————————
+# building
+# ————————————————————————————————————————————————————————————
+
+def _file_entries(bundle_dir: str, rel: str) -> dict:
+    full = os.path.join(bundle_dir, rel)
+    if os.path.isdir(full):
+        rels = []
+        for root, _, files in os.walk(full):
+            rels += [os.path.relpath(os.path.join(root, f), bundle_dir) for f in files]
+    else:
+        rels = [rel]
+    return {r.replace(os.sep, '/'): {'sha256': sha256_file(os.path.join(bundle_dir, r)),
+                                     'bytes': os.path.getsize(os.path.join(bundle_dir, r))}
+            for r in sorted(rels)}
+
+
+def build_bundle(out_dir, efficientnet='efficientnet_b4', imagebind_ckpt=None,
+                 whisper=('large-v3',), text_model=None):
+    """Write a bundle; needs network once for torchvision and Whisper downloads."""
+    import torch
+    os.makedirs(out_dir, exist_ok=True)
+    models = {}
+    environment = {'torch': torch.__version__}
+
+    if efficientnet:
+        import torchvision.models as tv_models
+        import torchvision
+        variant = efficientnet.split('_', 1)[1].upper()
+        weights = getattr(tv_models, f'EfficientNet_{variant}_Weights').DEFAULT
+        model = getattr(tv_models, efficientnet)(weights=weights)
+        model.classifier = torch.nn.Identity()
+        rel = f'{efficientnet}.safetensors'
+        save_safetensors(model.state_dict(), os.path.join(out_dir, rel), {'source': weights.url})
+        models[efficientnet] = {'kind': 'torch', 'family': 'efficientnet', 'arch': efficientnet,
+                                'path': rel, 'version': str(weights), 'source': weights.url}
+        environment['torchvision'] = torchvision.__version__
+        del model
+
+    if imagebind_ckpt:
+        state = torch.load(imagebind_ckpt, map_location='cpu')
+        rel = 'imagebind_huge.safetensors'
+        save_safetensors(state, os.path.join(out_dir, rel), {'source': os.path.basename(imagebind_ckpt)})
+        models['imagebind_huge'] = {'kind': 'torch', 'family': 'imagebind', 'arch': 'imagebind_huge',
+                                    'path': rel, 'version': f"imagebind_huge sha256:{sha256_file(imagebind_ckpt)[:16]}",
+                                    'source': os.path.abspath(imagebind_ckpt)}
+        del state
+
+    for name in whisper or ():
+        import faster_whisper
+        from faster_whisper.utils import download_model
+        rel = f'whisper-{name}'
+        download_model(name, output_dir=os.path.join(out_dir, rel))
+        models[rel] = {'kind': 'whisper', 'path': rel, 'version': f"faster-whisper {name}"}
+        environment['faster_whisper'] = faster_whisper.__version__
+
+    if text_model:
+        rel = os.path.basename(text_model)
+        shutil.copy2(text_model, os.path.join(out_dir, rel))
+        models[os.path.splitext(rel)[0]] = {'kind': 'file', 'path': rel,
+                                            'version': f"sha256:{sha256_file(text_model)[:16]}"}
+
+    for entry in models.values():
+        entry['files'] = _file_entries(out_dir, entry['path'])
+    manifest = {
+        'format_version': FORMAT_VERSION,
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'environment': environment,
+        'models': models,
+    }
+    with open(os.path.join(out_dir, MANIFEST), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2)
+    print(f"Wrote bundle {out_dir} with {', '.join(models)}")
+
+
+# ————————————————————————————————————————————————————————————
+# cold-start benchmark
+# ————————————————————————————————————————————————————————————
+
+def _load_once(bundle_dir: str, name: str, method: str) -> dict:
+    """Load one model in this (fresh) process and measure it."""
+    import torch
+    from process_memory import memory_report, peak_rss_mb
+    start = time.perf_counter()
+    bundle = ModelBundle(bundle_dir)
+    entry = bundle.entry(name)
+    if method == 'bundle':
+        model = bundle.load_torch_model(name)
+    else:
+        state = torch.load(entry['source'], map_location='cpu') if os.path.exists(entry['source']) \
+            else torch.hub.load_state_dict_from_url(entry['source'], map_location='cpu')
+        model = ARCH_BUILDERS[entry['family']](entry['arch'])
+        model.load_state_dict(state, strict=False)
+        model.eval()
+    load_s = time.perf_counter() - start
+    mem = memory_report()
+    return {'method': method, 'load_s': load_s, 'rss_mb': mem['rss_mb'],
+            'private_mb': (mem['private_clean_mb'] or 0) + (mem['private_dirty_mb'] or 0)
+            if mem['rss_mb'] is not None else None,
+            'peak_rss_mb': peak_rss_mb(), 'params': sum(p.numel() for p in model.parameters())}
+
+
+def bench(bundle_dir: str, name: str, runs: int = 3):
+    """Compare torch.load and the bundle loader, each in fresh processes."""
+    results = {'torch': [], 'bundle': []}
+    for _ in range(runs):
+        for method in results:
+            out = subprocess.check_output([sys.executable, os.path.abspath(__file__),
+                                           bundle_dir, '_load', name, '--method', method])
+            results[method].append(json.loads(out.decode().strip().splitlines()[-1]))
+    print(f"\n{name}: median of {runs} fresh processes")
+    print(f"{'method':<8}{'load s':>9}{'RSS MB':>9}{'private MB':>12}{'peak MB':>9}")
+    for method, rows in results.items():
+        def median(key):
+            values = sorted(r[key] or 0 for r in rows)
+            return values[len(values) // 2]
+        print(f"{method:<8}{median('load_s'):>9.2f}{median('rss_mb'):>9.0f}"
+              f"{median('private_mb'):>12.0f}{median('peak_rss_mb'):>9.0f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Build, verify or benchmark a local model bundle')
+    parser.add_argument('bundle', help='Bundle directory')
+    sub = parser.add_subparsers(dest='command', required=True)
+    build = sub.add_parser('build', help='Convert and copy models into the bundle (needs network once)')
+    build.add_argument('--efficientnet', default='efficientnet_b4', help="'' to leave out")
+    build.add_argument('--imagebind-ckpt', default=None, help='e.g. .checkpoints/imagebind_huge.pth')
+    build.add_argument('--whisper', nargs='*', default=['large-v3'], help='Whisper model names')
+    build.add_argument('--text-model', default=None, help='e.g. text_model_v1.pth')
+    sub.add_parser('verify', help='Re-hash every file against the manifest')
+    bench_p = sub.add_parser('bench', help='Cold start: torch.load vs memory-mapped bundle')
+    bench_p.add_argument('model')
+    bench_p.add_argument('--runs', type=int, default=3)
+    load_p = sub.add_parser('_load')
+    load_p.add_argument('model')
+    load_p.add_argument('--method', choices=['torch', 'bundle'])
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        build_bundle(args.bundle, args.efficientnet or None, args.imagebind_ckpt,
+                     args.whisper, args.text_model)
+    elif args.command == 'verify':
+        bundle = ModelBundle(args.bundle)
+        for name in bundle.models:
+            bundle.verify(name, force=True)
+        print(f"All {len(bundle.models)} models match the manifest")
+    elif args.command == 'bench':
+        bench(args.bundle, args.model, args.runs)
+    else:
+        print(json.dumps(_load_once(args.bundle, args.model, args.method)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+"""
+Latency-budget planner for /predict.
+
+Interactive reviewers want an answer in seconds; overnight bulk runs want the
+most thorough pipeline. The planner picks, per video, how many frames to
+embed, which Whisper model and beam size to use and whether to run ImageBind,
+from a cost model that starts with rough CPU defaults and is refined from the
+stage timings classify_video reports.
+
+Modes:
+    thorough  start from ImageBind + large-v3 (beam 5) + 400 frames
+    balanced  start from the default pipeline: large-v3 (beam 5) + 400 frames
+    fast      start from a small Whisper model and 100 frames
+With a latency budget the planner walks down from the mode's starting rung
+until the estimate fits; if nothing fits, the cheapest rung is used and the
+plan says so.
+
+Rungs whose Whisper model is not available offline are skipped (see
+whisper_models in plan_prediction): the smaller models would otherwise be
+downloaded on first use and then stay resident next to large-v3.
+"""
+import os
+import threading
+
+# Rough CPU costs, replaced by measurements as videos are processed
+DEFAULT_COSTS = {
+    'decode': 0.05,        # seconds per (second of video x megapixel)
+    'image': 0.08,         # seconds per EfficientNet forward pass
+    'imagebind': 0.45,     # seconds per ImageBind frame
+    'transformer': 3.0,    # seconds per text-classifier call
+}
+# Whisper seconds per second of audio at beam 5, by model size
+DEFAULT_WHISPER_RTF = {
+    'large-v3': 0.30,
+    'medium': 0.16,
+    'small': 0.06,
+    'base': 0.03,
+}
+GREEDY_SPEEDUP = 0.6   # beam 1 costs roughly this fraction of beam 5
+EWMA_ALPHA = 0.2
+
+# Cheapest last. Each rung: frames, whisper model, beam, imagebind
+PLAN_LADDER = [
+    (400, 'large-v3', 5, True),
+    (400, 'large-v3', 5, False),
+    (200, 'large-v3', 1, False),
+    (100, 'medium', 1, False),
+    (100, 'small', 1, False),
+    (50, 'base', 1, False),
+]
+MODE_START = {'thorough': 0, 'balanced': 1, 'fast': 4}
+MODES = tuple(MODE_START)
+
+
+class Plan:
+    def __init__(self, mode, num_frames, whisper_model, beam_size, use_imagebind,
+                 estimate_s, budget_s=None, fits_budget=True, breakdown=None):
+        self.mode = mode
+        self.num_frames = num_frames
+        self.whisper_model = whisper_model
+        self.beam_size = beam_size
+        self.use_imagebind = use_imagebind
+        self.estimate_s = estimate_s
+        self.budget_s = budget_s
+        self.fits_budget = fits_budget
+        self.breakdown = breakdown or {}
+
+    def as_dict(self):
+        return {
+            "mode": self.mode,
+            "num_frames": self.num_frames,
+            "whisper_model": self.whisper_model,
+            "beam_size": self.beam_size,
+            "use_imagebind": self.use_imagebind,
+            "estimate_s": round(self.estimate_s, 2),
+            "budget_s": self.budget_s,
+            "fits_budget": self.fits_budget,
+            "breakdown": {k: round(v, 2) for k, v in self.breakdown.items()},
+        }
+
+
+class CostModel:
+    """Per-unit stage costs, updated from measured timings (EWMA)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.costs = dict(DEFAULT_COSTS)
+        self.whisper_rtf = dict(DEFAULT_WHISPER_RTF)
+        self.observations = 0
+
+    def _update(self, table, key, value):
+        old = table.get(key)
+        table[key] = value if old is None else (1 - EWMA_ALPHA) * old + EWMA_ALPHA * value
+
+    def observe(self, stage, units, seconds):
+        """Record a measured stage time; units as in DEFAULT_COSTS."""
+        if units <= 0:
+            return
+        with self._lock:
+            self._update(self.costs, stage, seconds / units)
+            self.observations += 1
+
+    def observe_whisper(self, model, beam_size, audio_s, seconds):
+        if audio_s <= 0:
+            return
+        rtf = seconds / audio_s
+        if beam_size == 1:
+            rtf /= GREEDY_SPEEDUP  # store as beam-5 equivalent
+        with self._lock:
+            self._update(self.whisper_rtf, whisper_model_key(model), rtf)
+            self.observations += 1
+
+    def estimate(self, duration_s, megapixels, num_frames, whisper_model, beam_size, use_imagebind):
+        with self._lock:
+            rtf = self.whisper_rtf.get(whisper_model_key(whisper_model), DEFAULT_WHISPER_RTF['large-v3'])
+            if beam_size == 1:
+                rtf *= GREEDY_SPEEDUP
+            breakdown = {
+                'decode': self.costs['decode'] * duration_s * max(megapixels, 0.1),
+                'image': self.costs['image'] * num_frames,
+                'whisper': rtf * duration_s,
+                'transformer': self.costs['transformer'],
+            }
+            if use_imagebind:
+                breakdown['imagebind'] = self.costs['imagebind'] * num_frames
+        return sum(breakdown.values()), breakdown
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "costs": dict(self.costs),
+                "whisper_rtf": dict(self.whisper_rtf),
+                "observations": self.observations,
+            }
+
+
+def whisper_model_key(model):
+    """
+    Model name for a Whisper name or local CTranslate2 directory.
+
+    A directory counts as a known model only when its name is exactly one,
+    or one in the bundle's (whisper-<name>) or faster-whisper's
+    (faster-whisper-<name>, also as a Hugging Face cache snapshot) form;
+    anything else, e.g. a fine-tune, is keyed by its own value.
+    """
+    parts = os.path.normpath(str(model)).split(os.sep)
+    name = parts[-1]
+    if len(parts) >= 3 and parts[-2] == 'snapshots':
+        # <cache>/models--Systran--faster-whisper-<name>/snapshots/<revision>
+        name = parts[-3].split('--')[-1]
+    for prefix in ('faster-whisper-', 'whisper-', ''):
+        if name.startswith(prefix) and name[len(prefix):] in DEFAULT_WHISPER_RTF:
+            return name[len(prefix):]
+    return str(model)
+
+
+def usable_rungs(mode, imagebind_available=True, whisper_models=None):
+    """
+    The ladder from the mode's starting rung down, without rungs that need
+    ImageBind or a Whisper model outside whisper_models (None allows all).
+    A mode whose own rungs all need missing models gets the cheapest rung
+    that can run.
+    """
+    def usable(rung):
+        return ((imagebind_available or not rung[3])
+                and (whisper_models is None or rung[1] in whisper_models))
+    rungs = [r for r in PLAN_LADDER[MODE_START[mode]:] if usable(r)]
+    if not rungs:
+        rungs = [r for r in PLAN_LADDER if usable(r)][-1:]
+    if not rungs:
+        raise ValueError(f"No plan uses an available Whisper model ({sorted(whisper_models)})")
+    return rungs
+
+
+def plan_prediction(duration_s, width, height, mode='balanced', budget_s=None,
+                    imagebind_available=True, model=None, whisper_models=None):
+    """
+    Choose the most thorough plan for the mode that fits the latency budget.
+
+    whisper_models: Whisper model names the plan may use, e.g. the ones in
+    the model bundle; None allows every model in PLAN_LADDER.
+    """
+    if mode not in MODE_START:
+        raise ValueError(f"Unknown mode {mode!r}; expected one of {MODES}")
+    model = model or cost_model
+    megapixels = (width * height) / 1e6 if width and height else 2.0
+
+    rungs = usable_rungs(mode, imagebind_available, whisper_models)
+    chosen = None
+    for num_frames, whisper_model, beam, use_ib in rungs:
+        estimate, breakdown = model.estimate(duration_s, megapixels, num_frames,
+                                             whisper_model, beam, use_ib)
+        chosen = (num_frames, whisper_model, beam, use_ib, estimate, breakdown)
+        if budget_s is None or estimate <= budget_s:
+            return Plan(mode, num_frames, whisper_model, beam, use_ib, estimate,
+                        budget_s, True, breakdown)
+    num_frames, whisper_model, beam, use_ib, estimate, breakdown = chosen
+    return Plan(mode, num_frames, whisper_model, beam, use_ib, estimate,
+                budget_s, False, breakdown)
+
+
+cost_model = CostModel()
@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+"""
+Per-process memory accounting from /proc (Linux).
+
+RSS alone double-counts pages that forked workers still share with the
+parent, so the report also carries PSS (each shared page split between the
+processes mapping it) and the shared fraction of RSS. On platforms without
+/proc/<pid>/smaps_rollup the fields are None.
+"""
+import os
+
+SMAPS_FIELDS = {
+    'Rss': 'rss_mb',
+    'Pss': 'pss_mb',
+    'Shared_Clean': 'shared_clean_mb',
+    'Shared_Dirty': 'shared_dirty_mb',
+    'Private_Clean': 'private_clean_mb',
+    'Private_Dirty': 'private_dirty_mb',
+}
+
+
+def memory_report(pid: int = None) -> dict:
+    """RSS / PSS / shared / private memory of a process, in MB."""
+    pid = pid or os.getpid()
+    report = {'pid': pid}
+    report.update({key: None for key in SMAPS_FIELDS.values()})
+    report['shared_fraction'] = None
+    try:
+        with open(f'/proc/{pid}/smaps_rollup', 'r') as f:
+            for line in f:
+                name, _, rest = line.partition(':')
+                if name in SMAPS_FIELDS:
+                    kb = int(rest.split()[0])
+                    report[SMAPS_FIELDS[name]] = kb / 1024.0
+    except (OSError, ValueError, IndexError):
+        return report
+    if report['rss_mb']:
+        shared = (report['shared_clean_mb'] or 0.0) + (report['shared_dirty_mb'] or 0.0)
+        report['shared_fraction'] = shared / report['rss_mb']
+    return report
+
+
+def peak_rss_mb(pid: int = None):
+    """High-water mark of resident memory (VmHWM), in MB."""
+    pid = pid or os.getpid()
+    try:
+        with open(f'/proc/{pid}/status', 'r') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024.0
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+"""
+Opt-in profiling of the inference pipeline.
+
+A PipelineProfiler wraps one classify_video call and records:
+  - a cProfile CPU profile of the calling thread (cpu.prof + cpu_top.txt),
+  - tracemalloc peak allocations and wall time per stage (stages.json),
+  - torch profiler operator tables for the embedding stages (torch_<stage>.txt).
+Artifacts go to <profile dir>/<video name>_<timestamp>_<uuid>/.
+
+cProfile and tracemalloc are process-wide (tracemalloc.reset_peak() resets
+the peak for every thread), so profiled runs are serialized: a second
+profiled request waits for the first to finish before it starts measuring.
+Callers enter the profiler before taking a scheduler slot, so the wait does
+not hold one, and a cancelled request stops waiting (see cancellation.py).
+
+When profiling is off, callers get NULL_PROFILER, whose stage() hands back a
+shared no-op context manager, so the pipeline pays nothing for the hooks.
+"""
+import cProfile
+import io
+import json
+import os
+import pstats
+import threading
+import time
+import tracemalloc
+import uuid
+from contextlib import contextmanager, nullcontext
+
+from cancellation import NULL_TOKEN
+
+PROFILE_DIR = os.environ.get(
+    'SHPD_PROFILE_DIR',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'profiles')
+)
+TORCH_STAGES = ('image', 'imagebind')  # stages that run torch forward passes
+TOP_FUNCTIONS = 60
+TORCH_ROWS = 40
+
+# One profiled run at a time: cProfile allows a single active session and
+# tracemalloc peaks are shared by every thread in the process
+_profile_lock = threading.Lock()
+LOCK_POLL_S = 0.5  # a waiting profiled run re-checks its cancel token this often
+
+
+class _NullProfiler:
+    enabled = False
+    out_dir = None
+    _null = nullcontext()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+    def stage(self, name):
+        return self._null
+
+
+NULL_PROFILER = _NullProfiler()
+
+
+def make_profiler(enabled: bool, video_path: str, out_dir: str = PROFILE_DIR, cancel=NULL_TOKEN):
+    """PipelineProfiler for video_path when enabled, otherwise NULL_PROFILER."""
+    return PipelineProfiler(video_path, out_dir, cancel) if enabled else NULL_PROFILER
+
+
+class PipelineProfiler:
+    enabled = True
+
+    def __init__(self, video_path: str, out_dir: str = PROFILE_DIR, cancel=NULL_TOKEN):
+        name = os.path.splitext(os.path.basename(video_path))[0]
+        stamp = time.strftime('%Y%m%d-%H%M%S')
+        # Two requests for the same video in the same second get separate dirs
+        self.video_path = video_path
+        self.out_dir = os.path.join(out_dir, f"{name}_{stamp}_{uuid.uuid4().hex[:8]}")
+        self.stages = {}
+        self.notes = []
+        self.cancel = cancel
+        self._cprofile = None
+        self._started = None
+
+    def __enter__(self):
+        waited = time.perf_counter()
+        while not _profile_lock.acquire(timeout=LOCK_POLL_S):
+            self.cancel.check()
+        waited = time.perf_counter() - waited
+        os.makedirs(self.out_dir, exist_ok=True)
+        if waited > 0.1:
+            self.notes.append(f"waited {waited:.1f}s for another profiled request to finish")
+        tracemalloc.start()
+        self._cprofile = cProfile.Profile()
+        self._cprofile.enable()
+        self._started = time.perf_counter()
+        return self
+
+    @contextmanager
+    def stage(self, name: str):
+        tracemalloc.reset_peak()
+        base, _ = tracemalloc.get_traced_memory()
+        torch_prof = self._start_torch_profiler() if name in TORCH_STAGES else None
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            _, peak = tracemalloc.get_traced_memory()
+            self.stages[name] = {
+                "wall_s": elapsed,
+                "peak_alloc_mb": max(0, peak - base) / (1024 * 1024),
+            }
+            if torch_prof is not None:
+                self._write_torch_table(name, torch_prof)
+
+    def _start_torch_profiler(self):
+        try:
+            from torch.profiler import profile, ProfilerActivity
+        except ImportError:
+            return None
+        prof = profile(activities=[ProfilerActivity.CPU], record_shapes=True)
+        prof.__enter__()
+        return prof
+
+    def _write_torch_table(self, name, prof):
+        prof.__exit__(None, None, None)
+        table = prof.key_averages(group_by_input_shape=True).table(
+            sort_by="self_cpu_time_total", row_limit=TORCH_ROWS
+        )
+        with open(os.path.join(self.out_dir, f"torch_{name}.txt"), 'w') as f:
+            f.write(table)
+
+    def __exit__(self, exc_type, exc, tb):
+        total = time.perf_counter() - self._started
+        try:
+            self._cprofile.disable()
+        finally:
+            tracemalloc.stop()
+            _profile_lock.release()
+        self._cprofile.dump_stats(os.path.join(self.out_dir, 'cpu.prof'))
+        buf = io.StringIO()
+        pstats.Stats(self._cprofile, stream=buf).sort_stats('cumulative').print_stats(TOP_FUNCTIONS)
+        with open(os.path.join(self.out_dir, 'cpu_top.txt'), 'w') as f:
+            f.write(buf.getvalue())
+        with open(os.path.join(self.out_dir, 'stages.json'), 'w') as f:
+            json.dump({
+                "video": self.video_path,
+                "total_s": total,
+                "failed": exc_type is not None,
+                "stages": self.stages,
+                "notes": self.notes,
+            }, f, indent=2)
+        print(f"[profile] {os.path.basename(self.video_path)}: artifacts in {self.out_dir}")
+        return False
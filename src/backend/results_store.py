@@ -0,0 +1,291 @@
+#!/usr/bin/env python3
+"""
+SQLite results store for classified videos.
+
+Replaces the videos.json file the Electron main process used to read, append
+to and rewrite in full after every /predict call. Rows are keyed by filename
+(re-processing a file updates its row, but keeps a tag a reviewer set), the
+database runs in WAL mode so the UI can page through results while a batch is
+writing, and the columns the UI filters on are indexed. Tags compare
+case-insensitively, as the UI always did ("delete" is a Delete tag).
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS videos (
+    id          TEXT PRIMARY KEY,
+    filename    TEXT NOT NULL UNIQUE,
+    prediction  TEXT NOT NULL,
+    tag         TEXT NOT NULL DEFAULT 'Pending',
+    score       REAL,
+    created_at  REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_videos_prediction ON videos(prediction);
+DROP INDEX IF EXISTS idx_videos_tag;
+CREATE INDEX IF NOT EXISTS idx_videos_tag_nocase ON videos(tag COLLATE NOCASE, created_at);
+CREATE INDEX IF NOT EXISTS idx_videos_created ON videos(created_at);
+CREATE TABLE IF NOT EXISTS imports (
+    path        TEXT PRIMARY KEY,
+    rows        INTEGER NOT NULL,
+    imported_at REAL NOT NULL
+);
+"""
+
+MAX_PAGE_SIZE = 1000
+SQL_CHUNK = 500  # stay well under SQLite's bound-parameter limit
+
+
+def default_tag(prediction: str) -> str:
+    """Only confident car checks are queued for deletion automatically."""
+    return "Delete" if prediction == "Car Check|Confident" else "Pending"
+
+
+# default_tag() of a stored row's prediction, for use inside SQL
+DEFAULT_TAG_SQL = "CASE WHEN videos.prediction = 'Car Check|Confident' THEN 'Delete' ELSE 'Pending' END"
+
+
+class DuplicateVideoId(Exception):
+    """An incoming video's id already belongs to a different file."""
+
+    def __init__(self, video_id: str, filename: str):
+        super().__init__(f"Video id {video_id} already belongs to another file, {filename} not stored")
+        self.video_id = video_id
+        self.filename = filename
+
+
+def _chunks(items, size=SQL_CHUNK):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+class ResultsStore:
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._local = threading.local()
+        # Short-lived connection: a connection must not be inherited by
+        # workers forked after the store is created (see serve.py)
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(SCHEMA)
+        finally:
+            conn.close()
+
+    def _connect(self) -> sqlite3.Connection:
+        # One connection per thread; FastAPI serves sync endpoints from a pool
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def upsert(self, filename: str, prediction: str, score=None, tag: str = None,
+               video_id: str = None, created_at: float = None) -> dict:
+        """Insert or update the result for one file and return the stored row."""
+        return self.upsert_many([{
+            "id": video_id,
+            "filename": filename,
+            "prediction": prediction,
+            "tag": tag,
+            "score": score,
+            "created_at": created_at,
+        }])[0]
+
+    def upsert_many(self, videos: list) -> list:
+        """
+        Insert or update many results. A re-processed file takes the new
+        prediction and score, but its tag only follows the new default while
+        it is still the default of the old prediction; a reviewer's tag stays.
+        Raises DuplicateVideoId, storing nothing, if a given id belongs to
+        another file.
+        """
+        now = time.time()
+        rows = []
+        for v in videos:
+            prediction = v.get("prediction") or "Other/Unsure"
+            rows.append((
+                v.get("id") or f"vid_{uuid.uuid4().hex[:12]}",
+                v["filename"],
+                prediction,
+                v.get("tag") or default_tag(prediction),
+                v.get("score"),
+                v.get("created_at") or now,
+            ))
+        conn = self._connect()
+        with conn:
+            try:
+                conn.executemany(
+                    f"""
+                    INSERT INTO videos (id, filename, prediction, tag, score, created_at)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                    ON CONFLICT(filename) DO UPDATE SET
+                        prediction = excluded.prediction,
+                        tag        = CASE WHEN videos.tag = {DEFAULT_TAG_SQL} COLLATE NOCASE
+                                          THEN excluded.tag ELSE videos.tag END,
+                        score      = excluded.score,
+                        created_at = excluded.created_at
+                    """,
+                    rows,
+                )
+            except sqlite3.IntegrityError as e:
+                conflict = self._id_conflict(rows)
+                if conflict is None:
+                    raise
+                raise DuplicateVideoId(*conflict) from e
+        return [self.get(r[1]) for r in rows]
+
+    def get(self, filename: str):
+        row = self._connect().execute(
+            "SELECT * FROM videos WHERE filename = ?", (filename,)
+        ).fetchone()
+        return dict(row) if row else None
+
+    def query(self, search: str = None, prediction: str = None, tag: str = None,
+              since: float = None, until: float = None,
+              limit: int = 100, offset: int = 0) -> dict:
+        """
+        One page of results, newest first.
+
+        prediction matches a prefix, so 'Car Check' matches every confidence
+        level. search is a case-insensitive substring of id, filename,
+        prediction or tag, like the All Videos search box.
+        """
+        clauses, params = [], []
+        if prediction:
+            clauses.append("prediction LIKE ? ESCAPE '\\'")
+            params.append(_escape_like(prediction) + '%')
+        if tag:
+            clauses.append("tag = ? COLLATE NOCASE")
+            params.append(tag)
+        if since is not None:
+            clauses.append("created_at >= ?")
+            params.append(since)
+        if until is not None:
+            clauses.append("created_at < ?")
+            params.append(until)
+        if search:
+            pattern = '%' + _escape_like(search) + '%'
+            clauses.append(
+                "(id LIKE ? ESCAPE '\\' OR filename LIKE ? ESCAPE '\\' "
+                "OR prediction LIKE ? ESCAPE '\\' OR tag LIKE ? ESCAPE '\\')"
+            )
+            params += [pattern] * 4
+        where = ("WHERE " + " AND ".join(clauses)) if clauses else ""
+        limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+        offset = max(0, int(offset))
+
+        conn = self._connect()
+        total = conn.execute(f"SELECT COUNT(*) FROM videos {where}", params).fetchone()[0]
+        rows = conn.execute(
+            f"SELECT * FROM videos {where} ORDER BY created_at DESC, id LIMIT ? OFFSET ?",
+            params + [limit, offset],
+        ).fetchall()
+        return {"items": [dict(r) for r in rows], "total": total, "limit": limit, "offset": offset}
+
+    def update_tags(self, tag: str, ids: list = None, filenames: list = None) -> int:
+        """Set one tag on many videos at once; returns the number of rows changed."""
+        updated = 0
+        conn = self._connect()
+        with conn:
+            for column, values in (("id", ids or []), ("filename", filenames or [])):
+                for chunk in _chunks(list(values)):
+                    marks = ",".join("?" * len(chunk))
+                    cur = conn.execute(
+                        f"UPDATE videos SET tag = ? WHERE {column} IN ({marks})",
+                        [tag] + chunk,
+                    )
+                    updated += cur.rowcount
+        return updated
+
+    def delete(self, filenames: list) -> int:
+        deleted = 0
+        conn = self._connect()
+        with conn:
+            for chunk in _chunks(list(filenames)):
+                marks = ",".join("?" * len(chunk))
+                cur = conn.execute(f"DELETE FROM videos WHERE filename IN ({marks})", chunk)
+                deleted += cur.rowcount
+        return deleted
+
+    def import_videos_json(self, json_path: str) -> int:
+        """
+        One-time import of a legacy videos.json written by the Electron app.
+
+        Each path is imported once; later calls return 0. Missing or empty
+        files import nothing but are not recorded, so they can be retried.
+        """
+        json_path = os.path.abspath(json_path)
+        conn = self._connect()
+        if conn.execute("SELECT 1 FROM imports WHERE path = ?", (json_path,)).fetchone():
+            return 0
+        if not os.path.exists(json_path):
+            return 0
+        with open(json_path, 'r', encoding='utf-8') as f:
+            try:
+                videos = json.load(f)
+            except json.JSONDecodeError as e:
+                print(f"Could not parse {json_path}, skipping import: {e}")
+                return 0
+        videos = [v for v in videos if isinstance(v, dict) and v.get("filename")]
+        rekeyed = self._rekey_duplicate_ids(videos)
+        if rekeyed:
+            print(f"{rekeyed} videos in {json_path} reused another video's id and got a new one")
+        # Keep the legacy ids' ordering: later entries were appended later
+        base = time.time() - len(videos)
+        for i, v in enumerate(videos):
+            v.setdefault("created_at", base + i)
+        if videos:
+            self.upsert_many(videos)
+        with conn:
+            conn.execute(
+                "INSERT INTO imports (path, rows, imported_at) VALUES (?, ?, ?)",
+                (json_path, len(videos), time.time()),
+            )
+        print(f"Imported {len(videos)} videos from {json_path}")
+        return len(videos)
+
+    def _id_owners(self, ids) -> dict:
+        """Stored filename of each of ids that is already in use."""
+        conn = self._connect()
+        owner = {}
+        for chunk in _chunks(list(set(ids))):
+            marks = ",".join("?" * len(chunk))
+            for row in conn.execute(f"SELECT id, filename FROM videos WHERE id IN ({marks})", chunk):
+                owner[row["id"]] = row["filename"]
+        return owner
+
+    def _id_conflict(self, rows):
+        """(id, filename) of the first row whose id another file has, or None."""
+        owner = self._id_owners(r[0] for r in rows)
+        for video_id, filename, *_ in rows:
+            if owner.setdefault(video_id, filename) != filename:
+                return video_id, filename
+        return None
+
+    def _rekey_duplicate_ids(self, videos: list) -> int:
+        """
+        Clear ids that another file already uses, in the list or the store,
+        so upsert_many gives those videos fresh ones instead of failing.
+        """
+        owner = self._id_owners(v["id"] for v in videos if v.get("id"))
+        rekeyed = 0
+        for v in videos:
+            video_id = v.get("id")
+            if not video_id:
+                continue
+            if owner.setdefault(video_id, v["filename"]) != v["filename"]:
+                v["id"] = None
+                rekeyed += 1
+        return rekeyed
+
+
+def _escape_like(text: str) -> str:
+    return text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
@@ -0,0 +1,261 @@
+# backend/scheduler.py
+"""
+CPU budget scheduler for the /predict pipeline.
+
+FastAPI runs the sync /predict handler on its threadpool, so several requests
+can be inside classify_video at once. Left alone, every one of them starts
+torch and CTranslate2 with a thread per core and the box ends up running
+N x cores threads. The scheduler fixes a total core budget, gives each stage
+of a prediction a thread allocation, and only admits as many predictions as
+fit in the budget. Work beyond that waits in a bounded queue or is rejected.
+
+Configuration (environment variables, all optional):
+    SHPD_CPU_BUDGET          total cores the backend may use (default: all)
+    SHPD_DECODE_THREADS      FFmpeg threads for the single-pass demux
+    SHPD_VISION_THREADS      torch intra-op threads (EfficientNet / ImageBind)
+    SHPD_WHISPER_THREADS     CTranslate2 threads per Whisper decode
+    SHPD_TRANSFORMER_THREADS OMP threads for the text classifier subprocess
+    SHPD_WHISPER_CHUNK_WORKERS  parallel chunk decodes per long recording,
+                             carved out of SHPD_WHISPER_THREADS (default 1: off)
+    SHPD_MAX_QUEUE           predictions allowed to wait for a slot
+    SHPD_QUEUE_TIMEOUT_S     seconds a queued prediction waits before rejection
+"""
+import os
+import threading
+import time
+from collections import deque
+
+from cancellation import NULL_TOKEN
+
+STAGES = ('decode', 'vision', 'whisper', 'transformer')
+
+DEFAULT_MAX_QUEUE = 8
+DEFAULT_QUEUE_TIMEOUT_S = 900.0
+STATS_WINDOW = 200  # recent requests kept for percentile stats
+CANCEL_POLL_S = 0.5  # queued tickets re-check their cancel token this often
+
+
+class SchedulerRejected(Exception):
+    """Raised when a prediction cannot be admitted within the budget."""
+
+
+def _env_int(name, default):
+    value = os.environ.get(name)
+    return int(value) if value else default
+
+
+def _env_float(name, default):
+    value = os.environ.get(name)
+    return float(value) if value else default
+
+
+def summarize(samples):
+    """Mean / p50 / p95 of a sequence of durations in seconds."""
+    ordered = sorted(samples) or [0.0]
+    def pct(q):
+        return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+    return {
+        "mean": sum(ordered) / len(ordered),
+        "p50": pct(0.50),
+        "p95": pct(0.95),
+    }
+
+
+class Ticket:
+    """Handle for one admitted prediction; records queue wait and run time."""
+
+    def __init__(self, scheduler, cancel=NULL_TOKEN):
+        self._scheduler = scheduler
+        self.cancel = cancel
+        self.enqueued = time.perf_counter()
+        self.started = None
+        self.finished = None
+
+    @property
+    def wait_s(self):
+        end = self.started if self.started is not None else time.perf_counter()
+        return end - self.enqueued
+
+    @property
+    def run_s(self):
+        if self.started is None:
+            return 0.0
+        end = self.finished if self.finished is not None else time.perf_counter()
+        return end - self.started
+
+    def __enter__(self):
+        self._scheduler._acquire(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._scheduler._release(self)
+        return False
+
+
+class ResourceScheduler:
+    def __init__(self, cpu_budget, stage_threads, max_queue=DEFAULT_MAX_QUEUE,
+                 queue_timeout_s=DEFAULT_QUEUE_TIMEOUT_S, whisper_chunk_workers=1):
+        """
+        Args:
+            cpu_budget: total cores all admitted predictions may use together
+            stage_threads: dict of stage name -> threads used by that stage
+            max_queue: predictions allowed to wait for a slot; more are rejected
+            queue_timeout_s: how long a queued prediction waits before rejection
+            whisper_chunk_workers: chunks of one recording Whisper decodes at
+                once; they split the whisper allocation rather than add to it
+        """
+        unknown = set(stage_threads) - set(STAGES)
+        if unknown:
+            raise ValueError(f"Unknown stages: {sorted(unknown)}")
+        self.cpu_budget = max(1, int(cpu_budget))
+        self.stage_threads = {
+            stage: max(1, min(int(stage_threads.get(stage, 1)), self.cpu_budget))
+            for stage in STAGES
+        }
+        # Stages of one prediction run one after another, so a prediction
+        # holds at most its widest stage's threads at any moment.
+        self.threads_per_request = max(self.stage_threads.values())
+        self.slots = max(1, self.cpu_budget // self.threads_per_request)
+        self.max_queue = max(0, int(max_queue))
+        self.queue_timeout_s = queue_timeout_s
+        self.whisper_chunk_workers = max(1, min(int(whisper_chunk_workers),
+                                                self.stage_threads['whisper']))
+
+        self._cond = threading.Condition()
+        self._running = 0
+        self._queued = 0
+        self._admitted = 0
+        self._rejected = 0
+        self._completed = 0
+        self._waits = deque(maxlen=STATS_WINDOW)
+        self._runs = deque(maxlen=STATS_WINDOW)
+        self._started_at = time.perf_counter()
+
+    @classmethod
+    def from_env(cls):
+        budget = _env_int('SHPD_CPU_BUDGET', os.cpu_count() or 1)
+        # Default to two concurrent predictions, each using half the budget
+        per_stage = max(1, budget // 2)
+        stage_threads = {
+            'decode': _env_int('SHPD_DECODE_THREADS', per_stage),
+            'vision': _env_int('SHPD_VISION_THREADS', per_stage),
+            'whisper': _env_int('SHPD_WHISPER_THREADS', per_stage),
+            'transformer': _env_int('SHPD_TRANSFORMER_THREADS', 1),
+        }
+        return cls(
+            budget,
+            stage_threads,
+            max_queue=_env_int('SHPD_MAX_QUEUE', DEFAULT_MAX_QUEUE),
+            queue_timeout_s=_env_float('SHPD_QUEUE_TIMEOUT_S', DEFAULT_QUEUE_TIMEOUT_S),
+            whisper_chunk_workers=_env_int('SHPD_WHISPER_CHUNK_WORKERS', 1),
+        )
+
+    def threads_for(self, stage):
+        return self.stage_threads[stage]
+
+    def stage_allocation(self):
+        """Thread allocation to pass to classify_video as stage_threads."""
+        allocation = dict(self.stage_threads)
+        # The shared Whisper model must accept one decode per admitted slot,
+        # otherwise admitted requests serialize inside CTranslate2.
+        allocation['whisper_workers'] = self.slots
+        # Chunked decoding runs several decodes per prediction, each with an
+        # equal share of the prediction's Whisper threads
+        chunk_workers = self.whisper_chunk_workers
+        allocation['whisper_chunk_workers'] = chunk_workers
+        if chunk_workers > 1:
+            allocation['whisper'] = max(1, self.stage_threads['whisper'] // chunk_workers)
+            allocation['whisper_workers'] = self.slots * chunk_workers
+        return allocation
+
+    def pipeline_allocation(self):
+        """
+        Thread allocation for ensemble_model.run_pipelined.
+
+        Its stages work on different videos at the same time, so instead of
+        each taking a slot's share they split the budget: a quarter for
+        decoding (and fingerprinting), the rest halved between vision and
+        the transcribe stage, which runs Whisper and then the text
+        classifier and so never needs both at once. Every stage gets at
+        least one thread.
+        """
+        budget = self.cpu_budget
+        decode = max(1, budget // 4)
+        vision = max(1, (budget - decode) // 2)
+        whisper = max(1, budget - decode - vision)
+        chunk_workers = max(1, min(self.whisper_chunk_workers, whisper))
+        return {
+            'decode': decode,
+            'vision': vision,
+            'whisper': max(1, whisper // chunk_workers),
+            'whisper_workers': chunk_workers,
+            'whisper_chunk_workers': chunk_workers,
+            'transformer': min(self.stage_threads['transformer'], whisper),
+        }
+
+    def apply_torch_threads(self, threads=None):
+        """Pin torch's intra-op pool to the vision allocation (process-wide)."""
+        import torch
+        threads = threads or self.stage_threads['vision']
+        torch.set_num_threads(threads)
+        print(f"[scheduler] budget={self.cpu_budget} cores, slots={self.slots}, "
+              f"threads={self.stage_threads}, torch={threads}")
+
+    def admit(self, cancel=NULL_TOKEN):
+        """
+        Return a ticket to use as a context manager around one prediction.
+
+        A cancelled token (see cancellation.py) ends the wait for a slot.
+        """
+        return Ticket(self, cancel)
+
+    def _acquire(self, ticket):
+        with self._cond:
+            if self._running >= self.slots and self._queued >= self.max_queue:
+                self._rejected += 1
+                raise SchedulerRejected(
+                    f"Backend busy: {self._running} running, {self._queued} queued"
+                )
+            self._queued += 1
+            deadline = ticket.enqueued + self.queue_timeout_s
+            try:
+                while self._running >= self.slots:
+                    ticket.cancel.check()
+                    remaining = deadline - time.perf_counter()
+                    if remaining <= 0:
+                        self._rejected += 1
+                        raise SchedulerRejected(
+                            f"Timed out after {self.queue_timeout_s:.0f}s waiting for a CPU slot"
+                        )
+                    self._cond.wait(min(remaining, CANCEL_POLL_S))
+            finally:
+                self._queued -= 1
+            self._running += 1
+            self._admitted += 1
+            ticket.started = time.perf_counter()
+            self._waits.append(ticket.wait_s)
+
+    def _release(self, ticket):
+        with self._cond:
+            ticket.finished = time.perf_counter()
+            self._running -= 1
+            self._completed += 1
+            self._runs.append(ticket.run_s)
+            self._cond.notify()
+
+    def stats(self):
+        with self._cond:
+            uptime = time.perf_counter() - self._started_at
+            return {
+                "cpu_budget": self.cpu_budget,
+                "stage_threads": dict(self.stage_threads),
+                "slots": self.slots,
+                "running": self._running,
+                "queued": self._queued,
+                "admitted": self._admitted,
+                "rejected": self._rejected,
+                "completed": self._completed,
+                "throughput_per_min": 60.0 * self._completed / uptime if uptime > 0 else 0.0,
+                "queue_wait_s": summarize(self._waits),
+                "run_s": summarize(self._runs),
+            }
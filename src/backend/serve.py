@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+"""
+Pre-forking multi-worker server for the backend.
+
+`uvicorn --workers N` spawns fresh interpreters, so each worker imports main.py
+on its own and ends up with a private copy of every model. This script instead
+imports main.py (prototypes, fingerprint index, results store) and loads the
+torch models (EfficientNet-B4, and ImageBind with --preload-imagebind) once in
+a parent process, moves their weights into shared memory, freezes the GC so
+refcount/GC passes don't dirty the inherited heap, and only then forks the
+workers. All workers accept on one listening socket.
+
+Running jobs and in-flight predictions are tracked in a SQLite board shared
+by the workers (worker_board.py), so DELETE /jobs/{id} and request
+coalescing work whichever worker accepts the request.
+
+Whisper is NOT shared: every worker loads its own copy on first use, so it
+still dominates each worker's RSS and N workers hold N copies of it (about
+1.5 GB each for int8 large-v3). CTranslate2 starts its decode threads when a
+model is loaded and those do not exist in a forked child, so a model loaded
+in the parent hangs on its first decode in a worker. The parent only
+resolves the model to its local directory once, so workers load it straight
+from disk without touching the network, and each worker's CPU budget (and
+so its Whisper threads) is the machine's cores divided by --workers.
+
+Linux/macOS only (needs os.fork). Usage:
+    python src/backend/serve.py --workers 3 --port 8000
+"""
+import argparse
+import gc
+import os
+import signal
+import socket
+import sys
+import tempfile
+import time
+
+src_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, src_dir)
+
+from process_memory import memory_report
+
+
+def preload_models(whisper_model: str, preload_imagebind: bool):
+    """Import the app and pull every model into the parent process."""
+    from model_bundle import whisper_model_path
+    if whisper_model and not os.path.isdir(whisper_model_path(whisper_model)):
+        from faster_whisper.utils import download_model
+        print(f"[serve] Resolving Whisper model {whisper_model}")
+        os.environ['SHPD_WHISPER_MODEL'] = download_model(whisper_model)
+
+    import main  # loads prototypes, fingerprint index, results store
+    import test_image_similarity_model as img_model
+    if not getattr(img_model.model, 'memory_mapped', False):
+        img_model.model.share_memory()  # bundled weights are already a shared file mapping
+
+    if preload_imagebind and main.IMAGEBIND_AVAILABLE:
+        import test_imagebind_similarity_model as ib_model
+        if ib_model._model is None:
+            print("[serve] Loading ImageBind")
+            ib_model._model = ib_model._build_model()
+        if not getattr(ib_model._model, 'memory_mapped', False):
+            ib_model._model.share_memory()
+    return main.app
+
+
+def run_worker(app, sock, log_level):
+    import uvicorn
+    # Parent's handlers must not run in the worker; uvicorn installs its own
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    config = uvicorn.Config(app, log_level=log_level)
+    server = uvicorn.Server(config)
+    server.run(sockets=[sock])
+
+
+def spawn_worker(app, sock, log_level):
+    pid = os.fork()
+    if pid == 0:
+        code = 0
+        try:
+            run_worker(app, sock, log_level)
+        except BaseException as e:
+            print(f"[serve] Worker {os.getpid()} crashed: {e}")
+            code = 1
+        finally:
+            os._exit(code)
+    return pid
+
+
+def print_memory(parent_pid, workers):
+    parent = memory_report(parent_pid)
+    print(f"[serve] parent {parent_pid}: RSS {_mb(parent['rss_mb'])}")
+    total_pss = parent['pss_mb'] or 0.0
+    for pid in workers:
+        r = memory_report(pid)
+        total_pss += r['pss_mb'] or 0.0
+        frac = r['shared_fraction']
+        print(f"[serve] worker {pid}: RSS {_mb(r['rss_mb'])}, PSS {_mb(r['pss_mb'])}, "
+              f"private {_mb(r['private_dirty_mb'])}, "
+              f"shared {'n/a' if frac is None else f'{frac:.0%}'}")
+    print(f"[serve] total PSS across {len(workers)} workers + parent: {total_pss:.0f} MB")
+
+
+def _mb(value):
+    return 'n/a' if value is None else f"{value:.0f} MB"
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve the backend with shared-memory workers')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--whisper-model', default=os.environ.get('SHPD_WHISPER_MODEL', 'large-v3'),
+                        help='Whisper model name or local CTranslate2 directory')
+    parser.add_argument('--preload-imagebind', action='store_true',
+                        help='Load ImageBind in the parent so workers share it')
+    parser.add_argument('--report-interval', type=float, default=60.0,
+                        help='Seconds between memory reports (0 disables)')
+    parser.add_argument('--log-level', default='info')
+    args = parser.parse_args()
+
+    if not hasattr(os, 'fork'):
+        sys.exit("serve.py needs os.fork; on Windows start the backend with start-backend.js")
+
+    # Each worker gets an equal share of the machine's cores
+    if 'SHPD_CPU_BUDGET' not in os.environ:
+        os.environ['SHPD_CPU_BUDGET'] = str(max(1, (os.cpu_count() or 1) // args.workers))
+
+    # Fresh per run, created before main.py is imported so every worker inherits it
+    board_path = os.path.join(tempfile.gettempdir(), f"shpd-workers-{os.getpid()}.db")
+    os.environ['SHPD_WORKER_DB'] = board_path
+
+    start = time.perf_counter()
+    app = preload_models(args.whisper_model, args.preload_imagebind)
+    print(f"[serve] Models loaded in {time.perf_counter() - start:.1f}s; "
+          f"Whisper is not shared, each of the {args.workers} workers loads its own copy")
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((args.host, args.port))
+    sock.listen(128)
+    sock.set_inheritable(True)
+
+    # Everything allocated so far is long-lived; keep the GC off those pages
+    gc.collect()
+    gc.freeze()
+
+    parent_pid = os.getpid()
+    workers = set(spawn_worker(app, sock, args.log_level) for _ in range(args.workers))
+    print(f"[serve] Listening on http://{args.host}:{args.port} with workers {sorted(workers)}")
+
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+
+    last_report = time.monotonic()
+    while not stopping:
+        try:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+        except ChildProcessError:
+            pid = 0
+        if pid and pid in workers:
+            workers.discard(pid)
+            print(f"[serve] Worker {pid} exited ({status}), starting a replacement")
+            workers.add(spawn_worker(app, sock, args.log_level))
+        if args.report_interval and time.monotonic() - last_report >= args.report_interval:
+            print_memory(parent_pid, sorted(workers))
+            last_report = time.monotonic()
+        time.sleep(0.5)
+
+    print("[serve] Shutting down workers")
+    for pid in workers:
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+    for pid in workers:
+        try:
+            os.waitpid(pid, 0)
+        except ChildProcessError:
+            pass
+    sock.close()
+    for suffix in ('', '-wal', '-shm'):
+        try:
+            os.unlink(board_path + suffix)
+        except OSError:
+            pass
+
+
+if __name__ == '__main__':
+    main()
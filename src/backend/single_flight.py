@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+"""
+Single-flight coalescing of duplicate in-flight work.
+
+When the Electron app re-submits a file, or two reviewers queue the same
+clip, /predict used to run the whole pipeline twice side by side. A
+SingleFlight runs the first call for a key (the leader) and makes every call
+for the same key that arrives while it is running wait for and share its
+result, or its exception. Nothing is cached once the leader finishes; later
+calls start a new flight.
+
+Keys start from file_identity(), so a path and a symlink to it coalesce and
+a file replaced in place does not. main.py coalesces whole predictions;
+classify_video also coalesces the transcript + text-classifier branch through
+transcript_flight, so an ImageBind and a basic request for the same clip
+share one Whisper run.
+
+A leader can hand followers a context (main.py passes its CancelToken, so a
+follower keeps the shared run alive until it is cancelled too). Errors
+listed in retry_on are not shared: followers start a new flight instead, so
+one caller's cancellation does not fail the others. A follower passes its
+own cancel token too, so cancelling it ends its wait at once instead of when
+the shared run finishes.
+
+With a WorkerBoard (see worker_board.py) the leader of each process also
+claims the key across serve.py's workers; if another worker already runs
+it, this process waits for that worker's published result instead, which
+must then be JSON-serialisable.
+"""
+import os
+import threading
+
+from cancellation import Cancelled, NULL_TOKEN
+from worker_board import FlightFailed
+
+CANCEL_POLL_S = 0.5  # waiting followers re-check their own cancel token this often
+
+
+def file_identity(path: str) -> tuple:
+    """(real path, size, mtime) of a file; the path alone if it cannot be stat'ed."""
+    real = os.path.realpath(path)
+    try:
+        st = os.stat(real)
+    except OSError:
+        return (real,)
+    return (real, st.st_size, st.st_mtime_ns)
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+        self.context = None
+
+
+class SingleFlight:
+    def __init__(self, name: str, retry_on: tuple = (), board=None):
+        self.name = name
+        self.retry_on = retry_on
+        self.board = board
+        self._lock = threading.Lock()
+        self._calls = {}
+        self.leaders = 0
+        self.coalesced = 0
+
+    def do(self, key, fn, context=None, on_join=None, cancel=NULL_TOKEN):
+        """
+        Run fn() once per key at a time.
+
+        Returns (result, shared): shared is True when this call waited on
+        another caller's run instead of running fn itself. context is kept
+        with a leader's run and on_join(context) is called for each follower;
+        if it returns False the follower does not share that run. A follower
+        raises Cancelled as soon as its own cancel token is set.
+        """
+        while True:
+            with self._lock:
+                call = self._calls.get(key)
+                if call is not None:
+                    # on_join returning False means: wait this run out, then retry
+                    joined = on_join is None or on_join(call.context) is not False
+                    if joined:
+                        call.waiters += 1
+                        self.coalesced += 1
+                    leader = False
+                else:
+                    call = self._calls[key] = _Call()
+                    call.context = context
+                    self.leaders += 1
+                    leader = True
+
+            if leader:
+                break
+            try:
+                while not call.done.wait(CANCEL_POLL_S):
+                    cancel.check()
+            except Cancelled:
+                if joined:
+                    with self._lock:
+                        call.waiters -= 1
+                raise
+            if not joined:
+                continue
+            if call.error is None:
+                return call.result, True
+            if not isinstance(call.error, self.retry_on):
+                raise call.error
+
+        try:
+            call.result, shared = self._lead(key, fn, cancel)
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result, shared
+
+    def _lead(self, key, fn, cancel):
+        """Run fn() for this process, or wait for another worker already running key."""
+        if self.board is None:
+            return fn(), False
+        while True:
+            leads, flight_id = self.board.claim(repr(key))
+            if leads:
+                break
+            try:
+                result = self.board.wait(flight_id, cancel)
+            except FlightFailed as e:
+                print(f"[{self.name}] Identical run in another worker failed ({e}), retrying")
+                continue
+            with self._lock:
+                self.coalesced += 1
+            return result, True
+        try:
+            result = fn()
+        except BaseException as e:
+            self.board.publish(flight_id, error=e)
+            raise
+        self.board.publish(flight_id, result)
+        return result, False
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "in_flight": len(self._calls),
+                "waiting": sum(c.waiters for c in self._calls.values()),
+                "leaders": self.leaders,
+                "coalesced": self.coalesced,
+            }
+
+
+# Transcript + text-classifier branch, shared by ensemble_model and ensemble_model_full
+transcript_flight = SingleFlight('transcript', retry_on=(Cancelled,))
@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""
+Speech-presence pre-pass run before Whisper.
+
+Plenty of body-cam clips have no usable speech: the camera is in a pocket,
+there is only wind, or the siren is the only thing audible. Whisper large-v3
+still costs a sizeable fraction of the clip's length on those, and the text
+classifier then answers 'other' anyway. This module decodes the audio once at
+16 kHz mono, rejects near-silent tracks on RMS alone, and otherwise runs the
+Silero VAD bundled with faster_whisper to measure how much speech there is.
+"""
+import os
+import threading
+import time
+
+import numpy as np
+
+SAMPLE_RATE = 16000
+MIN_SPEECH_S = 2.0          # less detected speech than this → skip Whisper
+MIN_SPEECH_COVERAGE = 0.0   # optional floor on speech / duration
+SILENCE_RMS = 1e-3          # whole-track RMS below this is treated as silent
+
+VAD_THRESHOLD = 0.5         # same VAD settings Whisper uses in transcribe_file
+VAD_MIN_SILENCE_MS = 500
+
+DEFAULT_WHISPER_RTF = 0.3   # Whisper seconds per audio second before any measurement
+
+
+def decode_mono_16k(video_path: str) -> np.ndarray:
+    from faster_whisper import decode_audio
+    return decode_audio(video_path, sampling_rate=SAMPLE_RATE)
+
+
+def speech_timestamps(audio: np.ndarray):
+    """Silero VAD speech spans as (start_s, end_s) tuples."""
+    from faster_whisper.vad import VadOptions, get_speech_timestamps
+    options = VadOptions(threshold=VAD_THRESHOLD, min_silence_duration_ms=VAD_MIN_SILENCE_MS)
+    spans = get_speech_timestamps(audio, options)
+    return [(s['start'] / SAMPLE_RATE, s['end'] / SAMPLE_RATE) for s in spans]
+
+
+def detect_speech(video_path: str, min_speech_s: float = MIN_SPEECH_S,
+                  min_coverage: float = MIN_SPEECH_COVERAGE, audio: np.ndarray = None) -> dict:
+    """
+    Measure speech in a video's audio track.
+
+    audio: pre-decoded 16 kHz mono float32 audio (see demux.py); decoded from
+    video_path if None.
+
+    Returns a dict with speech_s, duration_s, coverage, has_speech and
+    elapsed_s (time spent on this pre-pass). If the audio cannot be decoded
+    here, has_speech is True so the caller falls through to Whisper, which
+    decodes the file itself and reports its own error.
+    """
+    start = time.perf_counter()
+    if audio is None:
+        try:
+            audio = decode_mono_16k(video_path)
+        except Exception as e:
+            print(f"[{os.path.basename(video_path)}] Could not decode audio for the speech gate: {e}")
+            return {
+                "speech_s": 0.0,
+                "duration_s": 0.0,
+                "coverage": 0.0,
+                "has_speech": True,
+                "elapsed_s": time.perf_counter() - start,
+            }
+
+    duration = audio.size / SAMPLE_RATE
+    if audio.size == 0 or float(np.sqrt(np.mean(audio * audio))) < SILENCE_RMS:
+        spans = []
+    else:
+        spans = speech_timestamps(audio)
+
+    speech_s = sum(end - begin for begin, end in spans)
+    coverage = speech_s / duration if duration > 0 else 0.0
+    return {
+        "speech_s": speech_s,
+        "duration_s": duration,
+        "coverage": coverage,
+        "has_speech": speech_s >= min_speech_s and coverage >= min_coverage,
+        "elapsed_s": time.perf_counter() - start,
+    }
+
+
+class WhisperCostTracker:
+    """Running estimate of Whisper seconds per second of audio, for logging time saved."""
+
+    def __init__(self, rtf: float = DEFAULT_WHISPER_RTF, alpha: float = 0.2):
+        self.rtf = rtf
+        self.alpha = alpha
+        self.skipped = 0
+        self.saved_s = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, audio_s: float, whisper_s: float):
+        if audio_s <= 0:
+            return
+        with self._lock:
+            self.rtf = (1 - self.alpha) * self.rtf + self.alpha * (whisper_s / audio_s)
+
+    def record_skip(self, audio_s: float, gate_s: float) -> float:
+        """Count a skipped transcription and return the estimated seconds saved."""
+        with self._lock:
+            saved = max(0.0, audio_s * self.rtf - gate_s)
+            self.skipped += 1
+            self.saved_s += saved
+            return saved
+
+
+whisper_costs = WhisperCostTracker()
@@ -8,6 +8,9 @@ import torch
 import torchvision.transforms as transforms
 import torchvision.models as models
 
+from cancellation import NULL_TOKEN
+from model_bundle import get_bundle
+
 # Default model name for import usage
 MODEL_NAME = 'efficientnet_b4'
 
@@ -22,6 +25,13 @@ PEDESTRIAN_VIDEO_DIR = os.path.join(
 )
 INPUT_SIZE = 320  # Higher-resolution input
 FRAMES_PER_VIDEO = 400
+# Near-static frame deduplication before embedding. Off until --dedupe-report
+# shows on the labelled set that scores stay clear of the fusion thresholds,
+# which are only 0.01 apart; SHPD_DEDUPE_FRAMES=1 turns it on.
+DEDUPE_FRAMES = os.environ.get('SHPD_DEDUPE_FRAMES', '0') == '1'
+DEDUPE_THUMB_SIZE = 32      # frames are compared as 32x32 grayscale thumbnails
+DEDUPE_DIFF_THRESH = 2.0    # mean abs difference (0-255 gray levels) that still counts as the same shot
+CANCEL_CHECK_FRAMES = 16    # embedded frames between cancellation checks
 MODEL_PATH_TEMPLATE = os.path.join(
     os.path.dirname(os.path.abspath(__file__)),
     'image_similarity_model_{model}.h5'
@@ -39,14 +49,17 @@ device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
 
 def _build_model(model_name: str):
     """Constructs and returns a feature-extractor model."""
-    if model_name.lower() == 'resnet50':
+    bundle = get_bundle()
+    if bundle is not None and model_name in bundle:
+        # Memory-mapped weights from the local bundle, no torchvision download
+        model = bundle.load_torch_model(model_name)
+    elif model_name.lower() == 'resnet50':
         model = models.resnet50(pretrained=True)
         model.fc = torch.nn.Identity()
     elif model_name.lower() == 'resnet101':
         model = models.resnet101(pretrained=True)
         model.fc = torch.nn.Identity()
     elif model_name.startswith('efficientnet_b'):
-        print("HERE")
         variant = model_name.split('_', 1)[1].upper()
         weights_enum = getattr(models, f'EfficientNet_{variant}_Weights').DEFAULT
         eff_fn = getattr(models, model_name)
@@ -112,13 +125,72 @@ def extract_frame_embedding(frame: np.ndarray):
     return embedding.cpu().numpy().flatten()
 
 
-def extract_video_feature(video_path: str):
-    """Extract video-level feature by averaging frame embeddings."""
-    frames = extract_frames(video_path)
+def dedupe_frames(frames: list, threshold: float = DEDUPE_DIFF_THRESH):
+    """
+    Collapse runs of near-identical consecutive frames.
+
+    Each frame is compared with the first frame of the current run (not its
+    neighbour, so slow pans don't drift into one run). Returns the kept frames
+    and, for each, the number of sampled frames it stands for.
+    """
+    kept, weights = [], []
+    anchor = None
+    for frame in frames:
+        gray = cv2.cvtColor(frame, cv2.COLOR_RGB2GRAY)
+        thumb = cv2.resize(gray, (DEDUPE_THUMB_SIZE, DEDUPE_THUMB_SIZE),
+                           interpolation=cv2.INTER_AREA).astype(np.float32)
+        if anchor is not None and float(np.mean(np.abs(thumb - anchor))) < threshold:
+            weights[-1] += 1
+            continue
+        kept.append(frame)
+        weights.append(1)
+        anchor = thumb
+    return kept, weights
+
+
+def extract_video_feature(video_path: str, dedupe: bool = DEDUPE_FRAMES, stats: dict = None,
+                          frames: list = None, num_frames: int = FRAMES_PER_VIDEO,
+                          cancel=NULL_TOKEN):
+    """
+    Extract video-level feature by averaging frame embeddings.
+
+    With dedupe, runs of near-static frames are embedded once and weighted by
+    the run length, so the result approximates the plain mean over all frames.
+    If stats is given it receives the sampled / embedded frame counts.
+    frames: already-decoded RGB frames (see demux.py); read from video_path if None.
+    cancel: CancelToken checked every CANCEL_CHECK_FRAMES frames (see cancellation.py).
+    """
+    if frames is None:
+        frames = extract_frames(video_path, num_frames)
     if not frames:
         return None
-    embeddings = [extract_frame_embedding(f) for f in frames]
-    return np.mean(np.array(embeddings), axis=0)
+    if dedupe:
+        frames_kept, weights = dedupe_frames(frames)
+    else:
+        frames_kept, weights = frames, [1] * len(frames)
+    if stats is not None:
+        stats['frames'] = len(frames)
+        stats['forward_passes'] = len(frames_kept)
+        stats['saved'] = len(frames) - len(frames_kept)
+    embeddings = []
+    for i, f in enumerate(frames_kept):
+        if i % CANCEL_CHECK_FRAMES == 0:
+            cancel.check()
+        embeddings.append(extract_frame_embedding(f))
+    return np.average(np.array(embeddings), axis=0, weights=np.array(weights, dtype=np.float64))
+
+
+def compare_dedupe(video_path: str, model_vector: np.ndarray) -> dict:
+    """Similarity with and without frame deduplication, for checking the threshold."""
+    stats = {}
+    deduped = extract_video_feature(video_path, dedupe=True, stats=stats)
+    full = extract_video_feature(video_path, dedupe=False)
+    if deduped is None or full is None:
+        return None
+    stats['score'] = cosine_similarity(deduped, model_vector)
+    stats['score_full'] = cosine_similarity(full, model_vector)
+    stats['score_delta'] = stats['score'] - stats['score_full']
+    return stats
 
 
 def cosine_similarity(vec1: np.ndarray, vec2: np.ndarray) -> float:
@@ -197,13 +269,40 @@ def combined_plot_and_analytics(
     print(f"Graph saved to {save_path}")
 
 
-def main(model_name: str = MODEL_NAME):
+def print_dedupe_report(video_paths: list[str], model_vector: np.ndarray):
+    """Forward passes saved and score change from frame deduplication."""
+    total_frames = total_saved = 0
+    deltas = []
+    for video_path in video_paths:
+        stats = compare_dedupe(video_path, model_vector)
+        if stats is None:
+            print(f"Skipping {video_path}: feature extraction failed.")
+            continue
+        total_frames += stats['frames']
+        total_saved += stats['saved']
+        deltas.append(abs(stats['score_delta']))
+        print(f"{os.path.basename(video_path)}: {stats['forward_passes']}/{stats['frames']} "
+              f"forward passes, score {stats['score']:.4f} vs {stats['score_full']:.4f} "
+              f"(delta {stats['score_delta']:+.4f})")
+    if deltas:
+        print(f"\nFrame dedupe saved {total_saved}/{total_frames} forward passes "
+              f"({total_saved / total_frames:.1%}); "
+              f"mean |score delta| {np.mean(deltas):.4f}, max {np.max(deltas):.4f}")
+
+
+def main(model_name: str = MODEL_NAME, dedupe_report: bool = False):
     # Load prototype vector and training paths
     model_path = MODEL_PATH_TEMPLATE.format(model=model_name)
     with h5py.File(model_path, 'r') as f:
         model_vector = np.array(f['model_vector'])
         train_video_paths = np.array(f['train_video_paths'], dtype=str)
 
+    if dedupe_report:
+        car_videos = list_videos(CAR_VIDEO_DIR)
+        ped_videos = list_videos(PEDESTRIAN_VIDEO_DIR)
+        print_dedupe_report(car_videos + ped_videos, model_vector)
+        return
+
     car_videos = list_videos(CAR_VIDEO_DIR)
     train_set = set(os.path.abspath(p) for p in train_video_paths)
     car_test_videos = [v for v in car_videos if os.path.abspath(v) not in train_set]
@@ -224,5 +323,9 @@ if __name__ == "__main__":
         '--model', type=str, default=MODEL_NAME,
         help='Model architecture to use, e.g., resnet50, resnet101, efficientnet_b0, efficientnet_b1'
     )
+    parser.add_argument(
+        '--dedupe-report', action='store_true',
+        help='Compare scores with and without static-frame deduplication instead of plotting'
+    )
     args = parser.parse_args()
-    main(args.model)
+    main(args.model, args.dedupe_report)
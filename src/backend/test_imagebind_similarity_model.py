@@ -9,6 +9,9 @@ import h5py
 
 from imagebind.models.imagebind_model import imagebind_huge, ModalityType
 
+from cancellation import NULL_TOKEN
+from model_bundle import get_bundle
+
 # Default checkpoint path
 CHECKPOINT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.checkpoints')
 CHECKPOINT_PATH = os.path.join(CHECKPOINT_DIR, 'imagebind_huge.pth')
@@ -23,14 +26,21 @@ FRAME_TRANSFORM = transforms.Compose([
     transforms.Normalize(mean=[0.5, 0.5, 0.5], std=[0.5, 0.5, 0.5])
 ])
 
+# Frames per forward pass; cancellation is checked between batches
+FRAME_BATCH = 32
+
 # Lazy-loaded model
 _model = None
 
 def _build_model():
-    """Load and return the ImageBind model with checkpoint."""
-    model = imagebind_huge(pretrained=False)
-    state = torch.load(CHECKPOINT_PATH, map_location=DEVICE)
-    model.load_state_dict(state)
+    """Load and return the ImageBind model, from the bundle if there is one."""
+    bundle = get_bundle()
+    if bundle is not None and 'imagebind_huge' in bundle:
+        model = bundle.load_torch_model('imagebind_huge')
+    else:
+        model = imagebind_huge(pretrained=False)
+        state = torch.load(CHECKPOINT_PATH, map_location=DEVICE)
+        model.load_state_dict(state)
     model.to(DEVICE)
     model.eval()
     return model
@@ -55,26 +65,34 @@ def extract_frames(video_path: str, num_frames: int = 400):
     return frames
 
 
-def extract_video_embedding(frames: list[np.ndarray]):
-    """Generate a video-level embedding by passing frames through ImageBind."""
+def extract_video_embedding(frames: list[np.ndarray], cancel=NULL_TOKEN):
+    """
+    Generate a video-level embedding by passing frames through ImageBind.
+
+    Frames go through in batches of FRAME_BATCH; cancel (see cancellation.py)
+    is checked before each batch.
+    """
     global _model
     if _model is None:
         _model = _build_model()
 
-    # Prepare frame tensors
-    tensors = []
-    for f in frames:
-        # PIL conversion for transform
-        pil = transforms.ToPILImage()(f)
-        t = FRAME_TRANSFORM(pil).unsqueeze(0)
-        tensors.append(t)
-    batch = torch.cat(tensors, dim=0).to(DEVICE)
-
-    with torch.no_grad():
-        # forward takes a dict mapping ModalityType to tensor
-        out = _model({ModalityType.VISION: batch})[ModalityType.VISION]
+    outputs = []
+    for start in range(0, len(frames), FRAME_BATCH):
+        cancel.check()
+        # Prepare frame tensors
+        tensors = []
+        for f in frames[start:start + FRAME_BATCH]:
+            # PIL conversion for transform
+            pil = transforms.ToPILImage()(f)
+            t = FRAME_TRANSFORM(pil).unsqueeze(0)
+            tensors.append(t)
+        batch = torch.cat(tensors, dim=0).to(DEVICE)
+
+        with torch.no_grad():
+            # forward takes a dict mapping ModalityType to tensor
+            outputs.append(_model({ModalityType.VISION: batch})[ModalityType.VISION])
     # Average across frames and return numpy
-    return out.mean(dim=0).cpu().numpy()
+    return torch.cat(outputs, dim=0).mean(dim=0).cpu().numpy()
 
 
 def cosine_sim(vec1: np.ndarray, vec2: np.ndarray) -> float:
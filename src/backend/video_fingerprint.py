@@ -0,0 +1,369 @@
+#!/usr/bin/env python3
+"""
+Cheap perceptual fingerprints for spotting re-exported / copied footage.
+
+The same incident is often uploaded several times: re-exported, copied out
+of another camera's sync folder, or trimmed slightly. A fingerprint is a
+handful of tiny grayscale thumbnails plus a coarse audio energy envelope,
+L2-normalised so that cosine similarity is a plain dot product. The index
+keeps every fingerprint with the result it produced, and classify_video
+reuses (or flags) that result when a new upload is close enough.
+
+Every stored fingerprint records the SIGNATURE_LAYOUT it was computed with.
+Fingerprints from another layout are not comparable, so lookups ignore them
+until they are recomputed:
+    python video_fingerprint.py INDEX rebuild
+"""
+import argparse
+import os
+import sqlite3
+import threading
+import time
+
+import cv2
+import numpy as np
+
+FINGERPRINT_FRAMES = 8     # frames sampled across the clip
+THUMB_SIZE = 8             # each frame is reduced to THUMB_SIZE x THUMB_SIZE
+AUDIO_BINS = 32            # RMS energy bins across the clip
+AUDIO_SAMPLE_RATE = 8000   # energy only, so a low rate is plenty
+AUDIO_WEIGHT = 0.35        # share of the fingerprint norm carried by audio
+SAMPLING_GRID = 400        # FRAMES_PER_VIDEO of the embedding branches
+
+DUPLICATE_SIM_THRESH = 0.98  # >= this → treat as the same footage
+
+FINGERPRINT_DIM = FINGERPRINT_FRAMES * THUMB_SIZE * THUMB_SIZE + AUDIO_BINS
+
+# Bump SIGNATURE_VERSION whenever the way a signature is computed changes
+# without changing one of the sizes below (e.g. where frames are sampled)
+SIGNATURE_VERSION = 3      # 3: any frame count mapped onto the SAMPLING_GRID instants
+SIGNATURE_LAYOUT = (f"v{SIGNATURE_VERSION}|frames={FINGERPRINT_FRAMES}|thumb={THUMB_SIZE}"
+                    f"|audio={AUDIO_BINS}@{AUDIO_SAMPLE_RATE}|weight={AUDIO_WEIGHT}|grid={SAMPLING_GRID}")
+INITIAL_SHARD_ROWS = 256   # rows a mode's matrix starts with; doubled when full
+
+INDEX_SCHEMA = """
+CREATE TABLE IF NOT EXISTS fingerprints (
+    id       INTEGER PRIMARY KEY AUTOINCREMENT,
+    mode     TEXT NOT NULL,
+    vector   BLOB NOT NULL,   -- FINGERPRINT_DIM float32
+    path     TEXT NOT NULL,
+    label    TEXT NOT NULL,
+    score    REAL,
+    added_at REAL NOT NULL,
+    layout   TEXT             -- SIGNATURE_LAYOUT the vector was computed with
+);
+"""
+
+
+def fingerprint_mode(pipeline: str, num_frames: int, whisper_model: str, beam_size) -> str:
+    """
+    Index mode for one pipeline configuration.
+
+    A result is only reused for a request that would have run the same
+    pipeline: a fast plan's label (fewer frames, a smaller Whisper) must not
+    answer a balanced or thorough request for a copy of the same clip.
+    beam_size None is FasterWhisperTranscriber's default of 5.
+    """
+    return f"{pipeline}|frames={num_frames}|whisper={whisper_model}|beam={beam_size or 5}"
+
+
+def mode_frames(mode: str) -> int:
+    """Frames the pipeline of an index mode samples (SAMPLING_GRID if unknown)."""
+    for part in mode.split('|'):
+        if part.startswith('frames='):
+            return int(part[len('frames='):])
+    return SAMPLING_GRID
+
+
+def _unit(vec: np.ndarray) -> np.ndarray:
+    norm = np.linalg.norm(vec)
+    return vec / norm if norm > 0 else vec
+
+
+def _pick(count: int, num_frames: int = FINGERPRINT_FRAMES) -> np.ndarray:
+    # Evenly spaced positions, skipping the very first / last frames where
+    # re-exports tend to differ
+    return np.linspace(0, count - 1, num_frames + 2, dtype=int)[1:-1]
+
+
+def _thumbnail(gray: np.ndarray) -> np.ndarray:
+    thumb = cv2.resize(gray, (THUMB_SIZE, THUMB_SIZE), interpolation=cv2.INTER_AREA)
+    thumb = thumb.astype(np.float32).flatten()
+    # Centre each thumbnail so brightness / re-encode gamma shifts cancel out
+    return _unit(thumb - thumb.mean())
+
+
+def _positions(sampled: int, num_frames: int = FINGERPRINT_FRAMES) -> list:
+    # Indices into `sampled` evenly spaced frames nearest to the instants of
+    # the SAMPLING_GRID positions, so every frame count sees the same moments
+    scale = (sampled - 1) / (SAMPLING_GRID - 1)
+    return [int(round(pos * scale)) for pos in _pick(SAMPLING_GRID, num_frames)]
+
+
+def visual_signature(video_path: str, num_frames: int = FINGERPRINT_FRAMES,
+                     frames: list = None, sampled: int = SAMPLING_GRID) -> np.ndarray:
+    """
+    Mean-centred grayscale thumbnails of evenly spaced frames.
+
+    frames: the RGB frames the embedding branches already decoded, evenly
+    spaced over the clip (see demux.py). When reading the file instead,
+    sampled is how many such frames to assume; with the same count both
+    pick the same frames and give the same signature.
+    """
+    sig = np.zeros((num_frames, THUMB_SIZE * THUMB_SIZE), dtype=np.float32)
+    if frames is not None:
+        if frames:
+            for i, pos in enumerate(_positions(len(frames), num_frames)):
+                sig[i] = _thumbnail(cv2.cvtColor(frames[pos], cv2.COLOR_RGB2GRAY))
+        return sig.flatten()
+
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        print(f"Error opening video: {video_path}")
+        return sig.flatten()
+    total = int(cap.get(cv2.CAP_PROP_FRAME_COUNT)) or sampled
+    grid = np.linspace(0, total - 1, sampled, dtype=int)
+    for i, pos in enumerate(_positions(sampled, num_frames)):
+        cap.set(cv2.CAP_PROP_POS_FRAMES, grid[pos])
+        ret, frame = cap.read()
+        if not ret:
+            continue
+        sig[i] = _thumbnail(cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY))
+    cap.release()
+    return sig.flatten()
+
+
+def audio_signature(video_path: str, bins: int = AUDIO_BINS) -> np.ndarray:
+    """Log RMS energy envelope of the audio track, zero if there is none."""
+    try:
+        from faster_whisper import decode_audio
+        audio = decode_audio(video_path, sampling_rate=AUDIO_SAMPLE_RATE)
+    except Exception as e:
+        print(f"No audio fingerprint for {os.path.basename(video_path)}: {e}")
+        return np.zeros(bins, dtype=np.float32)
+    return energy_envelope(audio, bins)
+
+
+def energy_envelope(audio: np.ndarray, bins: int = AUDIO_BINS) -> np.ndarray:
+    if audio.size < bins:
+        return np.zeros(bins, dtype=np.float32)
+    chunks = np.array_split(audio.astype(np.float32), bins)
+    rms = np.array([np.sqrt(np.mean(c * c)) for c in chunks], dtype=np.float32)
+    env = np.log(rms + 1e-4)
+    return _unit(env - env.mean())
+
+
+def compute_fingerprint(video_path: str, frames: list = None, audio: np.ndarray = None,
+                        sampled: int = SAMPLING_GRID) -> np.ndarray:
+    """
+    Fingerprint of a video; cosine similarity between two is a dot product.
+
+    frames / audio: already-decoded sampled RGB frames and mono audio (see
+    demux.py); read from video_path when None, assuming `sampled` frames.
+    """
+    visual = _unit(visual_signature(video_path, frames=frames, sampled=sampled))
+    audio = audio_signature(video_path) if audio is None else energy_envelope(audio)
+    fp = np.concatenate([visual * (1.0 - AUDIO_WEIGHT), audio * AUDIO_WEIGHT])
+    return _unit(fp).astype(np.float32)
+
+
+class _ModeShard:
+    """Fingerprints of one index mode in a matrix that grows by doubling."""
+
+    def __init__(self):
+        self.vectors = np.zeros((INITIAL_SHARD_ROWS, FINGERPRINT_DIM), dtype=np.float32)
+        self.count = 0
+        self.entries = []
+
+    def append(self, vector: np.ndarray, entry: dict):
+        if self.count == len(self.vectors):
+            grown = np.zeros((2 * len(self.vectors), FINGERPRINT_DIM), dtype=np.float32)
+            grown[:self.count] = self.vectors[:self.count]
+            self.vectors = grown
+        self.vectors[self.count] = vector
+        self.entries.append(entry)
+        self.count += 1
+
+    def best(self, fingerprint: np.ndarray):
+        sims = self.vectors[:self.count] @ fingerprint
+        best = int(np.argmax(sims))
+        return float(sims[best]), self.entries[best]
+
+
+class FingerprintIndex:
+    """
+    Fingerprints of already-classified videos and the results they produced.
+
+    Stored append-only in a SQLite file next to the backend, so adding a
+    video writes one row, and held in memory as one matrix per mode, so a
+    lookup is a single matrix-vector product over L2-normalised rows of its
+    own mode. Rows other processes add are picked up incrementally by rowid.
+    Rows of another SIGNATURE_LAYOUT are skipped until rebuild() replaces them.
+    """
+
+    def __init__(self, path: str = None, similarity_threshold: float = DUPLICATE_SIM_THRESH):
+        self.path = path
+        self.similarity_threshold = similarity_threshold
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._shards = {}     # mode -> _ModeShard
+        self._count = 0
+        self._last_id = 0     # highest rowid already loaded
+        self.stale = 0        # rows of another signature layout, not used
+        self.skipped = 0
+        self.flagged = 0
+        if path:
+            # Short-lived connection: serve.py forks workers after this
+            conn = sqlite3.connect(path, timeout=30)
+            try:
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.executescript(INDEX_SCHEMA)
+                columns = [row[1] for row in conn.execute("PRAGMA table_info(fingerprints)")]
+                if 'layout' not in columns:  # index written before layouts were recorded
+                    conn.execute("ALTER TABLE fingerprints ADD COLUMN layout TEXT")
+                # Loaded on this connection too, so none stays open across the fork
+                self._refresh(conn)
+            finally:
+                conn.close()
+            if self._count:
+                print(f"Loaded {self._count} video fingerprints from {path}")
+            if self.stale:
+                print(f"Ignoring {self.stale} fingerprints with an old signature layout in {path}; "
+                      f"run `python video_fingerprint.py {path} rebuild` to recompute them")
+
+    def __len__(self):
+        return self._count
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _append(self, mode: str, vector: np.ndarray, entry: dict):
+        shard = self._shards.get(mode)
+        if shard is None:
+            shard = self._shards[mode] = _ModeShard()
+        shard.append(vector, entry)
+        self._count += 1
+
+    def _refresh(self, conn: sqlite3.Connection = None):
+        # Rows added since the last read, by this or another worker process
+        if not self.path:
+            return
+        rows = (conn or self._connect()).execute(
+            "SELECT id, mode, vector, path, label, score, layout FROM fingerprints "
+            "WHERE id > ? ORDER BY id", (self._last_id,)).fetchall()
+        for row_id, mode, blob, path, label, score, layout in rows:
+            if layout == SIGNATURE_LAYOUT:
+                vector = np.frombuffer(blob, dtype=np.float32)
+                self._append(mode, vector, {'path': path, 'label': label, 'score': score})
+            else:
+                self.stale += 1
+            self._last_id = row_id
+
+    def lookup(self, fingerprint: np.ndarray, mode: str):
+        """
+        Nearest stored video classified in the same mode.
+
+        Returns (similarity, entry) when the best match reaches the threshold,
+        otherwise None. entry has 'path', 'label' and 'score'.
+        """
+        with self._lock:
+            self._refresh()
+            shard = self._shards.get(mode)
+            if shard is None or shard.count == 0:
+                return None
+            sim, entry = shard.best(fingerprint)
+            if sim < self.similarity_threshold:
+                return None
+            return sim, dict(entry)
+
+    def add(self, fingerprint: np.ndarray, video_path: str, mode: str, label: str, score):
+        score = None if score is None else float(score)
+        vector = np.ascontiguousarray(fingerprint, dtype=np.float32)
+        with self._lock:
+            if not self.path:
+                self._append(mode, vector, {'path': video_path, 'label': label, 'score': score})
+                return
+            conn = self._connect()
+            with conn:
+                conn.execute(
+                    "INSERT INTO fingerprints (mode, vector, path, label, score, added_at, layout) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (mode, vector.tobytes(), video_path, label, score, time.time(), SIGNATURE_LAYOUT))
+            self._refresh()
+
+    def rebuild(self) -> dict:
+        """
+        Recompute fingerprints stored with an old signature layout.
+
+        Each stale row's video is fingerprinted again, sampling as many frames
+        as its mode's pipeline does, and stored with its label, score and mode
+        as a new row; rows whose video is gone are dropped, since they can
+        never match again.
+        """
+        conn = self._connect()
+        stale = conn.execute(
+            "SELECT id, mode, path, label, score FROM fingerprints "
+            "WHERE layout IS NULL OR layout != ? ORDER BY id", (SIGNATURE_LAYOUT,)).fetchall()
+        rebuilt = dropped = 0
+        for row_id, mode, path, label, score in stale:
+            fingerprint = None
+            if os.path.exists(path):
+                fingerprint = compute_fingerprint(path, sampled=mode_frames(mode))
+            with conn:
+                conn.execute("DELETE FROM fingerprints WHERE id = ?", (row_id,))
+                if fingerprint is None:
+                    dropped += 1
+                    continue
+                conn.execute(
+                    "INSERT INTO fingerprints (mode, vector, path, label, score, added_at, layout) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (mode, np.asarray(fingerprint, dtype=np.float32).tobytes(), path, label, score,
+                     time.time(), SIGNATURE_LAYOUT))
+                rebuilt += 1
+        with self._lock:
+            self.stale = 0
+            self._refresh()
+        return {"rebuilt": rebuilt, "dropped": dropped}
+
+    def record_skip(self):
+        with self._lock:
+            self.skipped += 1
+
+    def record_flag(self):
+        with self._lock:
+            self.flagged += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "indexed": self._count,
+                "modes": len(self._shards),
+                "stale": self.stale,
+                "layout": SIGNATURE_LAYOUT,
+                "skipped": self.skipped,
+                "flagged": self.flagged,
+                "similarity_threshold": self.similarity_threshold,
+            }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Inspect or rebuild a video fingerprint index')
+    parser.add_argument('index', help='Fingerprint index SQLite file')
+    parser.add_argument('command', choices=['stats', 'rebuild'])
+    args = parser.parse_args()
+
+    index = FingerprintIndex(args.index)
+    if args.command == 'rebuild':
+        result = index.rebuild()
+        print(f"Recomputed {result['rebuilt']} fingerprints, dropped {result['dropped']} "
+              f"whose video no longer exists")
+    print(index.stats())
+
+
+if __name__ == '__main__':
+    main()
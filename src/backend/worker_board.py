@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+"""
+Job and in-flight state shared by serve.py's worker processes.
+
+JobRegistry and SingleFlight keep their state in the process that created
+them. Under serve.py's pre-forked workers, DELETE /jobs/{id} then only finds
+jobs running in the worker that happened to accept the DELETE, and two
+identical /predict calls only coalesce if they land on the same worker.
+serve.py creates a WorkerBoard database before forking and points every
+worker at it through SHPD_WORKER_DB; main.py then hands the board to its
+JobRegistry and prediction SingleFlight:
+
+- jobs: every running job with the pid of the worker running it. A cancel
+  for a job in another worker is recorded here, and that worker's registry
+  picks it up within CANCEL_POLL_S and cancels it locally.
+- flights: one 'running' row per prediction key (a partial unique index
+  enforces it). A worker that finds another worker's flight for its key
+  polls the row until the leader publishes the result or the error.
+
+Rows of workers that died are ignored and cleaned up, since serve.py
+replaces crashed workers with new pids. The database is private to one
+serve.py run, so nothing is left over from a previous start.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+from cancellation import NULL_TOKEN
+
+POLL_S = 0.5           # remote followers re-read their leader's flight this often
+FLIGHT_KEEP_S = 300.0  # finished flights kept for followers still polling them
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    job_id        TEXT PRIMARY KEY,
+    pid           INTEGER NOT NULL,
+    filepath      TEXT NOT NULL,
+    started       REAL NOT NULL,
+    cancel_reason TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_pid ON jobs(pid);
+CREATE TABLE IF NOT EXISTS flights (
+    flight_id TEXT PRIMARY KEY,
+    key       TEXT NOT NULL,
+    pid       INTEGER NOT NULL,
+    state     TEXT NOT NULL,   -- running | done | failed
+    result    TEXT,
+    error     TEXT,
+    updated   REAL NOT NULL
+);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_flights_running ON flights(key) WHERE state = 'running';
+"""
+
+
+class FlightFailed(Exception):
+    """The flight being waited on failed, was cancelled or lost its worker."""
+
+
+def _alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class WorkerBoard:
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._local = threading.local()
+        # Short-lived connection: the board is created before serve.py forks
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(SCHEMA)
+        finally:
+            conn.close()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _write(self, fn):
+        """Run fn(conn) in one write transaction."""
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            result = fn(conn)
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+        return result
+
+    # ———————————————————————————— jobs ————————————————————————————
+
+    def add_job(self, job_id: str, filepath: str):
+        """Register a job for this worker; ValueError if a live worker runs that id."""
+        def add(conn):
+            row = conn.execute("SELECT pid FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+            if row is not None:
+                if _alive(row['pid']):
+                    raise ValueError(f"Job {job_id} is already running")
+                conn.execute("DELETE FROM jobs WHERE job_id = ?", (job_id,))
+            conn.execute("INSERT INTO jobs (job_id, pid, filepath, started) VALUES (?, ?, ?, ?)",
+                         (job_id, os.getpid(), filepath, time.time()))
+        self._write(add)
+
+    def remove_job(self, job_id: str):
+        self._write(lambda conn: conn.execute(
+            "DELETE FROM jobs WHERE job_id = ? AND pid = ?", (job_id, os.getpid())))
+
+    def request_cancel(self, job_id: str, reason: str):
+        """Ask the worker running job_id to cancel it; None if no live worker runs it."""
+        def request(conn):
+            row = conn.execute("SELECT * FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+            if row is None or row['cancel_reason'] is not None or not _alive(row['pid']):
+                return None
+            conn.execute("UPDATE jobs SET cancel_reason = ? WHERE job_id = ?", (reason, job_id))
+            return {"job_id": job_id, "filepath": row['filepath'], "worker": row['pid']}
+        return self._write(request)
+
+    def cancel_requests(self) -> list:
+        """(job_id, reason) of this worker's jobs that another worker asked to cancel."""
+        rows = self._connect().execute(
+            "SELECT job_id, cancel_reason FROM jobs WHERE pid = ? AND cancel_reason IS NOT NULL",
+            (os.getpid(),)).fetchall()
+        return [(r['job_id'], r['cancel_reason']) for r in rows]
+
+    def jobs(self) -> list:
+        rows = self._connect().execute("SELECT * FROM jobs ORDER BY started").fetchall()
+        return [dict(r) for r in rows if _alive(r['pid'])]
+
+    # ——————————————————————————— flights ———————————————————————————
+
+    def claim(self, key: str):
+        """
+        Start a flight for key in this worker.
+
+        Returns (True, flight_id) when this worker leads, or (False,
+        flight_id) of another live worker's running flight to wait on.
+        """
+        flight_id = uuid.uuid4().hex
+
+        def claim(conn):
+            now = time.time()
+            conn.execute("DELETE FROM flights WHERE state != 'running' AND updated < ?",
+                         (now - FLIGHT_KEEP_S,))
+            row = conn.execute("SELECT flight_id, pid FROM flights WHERE key = ? AND state = 'running'",
+                               (key,)).fetchone()
+            if row is not None:
+                if _alive(row['pid']):
+                    return False, row['flight_id']
+                conn.execute("UPDATE flights SET state = 'failed', error = 'worker died', updated = ? "
+                             "WHERE flight_id = ?", (now, row['flight_id']))
+            conn.execute("INSERT INTO flights (flight_id, key, pid, state, updated) "
+                         "VALUES (?, ?, ?, 'running', ?)", (flight_id, key, os.getpid(), now))
+            return True, flight_id
+        return self._write(claim)
+
+    def publish(self, flight_id: str, result=None, error: BaseException = None):
+        """Finish a flight this worker leads; result must be JSON-serialisable."""
+        if error is None:
+            state, result, error = 'done', json.dumps(result), None
+        else:
+            state, result, error = 'failed', None, f"{type(error).__name__}: {error}"
+        self._write(lambda conn: conn.execute(
+            "UPDATE flights SET state = ?, result = ?, error = ?, updated = ? WHERE flight_id = ?",
+            (state, result, error, time.time(), flight_id)))
+
+    def wait(self, flight_id: str, cancel=NULL_TOKEN):
+        """Result of another worker's flight; FlightFailed if it did not succeed."""
+        conn = self._connect()
+        while True:
+            cancel.check()
+            row = conn.execute("SELECT * FROM flights WHERE flight_id = ?", (flight_id,)).fetchone()
+            if row is None:
+                raise FlightFailed("flight expired")
+            if row['state'] == 'done':
+                return json.loads(row['result'])
+            if row['state'] == 'failed':
+                raise FlightFailed(row['error'])
+            if not _alive(row['pid']):
+                raise FlightFailed("worker died")
+            time.sleep(POLL_S)
+
+
+def board_from_env():
+    """The board serve.py set up for its workers, or None outside serve.py."""
+    path = os.environ.get('SHPD_WORKER_DB')
+    return WorkerBoard(path) if path else None
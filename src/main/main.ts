@@ -5,6 +5,7 @@ import { ipcMain, dialog } from "electron";
 import fs from "fs";
 import trash from "trash";
 import fetch from "node-fetch";
+import { randomUUID } from "crypto";
 
 
 let mainWindow: Electron.BrowserWindow | null;
@@ -58,7 +59,9 @@ ipcMain.handle("open-file-dialog", async () => {
 app.on("ready", createWindow);
 
 // Quit when all windows are closed.
-app.on("window-all-closed", () => {
+app.on("window-all-closed", async () => {
+  // Nobody will see the result of a prediction still running
+  await cancelProcessing();
   // On OS X it is common for applications and their menu bar
   // to stay active until the user quits explicitly with Cmd + Q
   if (process.platform !== "darwin") {
@@ -93,18 +96,85 @@ ipcMain.on("store-video-paths", (_event, files: string[]) => {
 });
 
 const videosFile = path.join(__dirname, "videos.json");
+const BACKEND_URL = "http://127.0.0.1:8000";
+const PAGE_SIZE = 1000;
+
+type VideoQuery = {
+  search?: string;
+  prediction?: string;
+  tag?: string;
+  limit?: number;
+  offset?: number;
+};
+
+type VideoPage = { items: Video[]; total: number };
+
+async function backend<T>(route: string, body?: unknown): Promise<T> {
+  const res = await fetch(`${BACKEND_URL}${route}`, {
+    method: body === undefined ? "GET" : "POST",
+    headers: { "Content-Type": "application/json" },
+    body: body === undefined ? undefined : JSON.stringify(body),
+  });
+  if (!res.ok) {
+    throw new Error(`${route} failed with status ${res.status}`);
+  }
+  return (await res.json()) as T;
+}
+
+// Results now live in the backend's SQLite store; bring over the legacy
+// videos.json once (the backend remembers which files it has imported).
+let legacyImported = false;
+async function importLegacyVideos() {
+  if (legacyImported) return;
+  await backend("/videos/import", { path: videosFile });
+  legacyImported = true;
+}
+
+async function queryVideos(query: VideoQuery): Promise<VideoPage> {
+  await importLegacyVideos();
+  const params = new URLSearchParams();
+  Object.entries(query).forEach(([key, value]) => {
+    if (value !== undefined && value !== "") params.set(key, String(value));
+  });
+  return backend<VideoPage>(`/videos?${params.toString()}`);
+}
+
+async function fetchAllVideos(query: VideoQuery = {}): Promise<Video[]> {
+  const videos: Video[] = [];
+  for (let offset = 0; ; offset += PAGE_SIZE) {
+    const page = await queryVideos({ ...query, limit: PAGE_SIZE, offset });
+    videos.push(...page.items);
+    if (videos.length >= page.total || page.items.length === 0) break;
+  }
+  return videos;
+}
 
-ipcMain.handle("get-all-videos", () => {
-  if (!fs.existsSync(videosFile)) return [];
-  const json = fs.readFileSync(videosFile, "utf-8");
-  return JSON.parse(json);
+ipcMain.handle("get-all-videos", async () => {
+  try {
+    return await fetchAllVideos();
+  } catch (err) {
+    console.error("Failed to load videos from backend:", err);
+    return [];
+  }
+});
+
+ipcMain.handle("query-videos", async (_event, query: VideoQuery) => {
+  try {
+    return await queryVideos(query);
+  } catch (err) {
+    console.error("Failed to query videos from backend:", err);
+    return { items: [], total: 0 };
+  }
 });
 
-ipcMain.on("update-videos-json", (_event, updatedVideos: Video[]) => {
-  fs.writeFileSync(
-    path.join(__dirname, "videos.json"),
-    JSON.stringify(updatedVideos, null, 2)
-  );
+ipcMain.handle("update-video-tags", async (_event, ids: string[], tag: string) => {
+  try {
+    await backend("/videos/tags", { tag, ids });
+    return true;
+  } catch (err) {
+    console.error("Failed to update tags:", err);
+    return false;
+  }
 });
 
 ipcMain.handle("delete-video", async (_event, videoPath: string) => {
@@ -118,13 +188,8 @@ ipcMain.handle("delete-video", async (_event, videoPath: string) => {
 
     await trash([videoPath]);
 
-    // Remove from videos.json
-    const videosFile = path.join(__dirname, "videos.json");
-    if (fs.existsSync(videosFile)) {
-      const videos = JSON.parse(fs.readFileSync(videosFile, "utf-8"));
-      const updated = videos.filter((v: any) => v.filename !== videoPath);
-      fs.writeFileSync(videosFile, JSON.stringify(updated, null, 2));
-    }
+    // Remove from the results store
+    await backend("/videos/delete", { filenames: [videoPath] });
 
     return true;
   } catch (err) {
@@ -141,17 +206,6 @@ ipcMain.handle("get-video-paths", () => {
   return JSON.parse(fs.readFileSync(pathFile, "utf-8"));
 });
 
-// Append new videos
-ipcMain.on("append-videos", (_event, newVideos: any[]) => {
-  const videosFile = path.join(__dirname, "videos.json");
-  let existing = [];
-  if (fs.existsSync(videosFile)) {
-    existing = JSON.parse(fs.readFileSync(videosFile, "utf-8"));
-  }
-  const combined = [...existing, ...newVideos];
-  fs.writeFileSync(videosFile, JSON.stringify(combined, null, 2));
-});
-
 
 let processingQueue: { filename: string; status: string }[] = [];
 
@@ -165,13 +219,36 @@ ipcMain.on("set-imagebind-enabled", (_event, enabled: boolean) => {
 });
 
 
+// Job id of the /predict call in flight, so it can be cancelled
+let currentJobId: string | null = null;
+let cancelRequested = false;
+
+async function cancelProcessing(): Promise<void> {
+  cancelRequested = true;
+  processingQueue = [];
+  const jobId = currentJobId;
+  if (!jobId) return;
+  try {
+    await fetch(`${BACKEND_URL}/jobs/${jobId}`, { method: "DELETE" });
+  } catch (err) {
+    console.error(`Failed to cancel job ${jobId}:`, err);
+  }
+}
+
+ipcMain.handle("cancel-processing", async () => {
+  await cancelProcessing();
+  mainWindow?.webContents.send("processing-queue-updated", processingQueue);
+});
+
 ipcMain.on("start-processing", async (_event, unprocessed: string[]) => {
+  cancelRequested = false;
   processingQueue = unprocessed.map((filename, i) => ({
     filename,
     status: i === 0 ? "Currently Processing" : "Waiting to Process",
   }));
 
   for (let i = 0; i < processingQueue.length; i++) {
+    if (cancelRequested) break;
     const filename = processingQueue[i].filename;
 
     // Update current video's status
@@ -181,35 +258,26 @@ ipcMain.on("start-processing", async (_event, unprocessed: string[]) => {
     mainWindow?.webContents.send("processing-queue-updated", processingQueue);
 
     try {
-      const res = await fetch("http://127.0.0.1:8000/predict", {
+      currentJobId = randomUUID();
+      const res = await fetch(`${BACKEND_URL}/predict`, {
         method: "POST",
         headers: { "Content-Type": "application/json" },
         body: JSON.stringify({
           filepath: filename,
           use_imagebind: useImagebind,
+          job_id: currentJobId,
         }),
       });
 
-      const data = (await res.json()) as { prediction: string; score: number };
-      const prediction = data.prediction || "Other/Unsure";
-      const tag = prediction === "Car Check|Confident" ? "Delete" : "Pending";
-
-      let videos = [];
-      const videoPath = path.join(__dirname, "videos.json");
-      if (fs.existsSync(videoPath)) {
-        videos = JSON.parse(fs.readFileSync(videoPath, "utf-8"));
+      // The backend stores the result (and its tag) in the results store
+      const data = (await res.json()) as { prediction: string; score: number; tag: string };
+      if (!res.ok) {
+        console.error(`Prediction failed for ${filename}:`, data);
       }
-
-      videos.push({
-        id: `vid_${Date.now()}`,
-        filename,
-        prediction,
-        tag,
-      });
-
-      fs.writeFileSync(videoPath, JSON.stringify(videos, null, 2));
     } catch (err) {
       console.error(`Failed to process ${filename}:`, err);
+    } finally {
+      currentJobId = null;
     }
 
     mainWindow?.webContents.send("processing-queue-updated", processingQueue);
@@ -224,29 +292,32 @@ ipcMain.on("start-processing", async (_event, unprocessed: string[]) => {
 
 // ✅ NEW: delete-tagged-videos handler
 ipcMain.handle("delete-tagged-videos", async () => {
-  const videosFile = path.join(__dirname, "videos.json");
-
-  if (!fs.existsSync(videosFile)) return;
-
-  const allVideos = JSON.parse(fs.readFileSync(videosFile, "utf-8")) as Video[];
+  let tagged: Video[];
+  try {
+    tagged = await fetchAllVideos({ tag: "Delete" });
+  } catch (err) {
+    console.error("Failed to load tagged videos:", err);
+    return;
+  }
 
-  const keptVideos: Video[] = [];
+  const removed: string[] = [];
 
-  for (const video of allVideos) {
-    if (video.tag.toLowerCase() === "delete") {
-      try {
-        if (fs.existsSync(video.filename)) {
-          await trash([video.filename]); // move to recycling bin
-        } else {
-          console.warn("File not found for deletion:", video.filename);
-        }
-      } catch (err) {
-        console.error("Failed to trash:", video.filename, err);
+  for (const video of tagged) {
+    try {
+      if (fs.existsSync(video.filename)) {
+        await trash([video.filename]); // move to recycling bin
+      } else {
+        console.warn("File not found for deletion:", video.filename);
       }
-    } else {
-      keptVideos.push(video);
+      removed.push(video.filename);
+    } catch (err) {
+      console.error("Failed to trash:", video.filename, err);
     }
   }
 
-  fs.writeFileSync(videosFile, JSON.stringify(keptVideos, null, 2));
-});
\ No newline at end of file
+  try {
+    await backend("/videos/delete", { filenames: removed });
+  } catch (err) {
+    console.error("Failed to remove deleted videos from the backend:", err);
+  }
+});
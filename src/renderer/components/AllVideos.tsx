@@ -36,7 +36,7 @@ type Video = {
 
 export default function AllVideos(): JSX.Element {
   const [videos, setVideos] = React.useState<Video[]>([]);
-  const [filtered, setFiltered] = React.useState<Video[]>([]);
+  const [total, setTotal] = React.useState(0);
   const [search, setSearch] = React.useState("");
   const [filterTag, setFilterTag] = React.useState("All");
   const [page, setPage] = React.useState(0);
@@ -48,37 +48,33 @@ export default function AllVideos(): JSX.Element {
   const [smartDeleteOpen, setSmartDeleteOpen] = React.useState(false);
 
   const rowsPerPage = 20;
+  // Only the latest query's response is shown; earlier ones may resolve later
+  const latestQuery = React.useRef(0);
 
   React.useEffect(() => {
     loadVideos();
-  }, []);
-
-  React.useEffect(() => {
-    applyFilters();
-  }, [videos, search, filterTag]);
+  }, [search, filterTag, page]);
 
+  // Filtering and paging happen in the backend's results store
   const loadVideos = () => {
-    ipcRenderer.invoke("get-all-videos").then((data: Video[]) => {
-      setVideos(data);
-    });
-  };
-
-  const applyFilters = () => {
-    const lowerSearch = search.toLowerCase();
-    const result = videos.filter(
-      (v) =>
-        (filterTag === "All" || v.tag === filterTag) &&
-        (v.id.toLowerCase().includes(lowerSearch) ||
-          v.filename.toLowerCase().includes(lowerSearch) ||
-          v.prediction.toLowerCase().includes(lowerSearch) ||
-          v.tag.toLowerCase().includes(lowerSearch))
-    );
-    setFiltered(result);
-    setPage(0);
+    const query = ++latestQuery.current;
+    ipcRenderer
+      .invoke("query-videos", {
+        search,
+        tag: filterTag === "All" ? undefined : filterTag,
+        limit: rowsPerPage,
+        offset: page * rowsPerPage,
+      })
+      .then((data: { items: Video[]; total: number }) => {
+        if (query !== latestQuery.current) return;
+        setVideos(data.items);
+        setTotal(data.total);
+      });
   };
 
   const handleSearch = (e: React.ChangeEvent<HTMLInputElement>) => {
     setSearch(e.target.value);
+    setPage(0);
   };
 
   const handleChangePage = (_: unknown, newPage: number) => {
@@ -245,6 +241,7 @@ export default function AllVideos(): JSX.Element {
             selected={filterTag === option}
             onClick={() => {
               setFilterTag(option);
+              setPage(0);
               setFilterAnchorEl(null);
             }}
           >
@@ -265,51 +262,49 @@ export default function AllVideos(): JSX.Element {
             </TableRow>
           </TableHead>
           <TableBody>
-            {filtered
-              .slice(page * rowsPerPage, page * rowsPerPage + rowsPerPage)
-              .map((video) => {
-                const title = path.basename(video.filename);
-                const isExpanded = expandedRows.has(video.id);
-                return (
-                  <TableRow
-                    key={video.id}
-                    hover
-                    sx={{ cursor: "pointer" }}
-                    onClick={() => toggleExpandRow(video.id)}
+            {videos.map((video) => {
+              const title = path.basename(video.filename);
+              const isExpanded = expandedRows.has(video.id);
+              return (
+                <TableRow
+                  key={video.id}
+                  hover
+                  sx={{ cursor: "pointer" }}
+                  onClick={() => toggleExpandRow(video.id)}
+                >
+                  <TableCell sx={{ color: "gray", padding: "6px 16px" }}>{video.id}</TableCell>
+                  <TableCell
+                    sx={{
+                      fontWeight: "normal",
+                      whiteSpace: isExpanded ? "normal" : "nowrap",
+                      overflow: "hidden",
+                      textOverflow: "ellipsis",
+                      padding: "6px 16px",
+                    }}
                   >
-                    <TableCell sx={{ color: "gray", padding: "6px 16px" }}>{video.id}</TableCell>
-                    <TableCell
-                      sx={{
-                        fontWeight: "normal",
-                        whiteSpace: isExpanded ? "normal" : "nowrap",
-                        overflow: "hidden",
-                        textOverflow: "ellipsis",
-                        padding: "6px 16px",
-                      }}
-                    >
-                      {title}
-                    </TableCell>
-                    <TableCell sx={{ fontWeight: "bold", padding: "6px 16px" }}>
-                      {renderPredictionChip(video.prediction)}
-                    </TableCell>
-                    <TableCell sx={{ fontWeight: "bold", padding: "6px 16px" }}>
-                      {renderTagChip(video.tag)}
-                    </TableCell>
-                    <TableCell align="right" sx={{ padding: "6px 16px" }}>
-                      <IconButton onClick={(e) => handleMenuClick(e, video)}>
-                        <MoreVertIcon />
-                      </IconButton>
-                    </TableCell>
-                  </TableRow>
-                );
-              })}
+                    {title}
+                  </TableCell>
+                  <TableCell sx={{ fontWeight: "bold", padding: "6px 16px" }}>
+                    {renderPredictionChip(video.prediction)}
+                  </TableCell>
+                  <TableCell sx={{ fontWeight: "bold", padding: "6px 16px" }}>
+                    {renderTagChip(video.tag)}
+                  </TableCell>
+                  <TableCell align="right" sx={{ padding: "6px 16px" }}>
+                    <IconButton onClick={(e) => handleMenuClick(e, video)}>
+                      <MoreVertIcon />
+                    </IconButton>
+                  </TableCell>
+                </TableRow>
+              );
+            })}
           </TableBody>
         </Table>
       </TableContainer>
 
       <TablePagination
         component="div"
-        count={filtered.length}
+        count={total}
         page={page}
         onPageChange={handleChangePage}
         rowsPerPage={rowsPerPage}
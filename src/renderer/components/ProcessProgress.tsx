@@ -1,5 +1,5 @@
 import * as React from "react";
-import { Box, Typography, Paper, Table, TableBody, TableCell, TableContainer, TableHead, TableRow } from "@mui/material";
+import { Box, Button, Typography, Paper, Table, TableBody, TableCell, TableContainer, TableHead, TableRow } from "@mui/material";
 const { ipcRenderer } = window.require("electron");
 const path = window.require("path");
 
@@ -16,6 +16,11 @@ export default function ProcessProgress(): JSX.Element {
     return () => clearInterval(interval);
   }, []);
 
+  const handleCancel = async () => {
+    await ipcRenderer.invoke("cancel-processing");
+    setProcessing([]);
+  };
+
   return (
     <Box>
       <Box sx={{ width: "80%", margin: "0 auto" }}>
@@ -23,9 +28,14 @@ export default function ProcessProgress(): JSX.Element {
           Process Progress
         </Typography>
 
-        <Typography variant="h6" gutterBottom sx={{ mb: 2 }}>
-          Currently Processing Videos
-        </Typography>
+        <Box sx={{ display: "flex", justifyContent: "space-between", alignItems: "center", mb: 2 }}>
+          <Typography variant="h6">Currently Processing Videos</Typography>
+          {processing.length > 0 && (
+            <Button variant="outlined" color="error" onClick={handleCancel}>
+              Cancel Processing
+            </Button>
+          )}
+        </Box>
 
         <TableContainer component={Paper}>
           <Table size="small">
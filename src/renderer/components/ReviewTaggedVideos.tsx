@@ -34,9 +34,10 @@ export default function ReviewTaggedVideos(): JSX.Element {
   const handleTag = (tag: string) => {
     const updatedVideos = [...videos];
     const currentTag = updatedVideos[selectedIndex].tag;
-    updatedVideos[selectedIndex].tag = currentTag === tag ? "Pending" : tag;
+    const newTag = currentTag.toLowerCase() === tag.toLowerCase() ? "Pending" : tag;
+    updatedVideos[selectedIndex].tag = newTag;
     setVideos(updatedVideos);
-    ipcRenderer.send("update-videos-json", updatedVideos);
+    ipcRenderer.invoke("update-video-tags", [updatedVideos[selectedIndex].id], newTag);
   };
 
   const handleChangePage = (_: unknown, newPage: number) => {
@@ -134,7 +135,7 @@ export default function ReviewTaggedVideos(): JSX.Element {
 
           <Box sx={{ display: "flex", flexDirection: "column", gap: 2, mt: 0.5 }}> {/* Align with top of video */}
             {["Important", "Delete"].map((tag) => {
-              const selected = currentVideo.tag === tag;
+              const selected = currentVideo.tag.toLowerCase() === tag.toLowerCase();
               const label = tag === "Important" ? "Mark Important" : "Mark for Deletion";
               return (
                 <Box
@@ -18,12 +18,22 @@ const pythonExecutable = isWindows
 // Change to src directory and start the backend
 process.chdir(path.join(__dirname, 'src'));
 
-const args = [
-  '-m', 'uvicorn', 
-  'backend.main:app', 
-  '--host', '127.0.0.1', 
-  '--port', '8000'
-];
+// SHPD_WORKERS > 1 serves from several processes that share the loaded
+// models (backend/serve.py forks them, so it is not available on Windows)
+const workers = parseInt(process.env.SHPD_WORKERS || '1', 10);
+const args = workers > 1 && !isWindows
+  ? [
+    'backend/serve.py',
+    '--host', '127.0.0.1',
+    '--port', '8000',
+    '--workers', String(workers)
+  ]
+  : [
+    '-m', 'uvicorn', 
+    'backend.main:app', 
+    '--host', '127.0.0.1', 
+    '--port', '8000'
+  ];
 
 console.log(`Starting backend with: ${pythonExecutable} ${args.join(' ')}`);
 